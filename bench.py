@@ -0,0 +1,825 @@
+import os
+import sys
+import json
+import argparse
+import time
+import random
+import itertools
+import tempfile
+import threading
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import tracemalloc
+from datetime import datetime, timedelta
+from copy import deepcopy
+from typing import List
+
+from pysgdb import DB, Client, KeyMap, serve
+
+
+# benchmark helpers
+def _showing_rows(n: int) -> list:
+    start = datetime(2000, 1, 1)
+    return [{"date": start + timedelta(hours=i), "theater": f"Theater {i % 20}", "seats": 100 + i % 50, "price": 9.5} for i in range(n)]
+
+
+# the schema of the README, filled by generate()
+SCHEMA = {
+    "nodes": {
+        "Person": {"name": "str"},
+        "Movie": {"title": "str"},
+        "Play": {"title": "str"},
+        "Showing": {"date": "datetime", "theater": "str"},
+        "Ticket": {"seat": "str"}
+    },
+    "links": {
+        ("Person", "has", "Ticket"),
+        ("Ticket", "for", "Showing"),
+        ("Showing", "of", "Movie"),
+        ("Showing", "of", "Play")
+    }
+}
+
+
+def _power_law_choices(rng: random.Random, population: list, k: int, alpha: float) -> list:
+    # k picks from population, the i-th element with weight 1 / (i + 1) ** alpha, so a few hubs get most picks
+    weights = itertools.accumulate(1 / (rank + 1) ** alpha for rank in range(len(population)))
+    return rng.choices(population, cum_weights=list(weights), k=k)
+
+
+def generate(persons: int = 10_000, seed: int = 0, alpha: float = 1.2, ids: str = "int") -> dict:
+    # Seeded synthetic graph over SCHEMA: tickets per person follow a pareto distribution, showings and the
+    # movies/plays they are of are picked with power-law popularity. Returns the rows and links to write.
+    rng = random.Random(seed)
+    movies, plays, showings = max(1, persons // 100), max(1, persons // 200), max(1, persons // 10)
+    tickets_per_person = [min(int(rng.paretovariate(alpha)), 1000) for _ in range(persons)]
+    tickets = sum(tickets_per_person)
+    start = datetime(2000, 1, 1)
+    return {
+        "ids": ids,
+        "rows": {
+            "Person": [{"name": f"Person {i}"} for i in range(persons)],
+            "Movie": [{"title": f"Movie {i}"} for i in range(movies)],
+            "Play": [{"title": f"Play {i}"} for i in range(plays)],
+            "Showing": [{"date": start + timedelta(hours=i), "theater": f"Theater {i % 20}"} for i in range(showings)],
+            "Ticket": [{"seat": f"A{i}"} for i in range(tickets)]
+        },
+        # per link: positions into the rows of both node types
+        "links": {
+            ("Person", "has", "Ticket"): ([person for person, count in enumerate(tickets_per_person) for _ in range(count)], list(range(tickets))),
+            ("Ticket", "for", "Showing"): (list(range(tickets)), _power_law_choices(rng, list(range(showings)), tickets, alpha)),
+            ("Showing", "of", "Movie"): (list(range(0, showings, 2)), _power_law_choices(rng, list(range(movies)), len(range(0, showings, 2)), alpha)),
+            ("Showing", "of", "Play"): (list(range(1, showings, 2)), _power_law_choices(rng, list(range(plays)), len(range(1, showings, 2)), alpha))
+        }
+    }
+
+
+def _measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def bench_memory(n: int = 200_000):
+    # bytes held by n Showing nodes in each storage mode
+    schema = {
+        "nodes": {"Showing": {"date": "datetime", "theater": "str", "seats": "int", "price": "float"}},
+        "links": set()
+    }
+    results = {}
+    for storage in ("dict", "columnar", "record"):
+        def build():
+            db = DB(storage=storage)
+            db.migrate(schema)
+            db.create("Showing", _showing_rows(n))
+            return db
+        _db, current, elapsed = _measure(build)
+        results[storage] = {"bytes": current, "bytes_per_node": current / n, "seconds": elapsed}
+    return results
+
+
+def bench_ids(n: int = 20_000, fan_out: int = 10):
+    # bulk create plus fan-out linking with string ids vs dense int ids: int ids link faster, the size stays about the same
+    schema = {
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}},
+        "links": {("Person", "has", "Ticket")}
+    }
+    results = {}
+    for ids in ("str", "int"):
+        def build():
+            db = DB(ids=ids)
+            db.migrate(schema)
+            person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(n)])
+            ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(n * fan_out)])
+            for i, person_id in enumerate(person_ids):
+                db.link("Person", [person_id], "has", "Ticket", ticket_ids[i * fan_out:(i + 1) * fan_out])
+            return db
+        _db, current, elapsed = _measure(build)
+        results[ids] = {"bytes": current, "seconds": elapsed}
+    return results
+
+
+def bench_traverse(n: int = 20_000, fan_out: int = 10, repeat: int = 20):
+    # fan-out traverse over every source id, with and without freeze(), and frozen with a link before each traverse
+    db = DB(ids="int")
+    db.migrate({
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}},
+        "links": {("Person", "has", "Ticket")}
+    })
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(n)])
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(n * fan_out)])
+    for i, person_id in enumerate(person_ids):
+        db.link("Person", [person_id], "has", "Ticket", ticket_ids[i * fan_out:(i + 1) * fan_out])
+
+    results = {}
+    for mode in ("dict", "frozen"):
+        if mode == "frozen":
+            db.freeze()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            db.traverse("Person", person_ids, "->", "has", "Ticket")
+        results[mode] = {"seconds_per_traverse": (time.perf_counter() - started) / repeat}
+
+    # a write between reads, as in a read-mostly workload
+    started = time.perf_counter()
+    for i in range(repeat):
+        db.link("Person", [person_ids[i]], "has", "Ticket", [ticket_ids[-1 - i]])
+        db.traverse("Person", person_ids[:100], "->", "has", "Ticket")
+    results["frozen_write"] = {"seconds_per_traverse": (time.perf_counter() - started) / repeat}
+    return results
+
+
+def bench_find(n: int = 100_000, repeat: int = 50):
+    # range lookups on Showing.date through a sorted index vs filtering get(None, ...) in python
+    schema = {
+        "nodes": {"Showing": {"date": "datetime", "theater": "str", "seats": "int", "price": "float"}},
+        "links": set(),
+        "indexes": {"Showing": {"date": "sorted"}}
+    }
+    db = DB()
+    db.migrate(schema)
+    db.create("Showing", _showing_rows(n))
+    low, high = datetime(2001, 1, 1), datetime(2001, 2, 1)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        [node_id for node_id, date in db.get("Showing", None, ["id", "date"]) if low <= date < high]
+    scan = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        db.find("Showing", {"date": slice(low, high)})
+    indexed = (time.perf_counter() - started) / repeat
+    return {"scan": {"seconds_per_query": scan}, "index": {"seconds_per_query": indexed}}
+
+
+def bench_load(n: int = 100_000, fan_out: int = 5):
+    # cold start: pickle load vs segmented load followed by one get on the smallest node type
+    db = DB(storage="columnar", ids="int")
+    db.migrate({
+        "nodes": {"Person": {"name": "str"}, "Showing": {"date": "datetime", "theater": "str", "seats": "int", "price": "float"}},
+        "links": {("Person", "has", "Showing")}
+    })
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(100)])
+    showing_ids = db.create("Showing", _showing_rows(n))
+    for i, person_id in enumerate(person_ids):
+        db.link("Person", [person_id], "has", "Showing", showing_ids[i * fan_out:(i + 1) * fan_out])
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        db.save(folder, "db.pickle")
+        db.save_segments(folder, "db.segments")
+        for mode in ("pickle", "segments"):
+            loaded = DB()
+            started = time.perf_counter()
+            if mode == "pickle":
+                loaded.load(folder, "db.pickle")
+            else:
+                loaded.load_segments(folder, "db.segments")
+            loaded.get("Person", None, ["name"])
+            results[mode] = {"seconds": time.perf_counter() - started, "file_bytes": os.path.getsize(os.path.join(folder, "db." + mode))}
+            loaded = None
+    return results
+
+
+def bench_link(n: int = 20_000, fan_out: int = 10):
+    # loading an edge list: one link() call per pair vs one link_many() call
+    schema = {
+        "nodes": {"Ticket": {"seat": "str"}, "Showing": {"theater": "str"}},
+        "links": {("Ticket", "for", "Showing")}
+    }
+    results = {}
+    for mode in ("link", "link_many"):
+        db = DB(ids="int")
+        db.migrate(schema)
+        showing_ids = db.create("Showing", [{"theater": f"Theater {i}"} for i in range(n)])
+        ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(n * fan_out)])
+        pairs = [(ticket_id, showing_ids[i // fan_out]) for i, ticket_id in enumerate(ticket_ids)]
+        started = time.perf_counter()
+        if mode == "link":
+            for ticket_id, showing_id in pairs:
+                db.link("Ticket", [ticket_id], "for", "Showing", [showing_id])
+        else:
+            db.link_many("Ticket", pairs, "for", "Showing")
+        elapsed = time.perf_counter() - started
+        results[mode] = {"seconds": elapsed, "links_per_second": len(pairs) / elapsed}
+    return results
+
+
+def bench_delete(hubs: int = 20, fan_in: int = 20_000):
+    # deleting hub Showings, each the target of fan_in Tickets
+    db = DB(ids="int")
+    db.migrate({
+        "nodes": {"Ticket": {"seat": "str"}, "Showing": {"theater": "str"}},
+        "links": {("Ticket", "for", "Showing")}
+    })
+    showing_ids = db.create("Showing", [{"theater": f"Theater {i}"} for i in range(hubs)])
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(hubs * fan_in)])
+    db.link_many("Ticket", ticket_ids, "for", "Showing", [showing_ids[i // fan_in] for i in range(len(ticket_ids))])
+
+    started = time.perf_counter()
+    for showing_id in showing_ids[:hubs // 2]:
+        db.delete("Showing", [showing_id])
+    one_by_one = time.perf_counter() - started
+
+    started = time.perf_counter()
+    db.delete("Showing", showing_ids[hubs // 2:])
+    bulk = time.perf_counter() - started
+    return {"one_by_one": {"seconds_per_hub": one_by_one / (hubs // 2)}, "bulk": {"seconds_per_hub": bulk / (hubs - hubs // 2)}}
+
+
+def bench_cache(n: int = 2_000, fan_out: int = 10, repeat: int = 20_000):
+    # the same small traverse repeated between rare writes, with and without the traversal cache
+    db = DB(ids="int")
+    db.migrate({
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}},
+        "links": {("Person", "has", "Ticket")}
+    })
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(n)])
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(n * fan_out)])
+    db.link_many("Person", [person_ids[i // fan_out] for i in range(len(ticket_ids))], "has", "Ticket", ticket_ids)
+    queries = [person_ids[i:i + 50] for i in range(0, 500, 50)]
+
+    results = {}
+    for mode in ("uncached", "cached"):
+        if mode == "cached":
+            db.enable_cache()
+        started = time.perf_counter()
+        for i in range(repeat):
+            db.traverse("Person", queries[i % len(queries)], "->", "has", "Ticket")
+        results[mode] = {"seconds_per_traverse": (time.perf_counter() - started) / repeat}
+    results["cached"].update(db.cache_stats())
+    return results
+
+
+def bench_transaction(n: int = 2_000, fan_out: int = 5):
+    # a journaled ingest of single-row create and link calls, one by one vs inside one transaction
+    schema = {
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}},
+        "links": {("Person", "has", "Ticket")}
+    }
+    results = {}
+    for mode in ("calls", "transaction"):
+        db = DB(ids="int")
+        db.migrate(schema)
+        def ingest():
+            for i in range(n):
+                person_id = db.create("Person", [{"name": f"Person {i}"}])[0]
+                ticket_ids = db.create("Ticket", [{"seat": f"A{i}.{j}"} for j in range(fan_out)])
+                db.link("Person", [person_id], "has", "Ticket", ticket_ids)
+        with tempfile.TemporaryDirectory() as folder:
+            db.open_journal(folder, "db")
+            started = time.perf_counter()
+            if mode == "calls":
+                ingest()
+            else:
+                with db.transaction():
+                    ingest()
+            elapsed = time.perf_counter() - started
+            db.close_journal()
+        results[mode] = {"seconds": elapsed, "operations_per_second": 3 * n / elapsed}
+    return results
+
+
+def bench_snapshots(n: int = 20_000, readers: int = 8, seconds: float = 2.0):
+    # reader threads scanning Showings while one writer creates and links Tickets, everything behind one
+    # global lock vs readers on snapshots. Under the GIL the total work stays about the same, what changes
+    # is how long a write waits behind the scans
+    results = {}
+    for mode in ("lock", "snapshots"):
+        db = DB(ids="int")
+        db.migrate({
+            "nodes": {"Ticket": {"seat": "str"}, "Showing": {"date": "datetime", "theater": "str", "seats": "int", "price": "float"}},
+            "links": {("Ticket", "for", "Showing")}
+        })
+        showing_ids = db.create("Showing", _showing_rows(n))
+        lock = threading.Lock()
+        if mode == "snapshots":
+            db.enable_snapshots()
+        stop = threading.Event()
+        reads, write_latencies = [], []
+
+        def read():
+            count = 0
+            while not stop.is_set():
+                if mode == "lock":
+                    with lock:
+                        db.get("Showing", None, ["seats"])
+                else:
+                    db.snapshot().get("Showing", None, ["seats"])
+                count += 1
+            reads.append(count)
+
+        def write():
+            while not stop.is_set():
+                started = time.perf_counter()
+                with lock if mode == "lock" else db.write_lock:
+                    ticket_id = db.create("Ticket", [{"seat": f"A{len(write_latencies)}"}])[0]
+                    db.link("Ticket", [ticket_id], "for", "Showing", [showing_ids[len(write_latencies) % n]])
+                write_latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        write_latencies.sort()
+        results[mode] = {
+            "reads_per_second": sum(reads) / seconds,
+            "writes_per_second": len(write_latencies) / seconds,
+            "write_p99_seconds": write_latencies[int(len(write_latencies) * 0.99)],
+        }
+    return results
+
+
+_replica = None
+
+
+def _attach_replica(name: str):
+    global _replica
+    _replica = DB()
+    _replica.attach_shared(name)
+
+
+def _replica_task(person_ids: list) -> int:
+    return len(_replica.traverse("Person", person_ids, "->", "has", "Ticket"))
+
+
+def bench_replicas(n: int = 50_000, fan_out: int = 10, tasks: int = 400, workers: int = 4):
+    # traverse batches spread over a thread pool sharing one database vs a process pool of shared memory replicas
+    db = DB(ids="int")
+    db.migrate({
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}},
+        "links": {("Person", "has", "Ticket")}
+    })
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(n)])
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(n * fan_out)])
+    db.link_many("Person", [person_ids[i // fan_out] for i in range(len(ticket_ids))], "has", "Ticket", ticket_ids)
+    db.freeze()
+    batches = [person_ids[i * 1000 % n:i * 1000 % n + 1000] for i in range(tasks)]
+
+    results = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(db.traverse, *zip(*[("Person", batch, "->", "has", "Ticket") for batch in batches])))
+    results["threads"] = {"seconds": time.perf_counter() - started}
+
+    name = f"pysgdb_bench_{os.getpid()}"
+    try:
+        started = time.perf_counter()
+        db.publish_shared(name)
+        published = time.perf_counter() - started
+        started = time.perf_counter()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=_attach_replica, initargs=(name,)) as pool:
+            list(pool.map(_replica_task, batches))
+        results["replicas"] = {"seconds": time.perf_counter() - started, "publish_seconds": published, "workers": workers, "cpus": os.cpu_count()}
+    finally:
+        db.close_shared()
+    return results
+
+
+def bench_server(n: int = 2_000, fan_out: int = 10, requests: int = 5_000, batch: int = 100):
+    # small traverses in process vs through a local server: one per round trip, batched, and pipelined
+    db = DB(ids="int")
+    db.migrate({
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}},
+        "links": {("Person", "has", "Ticket")}
+    })
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(n)])
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(n * fan_out)])
+    db.link_many("Person", [person_ids[i // fan_out] for i in range(len(ticket_ids))], "has", "Ticket", ticket_ids)
+    ops = [("traverse", ("Person", [person_ids[i % n]], "->", "has", "Ticket")) for i in range(requests)]
+
+    results = {}
+    started = time.perf_counter()
+    for _, args in ops:
+        db.traverse(*args)
+    results["in_process"] = {"ops_per_second": requests / (time.perf_counter() - started)}
+
+    with tempfile.TemporaryDirectory() as folder:
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(serve(db, path=os.path.join(folder, "db.sock")))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        client = Client(path=os.path.join(folder, "db.sock"))
+        batches = [ops[i:i + batch] for i in range(0, requests, batch)]
+        for mode, run in [
+            ("round_trips", lambda: [client.batch([op]) for op in ops]),
+            ("batched", lambda: [client.batch(ops_batch) for ops_batch in batches]),
+            ("pipelined", lambda: client.pipeline([[op] for op in ops])),
+        ]:
+            started = time.perf_counter()
+            run()
+            results[mode] = {"ops_per_second": requests / (time.perf_counter() - started)}
+        client.close()
+        server.close()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+    return results
+
+
+def bench_planner(persons: int = 20_000, tickets_per_person: int = 5, showings: int = 200, repeat: int = 20):
+    # the Persons holding tickets for one Showing, walking every Person forward vs the plan picked from stats()
+    db = DB(ids="int")
+    db.migrate({
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}, "Showing": {"theater": "str"}},
+        "links": {("Person", "has", "Ticket"), ("Ticket", "for", "Showing")}
+    })
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(persons)])
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(persons * tickets_per_person)])
+    showing_ids = db.create("Showing", [{"theater": f"Theater {i}"} for i in range(showings)])
+    db.link_many("Person", [person_ids[i // tickets_per_person] for i in range(len(ticket_ids))], "has", "Ticket", ticket_ids)
+    db.link_many("Ticket", ticket_ids, "for", "Showing", [showing_ids[i * 7919 % showings] for i in range(len(ticket_ids))])
+    query = "Person->has:Ticket->for:Showing"
+    showing_id = showing_ids[0]
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        forward = {person_id for person_id, end_id in db.path(query, None, pairs=True) if end_id == showing_id}
+    forward_seconds = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        planned = {person_id for person_id, _ in db.path(query, None, pairs=True, end_ids=[showing_id])}
+    planned_seconds = (time.perf_counter() - started) / repeat
+    assert planned == forward
+    return {"forward": {"seconds_per_query": forward_seconds}, "planned": {"seconds_per_query": planned_seconds, "plan": db.explain(query, None, [showing_id])["plan"]}}
+
+
+def bench_counts(persons: int = 20_000, tickets_per_person: int = 5, showings: int = 200, repeat: int = 5):
+    # tickets per showing: len(traverse()) per showing id vs one count_by_neighbor() call
+    db = DB(ids="int")
+    db.migrate({
+        "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}, "Showing": {"theater": "str"}},
+        "links": {("Person", "has", "Ticket"), ("Ticket", "for", "Showing")}
+    })
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(persons * tickets_per_person)])
+    showing_ids = db.create("Showing", [{"theater": f"Theater {i}"} for i in range(showings)])
+    db.link_many("Ticket", ticket_ids, "for", "Showing", [showing_ids[i * 7919 % showings] for i in range(len(ticket_ids))])
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        per_id = {showing_id: len(db.traverse("Showing", [showing_id], "<-", "for", "Ticket")) for showing_id in showing_ids}
+    per_id_seconds = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        counted = db.count_by_neighbor("Ticket", None, "->", "for", "Showing")
+    counted_seconds = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        degrees = db.degree("Showing", showing_ids, "<-", "for", "Ticket")
+    degree_seconds = (time.perf_counter() - started) / repeat
+    assert counted == per_id and degrees == [per_id[showing_id] for showing_id in showing_ids]
+    return {"traverse": {"seconds": per_id_seconds}, "count_by_neighbor": {"seconds": counted_seconds}, "degree": {"seconds": degree_seconds}}
+
+
+def bench_algorithms(persons: int = 200_000, links_per_person: int = 5, repeat: int = 5):
+    # bfs, shortest_path and connected_components over a random Person knows Person graph with int ids
+    rng = random.Random(5)
+    db = DB(ids="int")
+    db.migrate({"nodes": {"Person": {"name": "str"}}, "links": {("Person", "knows", "Person")}})
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(persons)])
+    db.link_many("Person", [rng.choice(person_ids) for _ in range(persons * links_per_person)], "knows", "Person", [rng.choice(person_ids) for _ in range(persons * links_per_person)])
+    results = {}
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        reached = sum(len(layer["Person"]) for _, layer in db.bfs("Person", [person_ids[0]], "both"))
+    results["bfs"] = {"seconds": (time.perf_counter() - started) / repeat, "reached": reached}
+
+    pairs = [(rng.choice(person_ids), rng.choice(person_ids)) for _ in range(repeat * 20)]
+    started = time.perf_counter()
+    lengths = [len(db.shortest_path("Person", source_id, "Person", target_id) or ()) for source_id, target_id in pairs]
+    results["shortest_path"] = {"seconds": (time.perf_counter() - started) / len(pairs), "avg_length": sum(lengths) / len(lengths)}
+
+    started = time.perf_counter()
+    components = sum(1 for _ in db.connected_components())
+    results["connected_components"] = {"seconds": time.perf_counter() - started, "components": components}
+    return results
+
+
+def bench_scenarios(persons: int = 20_000, seed: int = 0, alpha: float = 1.2, traversals: int = 1000):
+    # the main operations, one after the other, on a generate() graph
+    graph = generate(persons, seed, alpha)
+    rng = random.Random(seed)
+    db = DB(ids=graph["ids"])
+    db.migrate(SCHEMA)
+    results = {}
+
+    started = time.perf_counter()
+    node_ids = {node_name: db.create(node_name, rows) for node_name, rows in graph["rows"].items()}
+    results["create"] = {"seconds": time.perf_counter() - started, "nodes": sum(map(len, node_ids.values()))}
+
+    started = time.perf_counter()
+    for (source, link, target), (sources, targets) in graph["links"].items():
+        db.link_many(source, [node_ids[source][i] for i in sources], link, target, [node_ids[target][i] for i in targets])
+    results["link"] = {"seconds": time.perf_counter() - started, "edges": sum(len(sources) for sources, _ in graph["links"].values())}
+
+    # Person -> Tickets -> Showings -> Movies, one Person at a time
+    person_ids = rng.sample(node_ids["Person"], min(traversals, persons))
+    started = time.perf_counter()
+    for person_id in person_ids:
+        ticket_ids = db.traverse("Person", [person_id], "->", "has", "Ticket")
+        showing_ids = db.traverse("Ticket", ticket_ids, "->", "for", "Showing")
+        db.traverse("Showing", showing_ids, "->", "of", "Movie")
+    results["traverse"] = {"seconds": time.perf_counter() - started, "traversals": len(person_ids)}
+
+    schema = deepcopy(SCHEMA)
+    # adds an attribute, a link and two indexes to build
+    schema["nodes"]["Movie"]["year"] = "int"
+    schema["links"].add(("Person", "likes", "Movie"))
+    schema["indexes"] = {"Showing": {"date": "sorted", "theater": "hash"}, "Ticket": {"seat": "hash"}}
+    started = time.perf_counter()
+    db.migrate(schema, defaults={"Movie": {"year": 0}})
+    results["migrate"] = {"seconds": time.perf_counter() - started}
+
+    folder = tempfile.mkdtemp()
+    started = time.perf_counter()
+    db.save(folder, "bench.db")
+    results["save"] = {"seconds": time.perf_counter() - started, "bytes": os.path.getsize(os.path.join(folder, "bench.db"))}
+    started = time.perf_counter()
+    db = DB()
+    db.load(folder, "bench.db")
+    results["load"] = {"seconds": time.perf_counter() - started}
+    os.remove(os.path.join(folder, "bench.db"))
+    os.rmdir(folder)
+
+    # the most popular Showing is the first one, with the most Tickets
+    hub_id = node_ids["Showing"][0]
+    degree = len(db.traverse("Showing", [hub_id], "<-", "for", "Ticket"))
+    started = time.perf_counter()
+    db.delete("Showing", [hub_id])
+    results["hub_delete"] = {"seconds": time.perf_counter() - started, "degree": degree}
+    return results
+
+
+def bench_metrics(persons: int = 1000, repeat: int = 50_000):
+    # cost of metering many small traverse() calls, and of having had metrics enabled
+    db = DB(ids="int")
+    db.migrate({"nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}}, "links": {("Person", "has", "Ticket")}})
+    person_ids = db.create("Person", [{"name": f"Person {i}"} for i in range(persons)])
+    ticket_ids = db.create("Ticket", [{"seat": f"A{i}"} for i in range(persons)])
+    db.link_many("Person", person_ids, "has", "Ticket", ticket_ids)
+    results = {}
+    for mode in ("disabled", "enabled", "disabled_again"):
+        if mode == "enabled":
+            db.enable_metrics()
+        elif mode == "disabled_again":
+            db.disable_metrics()
+        started = time.perf_counter()
+        for i in range(repeat):
+            db.traverse("Person", [person_ids[i % persons]], "->", "has", "Ticket")
+        results[mode] = {"seconds_per_call": (time.perf_counter() - started) / repeat}
+    return results
+
+
+def bench_import(persons: int = 20_000, seed: int = 0, alpha: float = 1.2):
+    # export a generate() graph to CSV and JSONL files, then stream them into an empty database
+    graph = generate(persons, seed, alpha)
+    db = DB(ids="int")
+    db.migrate(SCHEMA)
+    node_ids = {node_name: db.create(node_name, rows) for node_name, rows in graph["rows"].items()}
+    for (source, link, target), (sources, targets) in graph["links"].items():
+        db.link_many(source, [node_ids[source][i] for i in sources], link, target, [node_ids[target][i] for i in targets])
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for extension in (".csv", ".jsonl"):
+            started = time.perf_counter()
+            rows = sum(db.export_nodes(node_name, os.path.join(folder, node_name + extension)) for node_name in SCHEMA["nodes"])
+            rows += sum(db.export_links(os.path.join(folder, f"{source}_{link}_{target}{extension}"), source, link, target) for source, link, target in SCHEMA["links"])
+            export_seconds = time.perf_counter() - started
+
+            imported = DB(ids="int")
+            imported.migrate(SCHEMA)
+            key_map = KeyMap()
+            started = time.perf_counter()
+            for node_name in SCHEMA["nodes"]:
+                imported.import_nodes(node_name, os.path.join(folder, node_name + extension), key_map)
+            for source, link, target in SCHEMA["links"]:
+                imported.import_links(os.path.join(folder, f"{source}_{link}_{target}{extension}"), source, link, target, key_map)
+            import_seconds = time.perf_counter() - started
+            results[extension[1:]] = {"rows": rows, "export_rows_per_second": rows / export_seconds, "import_rows_per_second": rows / import_seconds}
+    return results
+
+
+def bench_get_iter(n: int = 500_000, batch_size: int = 10_000):
+    # peak memory of reading a whole node type with get() vs streaming it with get_iter()
+    db = DB(ids="int")
+    db.migrate({"nodes": {"Ticket": {"seat": "str", "price": "float"}}, "links": set()})
+    db.create("Ticket", [{"seat": f"A{i}", "price": 9.5} for i in range(n)])
+    results = {}
+    for mode in ("get", "get_iter", "page"):
+        def read():
+            if mode == "get":
+                return sum(price for _, price in db.get("Ticket", None, ["id", "price"]))
+            if mode == "get_iter":
+                return sum(price for batch in db.get_iter("Ticket", None, ["id", "price"], batch_size=batch_size) for _, price in batch)
+            total, token = 0.0, None
+            while True:
+                rows, token = db.page("Ticket", ["id", "price"], batch_size, token)
+                total += sum(price for _, price in rows)
+                if token is None:
+                    return total
+        tracemalloc.start()
+        started = time.perf_counter()
+        read()
+        seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[mode] = {"seconds": seconds, "peak_bytes": peak}
+    return results
+
+
+def bench_validation(n: int = 200_000, batch_size: int = 1000, repeat: int = 3):
+    # create() rows/sec with every row checked, a sample of 10 rows per batch, and trusted rows,
+    # plus the checks alone against the first-row-only check create() used to do
+    schema = {"nodes": {"Showing": {"date": "datetime", "theater": "str", "seats": "int", "price": "float"}}, "links": set()}
+    rows = _showing_rows(n)
+    batches = [rows[i:i + batch_size] for i in range(0, n, batch_size)]
+    results = {}
+    for mode, options in (("full", {}), ("sample", {"sample": 10}), ("trusted", {"trusted": True})):
+        seconds = []
+        for _ in range(repeat):
+            db = DB(ids="int")
+            db.migrate(schema)
+            started = time.perf_counter()
+            for batch in batches:
+                db.create("Showing", batch, **options)
+            seconds.append(time.perf_counter() - started)
+        results[mode] = {"rows_per_second": n / min(seconds)}
+
+    attributes = schema["nodes"]["Showing"]
+    def first_row_check(batch):
+        first = batch[0]
+        assert len(first) == len(attributes)
+        for name, type_name in attributes.items():
+            assert name in first and type(first[name]).__name__ == type_name
+    for mode, check, checked in (("first_row_check", first_row_check, 1), ("full_check", lambda batch: db._check_rows("Showing", batch), batch_size), ("sample_check", lambda batch: db._check_rows("Showing", batch, 10), 10)):
+        started = time.perf_counter()
+        for batch in batches:
+            check(batch)
+        seconds = time.perf_counter() - started
+        results[mode] = {"checked_rows_per_second": checked * len(batches) / seconds, "seconds_per_batch": seconds / len(batches)}
+    return results
+
+
+def bench_attribute_migration(n: int = 500_000, chunk_size: int = 100_000):
+    # add, rename and retype attributes of n Showings in each storage mode
+    schema = {"nodes": {"Showing": {"date": "datetime", "theater": "str", "seats": "int", "price": "float"}}, "links": set()}
+    migrated = {"nodes": {"Showing": {"date": "datetime", "hall": "str", "seats": "float", "price": "float", "sold_out": "bool"}}, "links": set()}
+    rows = _showing_rows(n)
+    results = {}
+    for storage in ("dict", "columnar", "record"):
+        db = DB(storage=storage, ids="int")
+        db.migrate(schema)
+        db.create("Showing", rows, trusted=True)
+        started = time.perf_counter()
+        db.migrate(migrated, defaults={"Showing": {"sold_out": False}}, renames={"Showing": {"theater": "hall"}}, converters={"Showing": {"seats": float}}, chunk_size=chunk_size)
+        seconds = time.perf_counter() - started
+        results[storage] = {"seconds": seconds, "rows_per_second": n / seconds}
+    return results
+
+
+def bench_upsert(n: int = 100_000, batch: int = 1_000):
+    # re-ingesting a batch of already stored people: upsert by a unique key vs scanning get(None, ...) to deduplicate
+    schema = {"nodes": {"Person": {"email": "str", "name": "str"}}, "links": set(), "unique": {"Person": ["email"]}}
+    db = DB()
+    db.migrate(schema)
+    db.create("Person", [{"email": f"person{i}@example.com", "name": f"Person {i}"} for i in range(n)], trusted=True)
+    rows = [{"email": f"person{i}@example.com", "name": f"Person {i}"} for i in random.Random(0).sample(range(n), batch)]
+
+    started = time.perf_counter()
+    known = {email: node_id for node_id, email in db.get("Person", None, ["id", "email"])}
+    [known[row["email"]] for row in rows]
+    scan = time.perf_counter() - started
+
+    started = time.perf_counter()
+    db.upsert("Person", rows, key="email")
+    upsert = time.perf_counter() - started
+    return {"scan": {"seconds": scan}, "upsert": {"seconds": upsert, "rows_per_second": batch / upsert}}
+
+
+def _lower_is_better(key: str) -> bool | None:
+    # timings and sizes should go down, throughputs up, other results (counts) are not compared
+    if key.endswith("_per_second"):
+        return False
+    if key.startswith("seconds") or key.endswith("_seconds") or "bytes" in key:
+        return True
+    return None
+
+
+def best(runs: List[dict]) -> dict:
+    # one result per benchmark out of several runs: the best of each timing, size and throughput, which is
+    # much less noisy than a single run. Other results (counts) are taken from the first run.
+    results = {}
+    for mode, result in runs[0].items():
+        results[mode] = {}
+        for key, value in result.items():
+            values = [run[mode][key] for run in runs]
+            lower_is_better = _lower_is_better(key)
+            results[mode][key] = value if lower_is_better is None else min(values) if lower_is_better else max(values)
+    return results
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> List[str]:
+    # every timing or size in results more than threshold (0.1 = 10%) above the same one in baseline,
+    # and every throughput more than threshold below it
+    regressions = []
+    for name, modes in results.items():
+        for mode, result in modes.items():
+            for key, value in result.items():
+                before = baseline.get(name, {}).get(mode, {}).get(key)
+                lower_is_better = _lower_is_better(key)
+                if lower_is_better is None or not before:
+                    continue
+                if value > before * (1 + threshold) if lower_is_better else value < before * (1 - threshold):
+                    regressions.append(f"{name} {mode} {key}: {before:.6f} -> {value:.6f} ({value / before - 1:+.0%})")
+    return regressions
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "ids": bench_ids,
+    "traverse": bench_traverse,
+    "find": bench_find,
+    "load": bench_load,
+    "link": bench_link,
+    "delete": bench_delete,
+    "cache": bench_cache,
+    "transaction": bench_transaction,
+    "snapshots": bench_snapshots,
+    "replicas": bench_replicas,
+    "server": bench_server,
+    "planner": bench_planner,
+    "counts": bench_counts,
+    "algorithms": bench_algorithms,
+    "metrics": bench_metrics,
+    "scenarios": bench_scenarios,
+    "import": bench_import,
+    "get_iter": bench_get_iter,
+    "validation": bench_validation,
+    "attribute_migration": bench_attribute_migration,
+    "upsert": bench_upsert,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run, exit with 1 if any timing regressed")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown flagged by --compare, 0.1 = 10%%")
+    parser.add_argument("--runs", type=int, default=3, help="runs of every benchmark, the best result of each is kept")
+    parser.add_argument("--persons", type=int, help="size of the generate() graph of the scenarios and import benchmarks")
+    parser.add_argument("--seed", type=int, help="seed of the generate() graph")
+    parser.add_argument("--alpha", type=float, help="power-law exponent of the generate() graph")
+    args = parser.parse_args()
+    if set(args.names) - set(BENCHMARKS):
+        parser.error(f"unknown benchmarks: {', '.join(sorted(set(args.names) - set(BENCHMARKS)))}")
+    if args.runs < 1:
+        parser.error(f"invalid number of runs: {args.runs}")
+    graph = {key: value for key, value in [("persons", args.persons), ("seed", args.seed), ("alpha", args.alpha)] if value is not None}
+    results = {}
+    for name in args.names or list(BENCHMARKS):
+        kwargs = graph if name in ("scenarios", "import") else {}
+        results[name] = best([BENCHMARKS[name](**kwargs) for _ in range(args.runs)])
+        for mode, result in results[name].items():
+            print(name, mode, result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for regression in regressions:
+            print("regression", regression)
+        sys.exit(1 if regressions else 0)
@@ -1,19 +1,50 @@
+import io
 import os
+import csv
+import dbm
+import json
+import queue
+import socket
+import asyncio
+import builtins
+import itertools
+import re
+import sys
+import mmap
+import time
+import zlib
+import struct
 import pickle 
-from copy import deepcopy
-from typing import Any, List, Tuple, Set
+import threading
+from array import array
+from multiprocessing import shared_memory, resource_tracker
+from collections import Counter, OrderedDict
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from datetime import datetime
+from functools import partial
+from contextlib import contextmanager, nullcontext
+from typing import Any, Iterator, List, Tuple, Set
 
 
 # helper functions
 def _unique_elements(a: List[Any], b: List[Any]) -> Tuple[List[Any], List[Any]]:
-    b_copy = deepcopy(b)
+    # c: the items of a left after each one cancels one equal item of b, d: the items of b left after that which are not in a at all
+    remaining = Counter(b)
     c = []
     for item in a:
-        if item in b_copy:
-            b_copy.remove(item)
+        if remaining[item]:
+            remaining[item] -= 1
         else:
             c.append(item)
-    d = [item for item in b_copy if item not in a]
+    cancelled = Counter(b) - remaining
+    in_a = set(a)
+    d = []
+    for item in b:
+        if cancelled[item]:
+            cancelled[item] -= 1
+        elif item not in in_a:
+            d.append(item)
     return c, d
 
 def _unique_tuples(a: Set[Tuple[Any, Any]], b: Set[Tuple[Any, Any]]) -> Tuple[List[Tuple[Any, Any]], List[Tuple[Any, Any]]]:
@@ -21,13 +52,872 @@ def _unique_tuples(a: Set[Tuple[Any, Any]], b: Set[Tuple[Any, Any]]) -> Tuple[Li
     d = list(b - a)
     return c, d
 
+def _copy_schema(schema: dict) -> dict:
+    # copies the containers of a schema, the names and type names in them are immutable
+    copied = dict(schema)
+    copied["nodes"] = {node_name: dict(attributes) for node_name, attributes in schema["nodes"].items()}
+    copied["links"] = set(schema["links"])
+    if "indexes" in schema:
+        copied["indexes"] = {node_name: dict(attributes) for node_name, attributes in schema["indexes"].items()}
+    if "unique" in schema:
+        copied["unique"] = {node_name: list(attributes) for node_name, attributes in schema["unique"].items()}
+    return copied
 
-Id = str
+def _index_declarations(schema: dict) -> dict:
+    # the declared indexes plus a hash index for every unique attribute that has none
+    indexes = {node_name: dict(attributes) for node_name, attributes in schema.get("indexes", {}).items()}
+    for node_name, attributes in schema.get("unique", {}).items():
+        for attr in attributes:
+            indexes.setdefault(node_name, {}).setdefault(attr, "hash")
+    return indexes
+
+_PATH_HOP = re.compile(r"(->|<-)(\w+):(\w+)")
+
+def _parse_path(query: str) -> Tuple[str, List[Tuple[str, str, str]]]:
+    # "Person->has:Ticket->for:Showing" -> ("Person", [("->", "has", "Ticket"), ("->", "for", "Showing")])
+    start = re.match(r"\s*(\w+)", query)
+    assert start, f"Invalid path: '{query}'. Must start with a node name"
+    hops = []
+    position = start.end()
+    while position < len(query.rstrip()):
+        hop = _PATH_HOP.match(query, position)
+        assert hop, f"Invalid path: '{query}'. Expected '->link:Node' or '<-link:Node' at position {position}"
+        hops.append((hop.group(1), hop.group(2), hop.group(3)))
+        position = hop.end()
+    assert len(hops) > 0, f"Invalid path: '{query}'. Must contain at least one hop"
+    return start.group(1), hops
+
+
+def _deep_size(root: Any, seen: set) -> int:
+    # approximate bytes held by root and everything it references that is not in seen (object ids), adds them to seen
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            # values of a _LazyDict that were not loaded yet are not counted
+            stack.extend(dict.keys(obj))
+            stack.extend(dict.values(obj))
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+            stack.append(obj.__dict__)
+    return size
+
+
+def _degree_histogram(adjacency: dict, other_node_name: str) -> Tuple[dict, List[int]]:
+    # ({bucket: number of ids}, degrees) of the ids with edges to other_node_name,
+    # an id of degree d is counted in the bucket of the largest power of two <= d
+    degrees = [len(others[other_node_name]) for others in adjacency.values() if other_node_name in others]
+    histogram = {}
+    for degree in degrees:
+        bucket = 1 << (degree.bit_length() - 1)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+    return dict(sorted(histogram.items())), degrees
+
+
+def _mark_unseen(other_ids, seen, found: list):
+    # appends the ids not seen yet to found and marks them, seen is a bytearray indexed by int id or a set
+    if type(seen) is bytearray:
+        for other_id in other_ids:
+            if not seen[other_id]:
+                seen[other_id] = 1
+                found.append(other_id)
+    else:
+        for other_id in other_ids:
+            if other_id not in seen:
+                seen.add(other_id)
+                found.append(other_id)
+
+
+def _group_pairs(node_1_ids: List[Any], node_2_ids: List[Any]) -> dict:
+    # parallel id lists -> node_1_id: [node_2_id, ...]
+    grouped = {}
+    for node_1_id, node_2_id in zip(node_1_ids, node_2_ids):
+        if node_1_id in grouped:
+            grouped[node_1_id].append(node_2_id)
+        else:
+            grouped[node_1_id] = [node_2_id]
+    return grouped
+
+
+Id = str | int
+
+# storage modes for db[nodes][node_name]
+STORAGE_MODES = ("dict", "columnar", "record")
+
+# id modes: "str" hands out stringified counters (the original format), "int" hands out dense ints
+ID_MODES = ("str", "int")
+
+# public methods enable_metrics() can instrument
+METRIC_OPS = ("create", "get", "find", "link", "unlink", "link_many", "unlink_many", "traverse", "delete", "migrate", "save", "load", "upsert")
+
+# schema types that get a typed array column in columnar storage
+_ARRAY_TYPECODES = {"int": "q", "float": "d", "bool": "b"}
+
+
+class _Columns:
+    # Columnar node store: one typed column per schema attribute plus an id -> slot map.
+    # Quacks like the default Dict[Id, dict] store so the rest of DB does not care which one it holds.
+
+    def __init__(self, attributes: dict):
+        self.attributes = dict(attributes)
+        self.columns = {name: self._new_column(type_name) for name, type_name in self.attributes.items()}
+        self.slots = {}  # id -> slot
+        self.free = []   # slots freed by delete, reused by the next insert
+        self.size = 0    # number of slots allocated in every column
+
+    @staticmethod
+    def _new_column(type_name: str):
+        if type_name in _ARRAY_TYPECODES:
+            return array(_ARRAY_TYPECODES[type_name])
+        return []
+
+    def _read(self, name: str, slot: int) -> Any:
+        value = self.columns[name][slot]
+        if self.attributes[name] == "bool":
+            return bool(value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, node_id) -> bool:
+        return node_id in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, _Columns):
+            return NotImplemented
+        return self.attributes == other.attributes and dict(self.items()) == dict(other.items())
+
+    def keys(self):
+        return self.slots.keys()
+
+    def items(self):
+        for node_id in self.slots:
+            yield node_id, self[node_id]
+
+    def get(self, node_id, default=None):
+        if node_id in self.slots:
+            return self[node_id]
+        return default
+
+    def __getitem__(self, node_id) -> dict:
+        slot = self.slots[node_id]
+        return {name: self._read(name, slot) for name in self.columns}
+
+    def __getstate__(self) -> dict:
+        # columns mapped from a segment file are memoryviews, pickle them as arrays
+        state = dict(self.__dict__)
+        state["columns"] = {name: array(column.format, column) if type(column) is memoryview else column for name, column in self.columns.items()}
+        return state
+
+    def copy(self) -> "_Columns":
+        copied = _Columns.__new__(_Columns)
+        copied.__dict__.update(self.__dict__)
+        copied.columns = {name: column[:] for name, column in self.columns.items()}
+        copied.slots = dict(self.slots)
+        copied.free = list(self.free)
+        return copied
+
+    def _writable(self):
+        # columns mapped from a segment file are read-only memoryviews, copy them on the first write
+        for name, column in self.columns.items():
+            if type(column) is memoryview:
+                self.columns[name] = array(column.format, column)
+
+    def __setitem__(self, node_id, row: dict):
+        self._writable()
+        values = [row[name] for name in self.columns]
+        values = [sys.intern(value) if type(value) is str else value for value in values]
+
+        slot = self.slots.get(node_id)
+        reused = slot is None and bool(self.free)
+        if reused:
+            slot = self.free.pop()
+
+        if slot is None:
+            # append a new slot at the end of every column, or to none of them if a value is refused
+            slot = self.size
+            written = []
+            try:
+                for name, value in zip(self.columns, values):
+                    self._write(name, slot, value)
+                    written.append(name)
+            except BaseException:
+                for name in written:
+                    del self.columns[name][slot]
+                raise
+            self.size += 1
+        else:
+            # overwrite the slot in every column, or give back the old values (and the free slot)
+            overwritten = []
+            try:
+                for name, value in zip(self.columns, values):
+                    old = self.columns[name][slot]
+                    self._write(name, slot, value)
+                    overwritten.append((name, old))
+            except BaseException:
+                for name, old in overwritten:
+                    self.columns[name][slot] = old
+                if reused:
+                    self.free.append(slot)
+                raise
+        self.slots[node_id] = slot
+
+    def _write(self, name: str, slot: int, value: Any):
+        column = self.columns[name]
+        try:
+            if slot == len(column):
+                column.append(value)
+            else:
+                column[slot] = value
+        except OverflowError:
+            # an int outside the typed array's range, keep the column as a plain list from now on
+            column = self.columns[name] = list(column)
+            self._write(name, slot, value)
+
+    def __delitem__(self, node_id):
+        self._writable()
+        slot = self.slots.pop(node_id)
+        for column in self.columns.values():
+            if type(column) is list:
+                column[slot] = None  # drop the reference, the slot itself is kept for reuse
+        self.free.append(slot)
+
+    def row(self, node_id, attributes: List[str]) -> List[Any]:
+        slot = self.slots[node_id]
+        return [node_id if name == "id" else self._read(name, slot) for name in attributes]
+
+    def column(self, name: str, ids=None) -> List[Any]:
+        slots = self.slots.values() if ids is None else [self.slots[node_id] for node_id in ids]
+        column = self.columns[name]
+        if self.attributes[name] == "bool":
+            return [bool(column[slot]) for slot in slots]
+        return [column[slot] for slot in slots]
+
+
+class _Records:
+    # Record node store: one tuple per node holding its values in the schema's attribute order, which is
+    # much smaller than a dict per node on wide node types. Quacks like the default store, see _Columns.
+
+    def __init__(self, attributes: dict):
+        self.attributes = dict(attributes)
+        self.names = tuple(self.attributes)
+        self.positions = {name: position for position, name in enumerate(self.names)}
+        self.rows = {}  # id -> tuple of values
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, node_id) -> bool:
+        return node_id in self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, _Records):
+            return NotImplemented
+        return self.attributes == other.attributes and self.rows == other.rows
+
+    def keys(self):
+        return self.rows.keys()
+
+    def items(self):
+        names = self.names
+        for node_id, record in self.rows.items():
+            yield node_id, dict(zip(names, record))
+
+    def get(self, node_id, default=None):
+        if node_id in self.rows:
+            return self[node_id]
+        return default
+
+    def __getitem__(self, node_id) -> dict:
+        return dict(zip(self.names, self.rows[node_id]))
+
+    def copy(self) -> "_Records":
+        copied = _Records.__new__(_Records)
+        copied.__dict__.update(self.__dict__)
+        copied.rows = dict(self.rows)
+        return copied
+
+    def __setitem__(self, node_id, row: dict):
+        values = [row[name] for name in self.names]
+        self.rows[node_id] = tuple([sys.intern(value) if type(value) is str else value for value in values])
+
+    def __delitem__(self, node_id):
+        del self.rows[node_id]
+
+    def row(self, node_id, attributes: List[str]) -> List[Any]:
+        record = self.rows[node_id]
+        positions = self.positions
+        return [node_id if name == "id" else record[positions[name]] for name in attributes]
+
+    def column(self, name: str, ids=None) -> List[Any]:
+        records = self.rows.values() if ids is None else map(self.rows.__getitem__, ids)
+        return list(map(itemgetter(self.positions[name]), records))
+
+
+# index kinds that can be declared in schema["indexes"]
+INDEX_KINDS = ("hash", "sorted")
+
+# a compiled link triple is compiled again once more source ids than this (or an eighth of its rows) changed
+_CSR_STALE_LIMIT = 1024
 
-class DB:
+
+class _HashIndex:
+    # attribute value -> ids, answers equality lookups
+    kind = "hash"
 
     def __init__(self):
-        pass
+        self.ids = {}
+
+    def add_many(self, entries: List[Tuple[Any, Id]]):
+        for value, node_id in entries:
+            if value not in self.ids:
+                self.ids[value] = set()
+            self.ids[value].add(node_id)
+
+    def remove_many(self, entries: List[Tuple[Any, Id]]):
+        for value, node_id in entries:
+            self.ids[value].discard(node_id)
+            if not self.ids[value]:
+                del self.ids[value]
+
+    def equal(self, value: Any) -> Set[Id]:
+        return set(self.ids.get(value, ()))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, _HashIndex):
+            return NotImplemented
+        return self.ids == other.ids
+
+    def copy(self) -> "_HashIndex":
+        copied = _HashIndex()
+        copied.ids = {value: set(ids) for value, ids in self.ids.items()}
+        return copied
+
+
+class _SortedIndex:
+    # parallel lists of sorted attribute values and their ids, answers equality and range lookups
+    kind = "sorted"
+
+    def __init__(self):
+        self.values = []
+        self.ids = []
+
+    def add_many(self, entries: List[Tuple[Any, Id]]):
+        if len(entries) * 8 < len(self.values):
+            # a few new values: insert them in place
+            for value, node_id in entries:
+                position = bisect_right(self.values, value)
+                self.values.insert(position, value)
+                self.ids.insert(position, node_id)
+            return
+        # a large batch: sorting everything again is cheaper than shifting the lists for every insert
+        entries = sorted([*zip(self.values, self.ids), *entries], key=itemgetter(0))
+        self.values = [value for value, _ in entries]
+        self.ids = [node_id for _, node_id in entries]
+
+    def remove_many(self, entries: List[Tuple[Any, Id]]):
+        if len(entries) * 8 < len(self.values):
+            # a few values: delete them in place
+            for value, node_id in entries:
+                start = bisect_left(self.values, value)
+                position = start + self.ids[start:bisect_right(self.values, value)].index(node_id)
+                del self.values[position]
+                del self.ids[position]
+            return
+        # a large batch: one pass keeping everything else, an id is in the index once
+        removed = {node_id for _, node_id in entries}
+        kept = [(value, node_id) for value, node_id in zip(self.values, self.ids) if node_id not in removed]
+        self.values = [value for value, _ in kept]
+        self.ids = [node_id for _, node_id in kept]
+
+    def equal(self, value: Any) -> Set[Id]:
+        return set(self.ids[bisect_left(self.values, value):bisect_right(self.values, value)])
+
+    def range(self, low: Any, high: Any) -> Set[Id]:
+        # low <= value < high, None leaves that end open
+        start = 0 if low is None else bisect_left(self.values, low)
+        stop = len(self.values) if high is None else bisect_left(self.values, high)
+        return set(self.ids[start:stop])
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, _SortedIndex):
+            return NotImplemented
+        return self.values == other.values and self.ids == other.ids
+
+    def copy(self) -> "_SortedIndex":
+        copied = _SortedIndex()
+        copied.values = list(self.values)
+        copied.ids = list(self.ids)
+        return copied
+
+
+def _new_index(kind: str):
+    if kind == "sorted":
+        return _SortedIndex()
+    return _HashIndex()
+
+
+# journal record header: payload length, crc32 of the payload
+_RECORD_HEADER = struct.Struct("<II")
+
+
+class _Journal:
+    # Append-only log of write operations. Each record is a pickled (lsn, op, args) tuple behind a
+    # length + crc32 header, so a record torn by a crash is detected and ignored on replay.
+
+    def __init__(self, path: str, sync_every: int | None, sync_interval: float | None):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.file = open(path, "ab")
+        self.lock = threading.Lock()  # the sync timer runs in its own thread
+        self.timer = None
+
+    def append(self, record: tuple):
+        # Every record is flushed to the OS right away, so it survives a crash of the process. fsync, which
+        # guards against a crash of the machine, waits for sync_every records, or sync_interval seconds: the
+        # first record after a sync starts a timer, so the last records before an idle period get synced too.
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.file.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.file.flush()
+            self.unsynced += 1
+            if self.sync_every and self.unsynced >= self.sync_every:
+                self._sync()
+            elif self.sync_interval is not None:
+                elapsed = time.monotonic() - self.last_sync
+                if elapsed >= self.sync_interval:
+                    self._sync()
+                elif self.timer is None:
+                    self.timer = threading.Timer(self.sync_interval - elapsed, self._timed_sync)
+                    self.timer.daemon = True
+                    self.timer.start()
+
+    def _timed_sync(self):
+        with self.lock:
+            self.timer = None
+            if self.unsynced and not self.file.closed:
+                self._sync()
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def truncate(self):
+        with self.lock:
+            self.file.seek(0)
+            self.file.truncate()
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._sync()
+            self.file.close()
+
+
+def _read_journal(path: str) -> Iterator[tuple]:
+    # yields records until the end of the file or the first torn / corrupt record
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            length, checksum = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                return
+            yield pickle.loads(payload)
+
+
+# segmented file layout: magic, then the (offset, length) of the segment table, then the segments
+_SEGMENT_MAGIC = b"PYSGDB\x00\x01"
+_SEGMENT_PREAMBLE = struct.Struct("<8sQQ")
+
+# shared memory control block: the generation currently published, see DB.publish_shared()
+_SHARED_CONTROL = struct.Struct("<Q")
+
+
+_tracker_is_own = None  # see _open_shared_memory()
+
+
+def _open_shared_memory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    # Before 3.13 attaching registers the block with the resource tracker, which unlinks it when the processes
+    # using that tracker exit. Worker processes started by the writer share its tracker, where the block is
+    # already registered. A process that had no tracker before its first attach gets its own and must
+    # unregister every block it attaches.
+    global _tracker_is_own
+    if _tracker_is_own is None:
+        _tracker_is_own = resource_tracker._resource_tracker._fd is None
+    block = shared_memory.SharedMemory(name)
+    if _tracker_is_own:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+class _LazyDict(dict):
+    # A dict whose values are loaded the first time they are looked up, see load_segments().
+    # Anything that needs every value (iteration, comparison, pickling) loads the rest first.
+
+    def __init__(self, pending: dict):
+        super().__init__()
+        self.pending = pending  # key -> function loading the value
+        self.lock = threading.Lock()
+
+    def __missing__(self, key):
+        # snapshot readers share the dict, one of them loads the value while the others wait for it.
+        # The loader stays pending until the value is stored so the key is always in one of the two.
+        with self.lock:
+            if dict.__contains__(self, key):
+                return dict.__getitem__(self, key)
+            if key not in self.pending:
+                raise KeyError(key)
+            value = self.pending[key]()
+            self[key] = value
+            del self.pending[key]
+            return value
+
+    def load_all(self):
+        for key in list(self.pending):
+            self[key]
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or key in self.pending
+
+    def __len__(self) -> int:
+        return dict.__len__(self) + len(self.pending)
+
+    def __iter__(self):
+        self.load_all()
+        return dict.__iter__(self)
+
+    def __eq__(self, other) -> bool:
+        self.load_all()
+        if isinstance(other, _LazyDict):
+            other.load_all()
+        return dict.__eq__(self, other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        self.load_all()
+        return (dict, (dict(dict.items(self)),))
+
+    def keys(self):
+        self.load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        if key in self.pending:
+            self[key]
+        return dict.pop(self, key, *default)
+
+    def __delitem__(self, key):
+        if key in self.pending:
+            del self.pending[key]
+        else:
+            dict.__delitem__(self, key)
+
+    def copy(self) -> "_LazyDict":
+        # values not loaded yet stay lazy in both dicts
+        copied = _LazyDict(dict(self.pending))
+        dict.update(copied, dict.items(self))
+        return copied
+
+
+class _TraversalCache:
+    # LRU cache of traverse() and path() results. Every entry remembers the versions of the links it
+    # read; an entry whose links have been written to since is stale and treated as a miss.
+
+    def __init__(self, max_entries: int | None, max_bytes: int | None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (link versions, result, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, versions: tuple) -> tuple | None:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != versions:
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, versions: tuple, result: tuple):
+        if key in self.entries:
+            self._drop(key)
+        size = sys.getsizeof(key) + sys.getsizeof(result)
+        self.entries[key] = (versions, result, size)
+        self.bytes += size
+        while (self.max_entries is not None and len(self.entries) > self.max_entries) or \
+                (self.max_bytes is not None and self.bytes > self.max_bytes and len(self.entries) > 1):
+            oldest = next(iter(self.entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: tuple):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries), "bytes": self.bytes}
+
+
+# latency histogram bucket upper bounds in seconds, the last bucket counts everything slower
+_LATENCY_BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+# operation -> number of items it processed, from its arguments by name and its result
+_METRIC_ITEMS = {
+    "create": lambda arguments, result: len(arguments["attributes"]),
+    "get": lambda arguments, result: len(result),
+    "find": lambda arguments, result: len(result),
+    "traverse": lambda arguments, result: len(result),
+    "delete": lambda arguments, result: len(arguments["ids"]),
+    "upsert": lambda arguments, result: len(arguments["rows"]),
+    "link": lambda arguments, result: len(arguments["node_1_ids"]) * len(arguments["node_2_ids"]),
+    "unlink": lambda arguments, result: len(arguments["node_1_ids"]) * len(arguments["node_2_ids"]),
+    "link_many": lambda arguments, result: result,
+    "unlink_many": lambda arguments, result: result,
+}
+
+
+def _summarize(value: Any) -> str:
+    # short description of an argument for the slow operation log
+    if isinstance(value, (list, tuple, set, dict)) and len(value) > 3:
+        return f"<{type(value).__name__} of {len(value)}>"
+    text = repr(value)
+    return text if len(text) <= 80 else text[:77] + "..."
+
+
+class _Metrics:
+    # per operation counters, see DB.enable_metrics()
+
+    def __init__(self, slow_seconds: float | None, slow_log_size: int):
+        self.slow_seconds = slow_seconds
+        self.slow_log_size = slow_log_size
+        self.hooks = []  # (pre, post) pairs
+        self.reset()
+
+    def reset(self):
+        self.ops = {}  # op -> [calls, errors, items, seconds, max seconds, histogram counts]
+        self.slow = []
+
+    def record(self, op: str, args: tuple, kwargs: dict, seconds: float, items: int, error: bool):
+        counters = self.ops.get(op)
+        if counters is None:
+            counters = self.ops[op] = [0, 0, 0, 0.0, 0.0, [0] * (len(_LATENCY_BUCKETS) + 1)]
+        counters[0] += 1
+        counters[1] += error
+        counters[2] += items
+        counters[3] += seconds
+        counters[4] = max(counters[4], seconds)
+        counters[5][bisect_left(_LATENCY_BUCKETS, seconds)] += 1
+        if self.slow_seconds is not None and seconds >= self.slow_seconds:
+            self.slow.append({"op": op, "seconds": seconds, "args": [_summarize(arg) for arg in args] + [f"{name}={_summarize(arg)}" for name, arg in kwargs.items()], "error": error, "time": time.time()})
+            del self.slow[:-self.slow_log_size]
+
+    def snapshot(self) -> dict:
+        ops = {}
+        for op, (calls, errors, items, seconds, max_seconds, histogram) in self.ops.items():
+            ops[op] = {
+                "calls": calls, "errors": errors, "items": items, "seconds": seconds, "max_seconds": max_seconds,
+                "histogram": dict(zip(_LATENCY_BUCKETS + (float("inf"),), histogram))
+            }
+        return {"ops": ops, "slow": list(self.slow)}
+
+
+class _Versions:
+    # snapshot mode state, see DB.enable_snapshots()
+
+    def __init__(self):
+        self.owned = {}  # id -> container copied since the last publish, safe to change in place
+        self.published = None
+
+
+def _new_node_store(storage: str, attributes: dict):
+    if storage == "columnar":
+        return _Columns(attributes)
+    if storage == "record":
+        return _Records(attributes)
+    return {}
+
+
+# schema type names -> the type their values must have exactly, other type names are compared by name
+_SCHEMA_TYPES = {"str": str, "int": int, "float": float, "bool": bool, "datetime": datetime, "bytes": bytes, "list": list, "dict": dict, "tuple": tuple}
+
+
+def _row_validator(node_name: str, attributes: dict):
+    # Compiled once per node type by DB._schema_changed(): checks every row of a batch one column at a time,
+    # with the work done by map() and set(). Only a failing batch is walked row by row for the error message.
+    count = len(attributes)
+    getters = [(attr, itemgetter(attr), _SCHEMA_TYPES.get(type_name), type_name) for attr, type_name in attributes.items()]
+
+    def explain(rows: List[dict]):
+        for position, row in enumerate(rows):
+            assert type(row) is dict, f"Row {position} of {node_name} is not a dict"
+            for attr, _, _, type_name in getters:
+                assert attr in row, f"Wrong attribute name found when creating a node in create(): {attr} missing in row {position} of {node_name}"
+                assert type(row[attr]).__name__ == type_name, f"Type mismatch in db create(): {node_name}.{attr} of row {position} is {type(row[attr]).__name__}, expected {type_name}"
+            assert len(row) == count, f"Wrong number or attributes given in create(): row {position} of {node_name} has {sorted(set(row) - set(attributes))} too"
+
+    def validate(rows: List[dict]):
+        try:
+            valid = set(map(len, rows)) == {count}
+            for _, getter, expected, type_name in getters:
+                if not valid:
+                    break
+                found = set(map(type, map(getter, rows)))
+                valid = found == {expected} or all(found_type.__name__ == type_name for found_type in found)
+        except (KeyError, TypeError):
+            valid = False
+        if not valid:
+            explain(rows)
+    return validate
+
+
+# schema type -> function reading a value of that type from its text, for imports. Other types need a converter.
+_BOOL_TEXT = {"True": True, "true": True, "1": True, "False": False, "false": False, "0": False}
+_TEXT_CONVERTERS = {"str": str, "int": int, "float": float, "bool": _BOOL_TEXT.__getitem__, "datetime": datetime.fromisoformat}
+
+# file formats of import_nodes() and friends, by extension
+IMPORT_FORMATS = (".csv", ".jsonl")
+
+
+class KeyMap:
+    # External key -> pysgdb id for each node type, filled by DB.import_nodes() and read by DB.import_links().
+    # Kept in memory by default, or in a dbm file at path for datasets with more keys than fit in memory.
+    # Keys are compared as strings, so a CSV key "7" and a JSONL key 7 are the same key.
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self.keys = {} if path is None else dbm.open(path, "n")
+
+    def update(self, node_name: str, keys: List[Any], ids: List[Id]):
+        if self.path is None:
+            self.keys.update(zip([(node_name, str(key)) for key in keys], ids))
+        else:
+            for key, node_id in zip(keys, ids):
+                self.keys[f"{node_name}\x00{key}"] = str(node_id)
+
+    def ids(self, node_name: str, keys: List[Any]) -> List[Id]:
+        # string ids when spilled, see DB._as_ids()
+        try:
+            if self.path is None:
+                return [self.keys[(node_name, str(key))] for key in keys]
+            return [self.keys[f"{node_name}\x00{key}"].decode() for key in keys]
+        except KeyError as e:
+            raise AssertionError(f"Unknown {node_name} key: {e.args[0]}") from None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def close(self):
+        if self.path is not None:
+            self.keys.close()
+
+
+def _read_records(path: str) -> Iterator[dict]:
+    # one dict per line of a .jsonl file or per row of a .csv file with a header, values of a CSV row are text
+    extension = os.path.splitext(path)[1]
+    assert extension in IMPORT_FORMATS, f"Unknown file format: {path}. Must be one of {IMPORT_FORMATS}"
+    with open(path, newline="") as f:
+        if extension == ".csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _write_records(path: str, fields: List[str], rows: Iterator[list]) -> int:
+    # the counterpart of _read_records(), returns the number of rows written
+    extension = os.path.splitext(path)[1]
+    assert extension in IMPORT_FORMATS, f"Unknown file format: {path}. Must be one of {IMPORT_FORMATS}"
+    count = 0
+    with open(path + ".tmp", "w", newline="") as f:
+        if extension == ".csv":
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow([value.isoformat() if type(value) is datetime else value for value in row])
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(fields, row)), default=_json_value))
+                f.write("\n")
+                count += 1
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def _json_value(value: Any) -> Any:
+    if type(value) is datetime:
+        return value.isoformat()
+    raise TypeError(f"Cannot export a {type(value).__name__} value to JSON, use CSV or convert the attribute first")
+
+
+class DB:
+
+    def __init__(self, storage: str | None = None, ids: str | None = None):
+        assert storage is None or storage in STORAGE_MODES, f"Invalid storage mode: {storage}. Must be one of {STORAGE_MODES}"
+        assert ids is None or ids in ID_MODES, f"Invalid id mode: {ids}. Must be one of {ID_MODES}"
+        self.storage = storage
+        self.ids = ids
+        self._csr = None  # compiled read view, see freeze()
+        self._csr_stale = {}  # compiled triple -> ids written since it was compiled, see _compiled()
+        self._journal = None  # write-ahead log, see open_journal()
+        self._incident = {}  # see _schema_changed()
+        self._cache = None  # traversal cache, see enable_cache()
+        self._link_versions = {}  # link name -> number of writes, used to invalidate cached traversals
+        self._stats = None  # (source, link, target) -> [edges, source ids with edges, target ids with edges], see stats()
+        self._transaction = None  # buffered operations, see transaction()
+        self._versions = None  # copy-on-write bookkeeping, see enable_snapshots()
+        self._cow = False  # True when writes must copy what they touch first: snapshot mode, and snapshots themselves
+        self.write_lock = None  # held by transactions in snapshot mode
+        self._shared = None  # shared memory blocks, see publish_shared() and attach_shared()
+        self._metrics = None  # operation counters, see enable_metrics()
+        self._validators = {}  # node_name -> row validator, see _schema_changed()
 
 
     def _init_schema(self, schema: dict):
@@ -37,12 +927,14 @@ class DB:
             "->": {},          # db[direction][source_node_name][id][target_node_name] -> Set[Id]
             "<-": {},          # db[direction][target_node_name][id][source_node_name] -> Set[Id]
             "node_links": {},  # db[node_links][source_node_name] -> Set[link_name]
-            "current_id": "0"
+            "indexes": {},     # db[indexes][node_name][attr_name] -> _HashIndex | _SortedIndex
+            "current_id": 0 if self.ids == "int" else "0",
+            "storage": self.storage or "dict"
         }
         self.db["schema"] = schema # TODO: make sure 'schema' is the right shape
         
-        for node_name in self.db["schema"]["nodes"].keys():
-            self.db["nodes"][node_name] = {}
+        for node_name, attributes in self.db["schema"]["nodes"].items():
+            self.db["nodes"][node_name] = _new_node_store(self.db["storage"], attributes)
         
         for (source, link, target) in self.db["schema"]["links"]:
             if link not in self.db["->"]:
@@ -57,20 +949,56 @@ class DB:
                 self.db["node_links"][source] = set()
             self.db["node_links"][source].add(link)
 
+        self._validate_indexes(schema)
+        self._update_indexes(_index_declarations(schema))
+
 
-    def _update_schema(self, schema: dict):
+    def _validate_indexes(self, schema: dict):
+        for node_name, attributes in schema.get("indexes", {}).items():
+            assert node_name in schema["nodes"], f"Cannot index node: '{node_name}' because it is not in the schema"
+            for attr, kind in attributes.items():
+                assert attr in schema["nodes"][node_name], f"Cannot index attribute: '{attr}' because it is not found in {node_name} nodes"
+                assert kind in INDEX_KINDS, f"Invalid index kind: '{kind}' for {node_name}.{attr}. Must be one of {INDEX_KINDS}"
+        for node_name, attributes in schema.get("unique", {}).items():
+            assert node_name in schema["nodes"], f"Cannot make node: '{node_name}' unique because it is not in the schema"
+            assert type(attributes) == list, f"Unique attributes of {node_name} must be a list"
+            for attr in attributes:
+                assert attr in schema["nodes"][node_name], f"Cannot make attribute: '{attr}' unique because it is not found in {node_name} nodes"
+
+
+    def _update_indexes(self, indexes: dict):
+        # drop the indexes no longer declared, build the new ones from the nodes already stored
+        for node_name in list(self.db["indexes"]):
+            for attr in list(self.db["indexes"][node_name]):
+                if indexes.get(node_name, {}).get(attr) != self.db["indexes"][node_name][attr].kind:
+                    del self.db["indexes"][node_name][attr]
+            if not self.db["indexes"][node_name]:
+                del self.db["indexes"][node_name]
+
+        for node_name, attributes in indexes.items():
+            for attr, kind in attributes.items():
+                if attr in self.db["indexes"].get(node_name, {}):
+                    continue
+                index = _new_index(kind)
+                index.add_many([(row[attr], node_id) for node_id, row in self.db["nodes"][node_name].items()])
+                if node_name not in self.db["indexes"]:
+                    self.db["indexes"][node_name] = {}
+                self.db["indexes"][node_name][attr] = index
+
+
+    def _update_schema(self, schema: dict, defaults: dict, renames: dict, converters: dict, chunk_size: int, progress):
 
         ### validations ###
         current_links = self.db["schema"]["links"]
         target_links = schema["links"]
         deleted_links, new_links = _unique_tuples(current_links, target_links)
-        deleted_link_names = [x[1] for x in deleted_links]
 
         for (source, link, target) in deleted_links:
             # check that there are no connections for the given link
-            remaining_forward_connections = len(self.db["->"][link][source])
+            # (links with the same name and source, or target, share db[direction][link][node_name])
+            remaining_forward_connections = sum(1 for targets in self.db["->"][link][source].values() if target in targets)
             assert remaining_forward_connections == 0, f"Cannot update schema. link ({link}: {source} -> {target}) still has '{remaining_forward_connections}' remaining connections. Please delete these first before migrating."
-            remaining_backward_connections = len(self.db["<-"][link][target])
+            remaining_backward_connections = sum(1 for sources in self.db["<-"][link][target].values() if source in sources)
             assert remaining_backward_connections == 0, f"Cannot update schema. link ({link}: {target} <- {source}) still has '{remaining_backward_connections}' remaining connections. Please delete these first before migrating."
             
         current_nodes = list(self.db["schema"]["nodes"].keys())
@@ -79,14 +1007,40 @@ class DB:
 
         for node_name in deleted_nodes:
             # make sure the delete node is not in a link - either forwards or backwards
-            found_in_links = list(self.db["node_links"][node_name])
-            found_in_links = [x for x in found_in_links if x not in deleted_link_names]
+            found_in_links = [
+                link for direction, link, other_node_name in self._incident[node_name]
+                if ((node_name, link, other_node_name) if direction == "->" else (other_node_name, link, node_name)) not in deleted_links
+            ]
             assert len(found_in_links) == 0, f"Cannot delete node: '{node_name}' because it is still used in links: {found_in_links}"
 
             # make sure node does not have any objects in it
             num_node_objects = len(self.db["nodes"][node_name])
             assert num_node_objects == 0, f"Cannot delete node: '{node_name}' becuase there are still '{num_node_objects}' objects contained in it"
 
+        self._validate_indexes(schema)
+
+        # node types whose attributes change are rebuilt now, nothing is changed if one of them fails
+        assert all(node_name in schema["nodes"] and node_name not in deleted_nodes and node_name not in new_nodes for node_name in renames), f"Renames for node types that are not kept: {list(renames)}"
+        migrated = {}
+        for node_name in current_nodes:
+            if node_name in schema["nodes"]:
+                plan = self._attribute_plan(node_name, schema["nodes"][node_name], defaults.get(node_name, {}), renames.get(node_name, {}), converters.get(node_name, {}))
+                if plan is not None:
+                    migrated[node_name] = (plan, self._migrated_store(node_name, schema["nodes"][node_name], plan, chunk_size, progress))
+
+        # values of attributes that become unique must already be
+        current_unique = self.db["schema"].get("unique", {})
+        for node_name, attributes in schema.get("unique", {}).items():
+            if node_name in new_nodes:
+                continue
+            store = migrated[node_name][1] if node_name in migrated else self.db["nodes"][node_name]
+            for attr in attributes:
+                if attr in current_unique.get(node_name, ()) and node_name not in migrated:
+                    continue
+                values = Counter(row[attr] for _, row in store.items())
+                duplicates = [value for value, count in values.items() if count > 1]
+                assert not duplicates, f"Cannot make {node_name}.{attr} unique, {len(duplicates)} values are used more than once, e.g. {duplicates[0]!r}"
+
         ### modifications ###
         
         # 1) Remove links
@@ -94,34 +1048,47 @@ class DB:
 
             # schema
             self.db["schema"]["links"].remove((source, link, target))
+            source_still_linked = any((other_source, other_link) == (source, link) for (other_source, other_link, _) in self.db["schema"]["links"])
+            target_still_linked = any((other_link, other_target) == (link, target) for (_, other_link, other_target) in self.db["schema"]["links"])
 
             # ->
-            del self.db["->"][link][source]
-            if len(self.db["->"][link]) == 0:
-                del self.db["->"][link]
+            if not source_still_linked:
+                del self.db["->"][link][source]
+                if len(self.db["->"][link]) == 0:
+                    del self.db["->"][link]
 
             # <-
-            del self.db["<-"][link][target]
-            if len(self.db["<-"][link]) == 0:
-                del self.db["<-"][link]
+            if not target_still_linked:
+                del self.db["<-"][link][target]
+                if len(self.db["<-"][link]) == 0:
+                    del self.db["<-"][link]
             
             # node_links
-            self.db["node_links"][source].remove(link)
-            if len(self.db["node_links"][source]) == 0:
-                del self.db["node_links"][source]
+            if not source_still_linked:
+                self.db["node_links"][source].remove(link)
+                if len(self.db["node_links"][source]) == 0:
+                    del self.db["node_links"][source]
 
         # 2) Remove nodes
         for node_name in deleted_nodes:
             del self.db["schema"]["nodes"][node_name]
             del self.db["nodes"][node_name]
 
-        # 3) Add nodes
+        # 3) Swap in the rebuilt node types. Indexes of attributes that kept their name and type are still valid.
+        for node_name, (plan, store) in migrated.items():
+            self.db["schema"]["nodes"][node_name] = schema["nodes"][node_name]
+            self.db["nodes"][node_name] = store
+            for attr in list(self.db["indexes"].get(node_name, {})):
+                if plan.get(attr) != ("keep", attr):
+                    del self.db["indexes"][node_name][attr]
+
+        # 4) Add nodes
         for node_name in new_nodes:
             # add the node to the schema
             self.db["schema"]["nodes"][node_name] = schema["nodes"][node_name]
-            self.db["nodes"][node_name] = {}
+            self.db["nodes"][node_name] = _new_node_store(self.db.get("storage", "dict"), schema["nodes"][node_name])
 
-        # 4) Add links
+        # 5) Add links
         for (source, link, target) in new_links:
             
             # schema
@@ -130,151 +1097,769 @@ class DB:
             # ->
             if link not in self.db["->"]:
                 self.db["->"][link] = {}
-            self.db["->"][link][source] = {}
+            if source not in self.db["->"][link]:
+                self.db["->"][link][source] = {}
 
             # <-
             if link not in self.db["<-"]:
                 self.db["<-"][link] = {}
-            self.db["<-"][link][target] = {}
+            if target not in self.db["<-"][link]:
+                self.db["<-"][link][target] = {}
 
             # node_links
             if source not in self.db["node_links"]:
                 self.db["node_links"][source] = set()
             self.db["node_links"][source].add(link)
 
+        # 6) Build and drop indexes, unique attributes always have one
+        for key in ("indexes", "unique"):
+            if schema.get(key) or key in self.db["schema"]:
+                self.db["schema"][key] = schema.get(key, {})
+        self._update_indexes(_index_declarations(schema))
+
 
+    def _attribute_plan(self, node_name: str, attributes: dict, defaults: dict, renames: dict, converters: dict) -> dict | None:
+        # new attribute -> ("keep", old attr) | ("convert", old attr, function) | ("default", value), None when nothing changes
+        current = self.db["schema"]["nodes"][node_name]
+        for old, new in renames.items():
+            assert old in current, f"Cannot rename {node_name}.{old}, it is not an attribute"
+            assert new in attributes, f"Cannot rename {node_name}.{old} to {new}, {new} is not in the new schema"
+        sources = {new: old for old, new in renames.items()}
+        has_nodes = len(self.db["nodes"][node_name]) > 0
+        plan = {}
+        for attr, type_name in attributes.items():
+            source = sources.get(attr, attr if attr in current and attr not in renames else None)
+            if source is None:
+                assert attr in defaults or not has_nodes, f"Cannot add {node_name}.{attr} without a default, {node_name} has nodes"
+                assert attr not in defaults or type(defaults[attr]).__name__ == type_name, f"Default of {node_name}.{attr} must be a {type_name}"
+                plan[attr] = ("default", defaults.get(attr))
+            elif current[source] != type_name:
+                assert attr in converters or not has_nodes, f"Cannot change the type of {node_name}.{source} to {type_name} without a converter, {node_name} has nodes"
+                plan[attr] = ("convert", source, converters.get(attr))
+            else:
+                plan[attr] = ("keep", source)
+        unused = (set(defaults) - {attr for attr, step in plan.items() if step[0] == "default"}) | (set(converters) - {attr for attr, step in plan.items() if step[0] == "convert"})
+        assert not unused, f"Defaults or converters for {node_name} attributes that are not added or retyped: {sorted(unused)}"
+        if list(attributes.items()) == list(current.items()) and not renames:
+            return None
+        return plan
 
-    def migrate(self, schema):
-        schema = deepcopy(schema)
+
+    def _migrated_store(self, node_name: str, attributes: dict, plan: dict, chunk_size: int, progress) -> Any:
+        # a new store holding every node of the type with its attributes migrated, the old store is only read
+        store = self.db["nodes"][node_name]
+        migrated = _new_node_store(self.db.get("storage", "dict"), attributes)
+        validate = _row_validator(node_name, attributes)
+        kept = [(attr, step[1]) for attr, step in plan.items() if step[0] == "keep"]
+        converted = [(attr, step[1], step[2]) for attr, step in plan.items() if step[0] == "convert"]
+        added = {attr: step[1] for attr, step in plan.items() if step[0] == "default"}
+        order = list(attributes)
+        ids = iter(list(store.keys()))
+        done, total = 0, len(store)
+        while chunk := list(itertools.islice(ids, chunk_size)):
+            rows = []
+            for node_id in chunk:
+                row = store[node_id]
+                new_row = {attr: row[source] for attr, source in kept}
+                for attr, source, convert in converted:
+                    new_row[attr] = convert(row[source])
+                new_row.update(added)
+                rows.append({attr: new_row[attr] for attr in order})
+            validate(rows)
+            for node_id, row in zip(chunk, rows):
+                migrated[node_id] = row
+            done += len(chunk)
+            if progress is not None:
+                progress(node_name, done, total)
+        return migrated
+
+
+    def _own_structure(self):
+        # snapshot mode: copies the containers a migration may restructure, not the node stores or link sets
+        db = self._own_root()
+        schema = self._own(db, "schema")
+        for key in ("nodes", "links", "indexes", "unique"):
+            if key in schema:
+                self._own(schema, key)
+        for key in ("nodes", "->", "<-", "node_links", "indexes"):
+            self._own(db, key)
+        for direction in ["->", "<-"]:
+            for link in list(db[direction]):
+                self._own(db[direction], link)
+        for key in ("node_links", "indexes"):
+            for node_name in list(db[key]):
+                self._own(db[key], node_name)
+
+
+    def migrate(self, schema, defaults: dict | None = None, renames: dict | None = None, converters: dict | None = None, chunk_size: int = 100_000, progress=None):
+        # Attributes of existing node types can change too, per node name:
+        #   defaults:   {attr: value} for added attributes, required when the node type has nodes
+        #   renames:    {old attr: new attr}, without one a changed name is a drop plus an add
+        #   converters: {attr: function} mapping the old value of an attribute whose type changed to the new type
+        # Every node type with changed attributes is rebuilt into a new store and swapped in once all of them are
+        # built, so a failed migration changes nothing. This is not in place: while rebuilding, peak memory holds
+        # both the old and the new copy of every changed node type. The migration runs as one uninterrupted
+        # call, chunk_size only sets how often progress(node_name, done, total) is called.
+        assert self._transaction is None, "Cannot migrate inside a transaction"
+        if self._journal is not None and converters:
+            try:
+                pickle.dumps(converters)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                raise AssertionError("Converters must be picklable (module level functions) while a journal is open") from None
+        schema = _copy_schema(schema)
+        if self._cow and hasattr(self, "db"):
+            self._own_structure()
         if not hasattr(self, 'db'):
             self._init_schema(schema)
         else:
-            self._update_schema(schema)
+            self._update_schema(schema, defaults or {}, renames or {}, converters or {}, chunk_size, progress)
+        self._schema_changed()
+        if defaults or renames or converters:
+            self._log("migrate", schema, defaults, renames, converters)
+        else:
+            self._log("migrate", schema)
+
+
+    def _schema_changed(self):
+        # node_name -> [(direction, link, other_node_name)] for every link the node type takes part in, on either side
+        self._incident = {node_name: [] for node_name in self.db["schema"]["nodes"]}
+        for (source, link, target) in self.db["schema"]["links"]:
+            self._incident[source].append(("->", link, target))
+            self._incident[target].append(("<-", link, source))
+        self._validators = {node_name: _row_validator(node_name, attributes) for node_name, attributes in self.db["schema"]["nodes"].items()}
+
+        # derived read structures may refer to links or nodes that no longer exist
+        if self._csr is not None:
+            self._csr = {}
+            self._csr_stale = {}
+        self._stats = None
+        for (_, link, _) in self.db["schema"]["links"]:
+            self._link_versions[link] = self._link_versions.get(link, 0) + 1
+
+
+    def _links_changed(self, node_1_name: str, link: str, node_2_name: str, edges: int = 0, sources: int = 0, targets: int = 0, node_1_ids=(), node_2_ids=()):
+        # called once per write to a (source, link, target) triple, with the change in the number of edges
+        # and in the number of source and target ids that have at least one edge, and the ids whose links changed
+        if self._stats is not None:
+            counts = self._stats[(node_1_name, link, node_2_name)]
+            counts[0] += edges
+            counts[1] += sources
+            counts[2] += targets
+        self._link_versions[link] = self._link_versions.get(link, 0) + 1
+        if self._csr is not None:
+            for key, ids in [(("->", link, node_1_name, node_2_name), node_1_ids), (("<-", link, node_2_name, node_1_name), node_2_ids)]:
+                if key in self._csr:
+                    self._csr_stale.setdefault(key, set()).update(ids)
+
+
+    def get_id(self) -> Id:
+        return self.get_ids(1)[0]
+
 
+    def get_ids(self, count: int) -> List[Id]:
+        # hands out a whole range of ids in one step
+        if self._cow:
+            self._own_root()
+        current_id = self.db["current_id"]
+        if type(current_id) is int:
+            self.db["current_id"] = current_id + count
+            return list(range(current_id, current_id + count))
+        current_id = int(current_id)
+        self.db["current_id"] = str(current_id + count)
+        return list(map(str, range(current_id, current_id + count)))
 
-    def get_id(self) -> str:
-        current_id = int(self.db["current_id"])
-        self.db["current_id"] = str(current_id + 1)
-        return str(current_id)
 
+    def _as_ids(self, ids: List[Id] | None) -> List[Id] | None:
+        # translation layer: int id databases still accept the string ids older databases handed out
+        if ids is None or type(self.db["current_id"]) is not int:
+            return ids
+        return [node_id if type(node_id) is int or not node_id.isdigit() else int(node_id) for node_id in ids]
 
-    def create(self, node_name: str, attributes: List[dict]) -> List[Id]:
-        # 1) Check if the attributes are correct on write (only checks the first dictionary for speed purposes)
+
+    def _convert_ids(self, id_mode: str):
+        # rewrite every stored id (node stores and both adjacency directions) into the requested id mode
+        convert = int if id_mode == "int" else str
+        for node_name, store in self.db["nodes"].items():
+            if type(store) is dict:
+                self.db["nodes"][node_name] = {convert(node_id): row for node_id, row in store.items()}
+            elif type(store) is _Records:
+                store.rows = {convert(node_id): record for node_id, record in store.rows.items()}
+            else:
+                store.slots = {convert(node_id): slot for node_id, slot in store.slots.items()}
+        for direction in ["->", "<-"]:
+            for link in self.db[direction].values():
+                for node_name, node_ids in link.items():
+                    link[node_name] = {
+                        convert(node_id): {other: set(map(convert, other_ids)) for other, other_ids in others.items()}
+                        for node_id, others in node_ids.items()
+                    }
+        self.db["current_id"] = convert(self.db["current_id"])
+
+        # indexes hold ids too, rebuild them
+        self.db["indexes"] = {}
+        self._update_indexes(_index_declarations(self.db["schema"]))
+
+
+    def create(self, node_name: str, attributes: List[dict], trusted: bool = False, sample: int | None = None) -> List[Id]:
+        # Every row is checked against the schema unless trusted=True, for rows that were validated upstream,
+        # or sample=n, which checks n rows spread over the batch. Ids are handed out right away, also inside a
+        # transaction, where every row is checked and stored on commit.
+        if self._transaction is not None:
+            new_ids = self.get_ids(len(attributes))
+            self._transaction.append(("create", node_name, new_ids, attributes))
+            return new_ids
+        self._check_rows(node_name, attributes, sample, trusted)
+        self._check_unique(node_name, attributes)
+        current_id = self.db["current_id"]
+        new_ids = self.get_ids(len(attributes))
+        try:
+            self._insert_rows(node_name, new_ids, attributes)
+        except BaseException:
+            self.db["current_id"] = current_id  # a refused batch hands out no ids
+            raise
+        self._log("create", node_name, attributes)
+        return new_ids
+
+
+    def _check_rows(self, node_name: str, attributes: List[dict], sample: int | None = None, trusted: bool = False):
         assert type(attributes) == list, "'attributes' parameter in pysgdb create() function must be a list"
         assert len(attributes) > 0, "Must send at least one set of attributes to the create() function"
         assert node_name in self.db["schema"]["nodes"], "Node name does not exist in schema"
-        first_attribute_set = attributes[0]
-        assert len(first_attribute_set) == len(self.db["schema"]["nodes"][node_name]), "Wrong number or attributes given in create()"
-        
-        # 2) For each attr: check if the types are aligned
-        for attribute_name, attribute_type in self.db["schema"]["nodes"][node_name].items():
-            assert attribute_name in first_attribute_set, f"Wrong attribute name found when creating a node in create(): {attribute_name}"
-            assert type(first_attribute_set[attribute_name]).__name__ == attribute_type, "Type mismatch in db create()"
+        if trusted:
+            return  # the rows themselves were checked upstream
+        validate = self._validators[node_name]
+        if sample is not None and len(attributes) > sample:
+            assert sample > 0, f"Invalid sample size: {sample}"
+            try:
+                return validate(attributes[::len(attributes) // sample][:sample])
+            except AssertionError:
+                pass  # check the whole batch, so the message points at the first bad row
+        validate(attributes)
+
+
+    def _check_unique(self, node_name: str, attributes: List[dict], ids: List[Id] | None = None, claimed: dict | None = None):
+        # Unique attribute values must not be held by another node, in the index or earlier in the batch.
+        # ids=None is for rows that have no id yet, negative positions stand in for them. claimed maps (node_name, attr) -> {value: id or None} for
+        # values taken (or freed, None) by earlier operations that the index does not show yet.
+        unique = self.db["schema"].get("unique", {}).get(node_name)
+        if not unique:
+            return
+        owners = range(-1, -len(attributes) - 1, -1) if ids is None else ids
+        claimed = {} if claimed is None else claimed
+        for attr in unique:
+            index = self.db["indexes"][node_name][attr]
+            taken = claimed.setdefault((node_name, attr), {})
+            for owner, row in zip(owners, attributes):
+                value = row[attr]
+                if value in taken:
+                    holder = taken[value]
+                else:
+                    holders = index.equal(value)
+                    holders.discard(owner)
+                    holder = next(iter(holders), None)
+                assert holder is None or holder == owner, f"Duplicate {node_name}.{attr}: {value!r} is used by more than one node"
+                taken[value] = owner
 
+
+    def _insert_rows(self, node_name: str, ids: List[Id], attributes: List[dict]):
+        if self._cow:
+            self._own_store(node_name)
         # 3) Save new entity to db
-        new_ids = []
-        for attribute_set in attributes:
-            new_id = self.get_id()
-            self.db["nodes"][node_name][new_id] = attribute_set
-            new_ids.append(new_id)
-        return new_ids
+        store = self.db["nodes"][node_name]
+        try:
+            for new_id, attribute_set in zip(ids, attributes):
+                store[new_id] = attribute_set
+        except BaseException:
+            # a store refused a row (e.g. a trusted row of the wrong type), take back the ones stored before it
+            for stored_id in ids[:ids.index(new_id)]:
+                del store[stored_id]
+            raise
+
+        # 4) Keep the node's indexes up to date
+        for attr, index in self.db["indexes"].get(node_name, {}).items():
+            index.add_many([(attribute_set[attr], new_id) for new_id, attribute_set in zip(ids, attributes)])
+
+
+    def _update_rows(self, node_name: str, ids: List[Id], attributes: List[dict]):
+        # replaces the rows of existing nodes, index entries move only for the values that changed
+        if self._cow:
+            self._own_store(node_name)
+        store = self.db["nodes"][node_name]
+        indexes = self.db["indexes"].get(node_name, {})
+        rows = [store[node_id] for node_id in ids] if indexes else []
+        for attr, index in indexes.items():
+            moved = [(row[attr], attribute_set[attr], node_id) for node_id, row, attribute_set in zip(ids, rows, attributes) if row[attr] != attribute_set[attr]]
+            index.remove_many([(old, node_id) for old, _, node_id in moved])
+            index.add_many([(new, node_id) for _, new, node_id in moved])
+        for node_id, attribute_set in zip(ids, attributes):
+            store[node_id] = attribute_set
+
+
+    def upsert(self, node_name: str, rows: List[dict], key: str) -> List[Id]:
+        # Looks up every row by its unique key attribute: rows with a new key value are created, the others are
+        # merged into the node holding that value, which keeps the attributes the row leaves out. Rows with the
+        # same key value in one batch merge into one node. Returns the id of every row, in order.
+        assert self._transaction is None, "Cannot upsert inside a transaction"
+        assert type(rows) == list and len(rows) > 0, "Must send a non-empty list of rows to upsert()"
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        assert key in self.db["schema"].get("unique", {}).get(node_name, ()), f"Cannot upsert by {node_name}.{key} because it is not unique"
+        index = self.db["indexes"][node_name][key]
+        store = self.db["nodes"][node_name]
+
+        result, updated, new = [], {}, {}  # new: key value -> row
+        for row in rows:
+            assert type(row) == dict and key in row, f"Every row must be a dict with its key: '{key}'"
+            value = row[key]
+            holder = next(iter(index.equal(value)), None)
+            if holder is None:
+                new[value] = {**new[value], **row} if value in new else row
+            else:
+                updated[holder] = {**updated.get(holder, store[holder]), **row}
+            result.append(holder)
+        updated = {node_id: row for node_id, row in updated.items() if row != store[node_id]}
+
+        # check everything before changing anything
+        if updated:
+            self._validators[node_name](list(updated.values()))
+        if new:
+            self._validators[node_name](list(new.values()))
+        claimed = {}
+        for attr in self.db["schema"]["unique"][node_name]:
+            claimed[(node_name, attr)] = {store[node_id][attr]: None for node_id, row in updated.items() if row[attr] != store[node_id][attr]}
+        self._check_unique(node_name, [*updated.values(), *new.values()], [*updated, *range(-1, -len(new) - 1, -1)], claimed)
+
+        if updated:
+            self._update_rows(node_name, list(updated), list(updated.values()))
+        if new:
+            new_ids = dict(zip(new, self.get_ids(len(new))))
+            self._insert_rows(node_name, list(new_ids.values()), list(new.values()))
+            result = [new_ids[row[key]] if node_id is None else node_id for node_id, row in zip(result, rows)]
+        if updated or new:
+            self._log("upsert", node_name, rows, key)
+        return result
 
 
     def delete(self, node_name: str, ids: List[Id]):
+        if self._transaction is not None:
+            self._transaction.append(("delete", node_name, list(self._as_ids(ids))))
+            return
         assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
-        
+        ids = list(dict.fromkeys(self._as_ids(ids)))
+        self._check_ids(node_name, ids)
+
+        # delete links in both directions, then the nodes themselves
+        self._remove_node_links(node_name, ids)
+        self._delete_rows(node_name, ids)
+        self._log("delete", node_name, ids)
+
+
+    def _delete_rows(self, node_name: str, ids: List[Id]):
+        if self._cow:
+            self._own_store(node_name)
+        store = self.db["nodes"][node_name]
+        indexes = self.db["indexes"].get(node_name, {})
+        rows = [store[node_id] for node_id in ids] if indexes else []
+        for attr, index in indexes.items():
+            index.remove_many([(row[attr], node_id) for node_id, row in zip(ids, rows)])
         for node_id in ids:
-            # validate if the node_id exists
-            assert node_id in self.db["nodes"][node_name], f"ID: {node_id} not found in {node_name} nodes"
-            
-            # delete links in both directions
-            links_to_check = self.db["node_links"].get(node_name, set())
-            for link in links_to_check:
-                for direction, opposite_direction in [("->", "<-"), ("<-", "->")]: # TODO check for bug, opposite_direction
-                    targets_to_unlink = []
-                    try:
-                        for target_node, target_ids in self.db[direction][link][node_name][node_id].items():
-                            targets_to_unlink.extend((target_node, tid) for tid in target_ids)
-                    except KeyError:
-                        continue  # No links in this direction for this node
-                    
-                    # Using self.unlink to remove links
-                    for target_node, target_id in targets_to_unlink:
-                        self.unlink(node_name, [node_id], link, target_node, [target_id])
-            
-            # delete node from db["nodes"]
-            del self.db["nodes"][node_name][node_id]
+            del store[node_id]
+
+
+    def _remove_node_links(self, node_name: str, ids: List[Id]):
+        # Removes every link to or from the given ids, whichever side of the link the node is on.
+        # Each link the node type takes part in is handled in one pass over the ids, and only the
+        # neighbors of those ids are visited. Neighbor containers left empty are cleaned up once per pass.
+        if self._cow:
+            self._own_node_links(node_name, ids)
+        for direction, link, other_node_name in self._incident[node_name]:
+            opposite_direction = "<-" if direction == "->" else "->"
+            adjacency = self.db[direction][link][node_name]
+            reverse = self.db[opposite_direction][link][other_node_name]
+
+            touched = set()
+            removed = unlinked = unlinked_neighbors = 0
+            for node_id in ids:
+                others = adjacency.get(node_id)
+                if others is None:
+                    continue
+                neighbor_ids = others.pop(other_node_name, None)
+                if not others:
+                    del adjacency[node_id]
+                if neighbor_ids is None:
+                    continue
+                removed += len(neighbor_ids)
+                unlinked += 1
+                for neighbor_id in neighbor_ids:
+                    neighbor = reverse.get(neighbor_id)
+                    if neighbor is not None and node_name in neighbor:
+                        neighbor[node_name].discard(node_id)
+                touched.update(neighbor_ids)
+
+            if not touched:
+                continue
+            for neighbor_id in touched:
+                neighbor = reverse.get(neighbor_id)
+                if neighbor is not None and node_name in neighbor and not neighbor[node_name]:
+                    del neighbor[node_name]
+                    unlinked_neighbors += 1
+                    if not neighbor:
+                        del reverse[neighbor_id]
+            if direction == "->":
+                self._links_changed(node_name, link, other_node_name, -removed, -unlinked, -unlinked_neighbors, ids, touched)
+            else:
+                self._links_changed(other_node_name, link, node_name, -removed, -unlinked_neighbors, -unlinked, touched, ids)
 
 
     def link(self, node_1_name: str, node_1_ids: List[Id], link: str, node_2_name: str, node_2_ids: List[Id]):
+        if self._transaction is not None:
+            self._transaction.append(("link", node_1_name, list(self._as_ids(node_1_ids)), link, node_2_name, list(self._as_ids(node_2_ids))))
+            return
         # Validate if node names and link are in schema
         assert node_1_name in self.db["schema"]["nodes"], f"Cannot create link, node name: {node_1_name} not in schema"
         assert node_2_name in self.db["schema"]["nodes"], f"Cannot create link, node name: {node_2_name} not in schema"
         assert (node_1_name, link, node_2_name) in self.db["schema"]["links"], f"Cannot create link, link name: {link} not in schema"
-        # TODO: above assert may be slow - check
+        node_1_ids, node_2_ids = self._as_ids(node_1_ids), self._as_ids(node_2_ids)
+        self._check_ids(node_1_name, node_1_ids)
+        self._check_ids(node_2_name, node_2_ids)
 
-        # Loop through each ID in node_1_ids and node_2_ids and create links
-        for node_1_id in node_1_ids:
-            # Make sure the ID exists in the nodes
-            assert node_1_id in self.db["nodes"][node_1_name], f"ID: {node_1_id} not found in {node_1_name} nodes"
-            
-            for node_2_id in node_2_ids:
-                # Make sure the ID exists in the nodes
-                assert node_2_id in self.db["nodes"][node_2_name], f"ID: {node_2_id} not found in {node_2_name} nodes"
-                
-                # Create links for the -> direction
-                if node_1_id not in self.db["->"][link][node_1_name]:
-                    self.db["->"][link][node_1_name][node_1_id] = {}
-                if node_2_name not in self.db["->"][link][node_1_name][node_1_id]:
-                    self.db["->"][link][node_1_name][node_1_id][node_2_name] = set()
-                self.db["->"][link][node_1_name][node_1_id][node_2_name].add(node_2_id)
-                
-                # Create links for the <- direction
-                if node_2_id not in self.db["<-"][link][node_2_name]:
-                    self.db["<-"][link][node_2_name][node_2_id] = {}
-                if node_1_name not in self.db["<-"][link][node_2_name][node_2_id]:
-                    self.db["<-"][link][node_2_name][node_2_id][node_1_name] = set()
-                self.db["<-"][link][node_2_name][node_2_id][node_1_name].add(node_1_id)
+        # Link each ID in node_1_ids to every ID in node_2_ids
+        targets = set(node_2_ids)
+        self._add_edges(node_1_name, link, node_2_name, {node_1_id: targets for node_1_id in node_1_ids})
+        self._log("link", node_1_name, node_1_ids, link, node_2_name, node_2_ids)
 
 
     def unlink(self, node_1_name: str, node_1_ids: List[Id], link: str, node_2_name: str, node_2_ids: List[Id]):
+        if self._transaction is not None:
+            self._transaction.append(("unlink", node_1_name, list(self._as_ids(node_1_ids)), link, node_2_name, list(self._as_ids(node_2_ids))))
+            return
         assert node_1_name in self.db["schema"]["nodes"], f"Node name: {node_1_name} not in schema"
         assert node_2_name in self.db["schema"]["nodes"], f"Node name: {node_2_name} not in schema"
         assert (node_1_name, link, node_2_name) in self.db["schema"]["links"], f"Link: {link} not in schema between {node_1_name} and {node_2_name}"
-        
-        for node_1_id in node_1_ids:
-            assert node_1_id in self.db["nodes"][node_1_name], f"ID: {node_1_id} not found in {node_1_name} nodes"
-            
-            for node_2_id in node_2_ids:
-                assert node_2_id in self.db["nodes"][node_2_name], f"ID: {node_2_id} not found in {node_2_name} nodes"
-                
-                try:
-                    self.db["->"][link][node_1_name][node_1_id][node_2_name].remove(node_2_id)
-                    if not self.db["->"][link][node_1_name][node_1_id][node_2_name]:
-                        del self.db["->"][link][node_1_name][node_1_id][node_2_name]
-                        
-                    if not self.db["->"][link][node_1_name][node_1_id]:
-                        del self.db["->"][link][node_1_name][node_1_id]
-                except KeyError:
-                    pass  # Link didn’t exist, so nothing to unlink
-                
-                try:
-                    self.db["<-"][link][node_2_name][node_2_id][node_1_name].remove(node_1_id)
-                    if not self.db["<-"][link][node_2_name][node_2_id][node_1_name]:
-                        del self.db["<-"][link][node_2_name][node_2_id][node_1_name]
-                        
-                    if not self.db["<-"][link][node_2_name][node_2_id]:
-                        del self.db["<-"][link][node_2_name][node_2_id]
-                except KeyError:
-                    pass  # Link didn’t exist, so nothing to unlink
+        node_1_ids, node_2_ids = self._as_ids(node_1_ids), self._as_ids(node_2_ids)
+        self._check_ids(node_1_name, node_1_ids)
+        self._check_ids(node_2_name, node_2_ids)
 
+        targets = set(node_2_ids)
+        self._remove_edges(node_1_name, link, node_2_name, {node_1_id: targets for node_1_id in node_1_ids})
+        self._log("unlink", node_1_name, node_1_ids, link, node_2_name, node_2_ids)
 
-    def get(self, node_name: str, ids: List[Id] | None, attributes: List[str]) -> List[List[Any]]:
-        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
-        for attr in attributes:
-            if attr != "id":
-                assert attr in self.db["schema"]["nodes"][node_name], f"Attribute: {attr} not found in {node_name} nodes"
-        
+
+    def link_many(self, node_1_name: str, node_1_ids: List[Id], link: str, node_2_name: str, node_2_ids: List[Id] | None = None) -> int:
+        # Pairwise link: node_1_ids[i] is linked to node_2_ids[i] only, instead of every id to every id like link().
+        # node_1_ids can also be an iterable of (node_1_id, node_2_id) pairs, with node_2_ids left out.
+        # The schema and all ids are checked once per batch. Returns the number of links that did not exist yet.
+        if self._transaction is not None:
+            node_1_ids, node_2_ids = self._pairwise(node_1_ids, node_2_ids)
+            self._transaction.append(("link_many", node_1_name, node_1_ids, link, node_2_name, node_2_ids))
+            return 0  # nothing is linked before the transaction commits
+        assert node_1_name in self.db["schema"]["nodes"], f"Cannot create link, node name: {node_1_name} not in schema"
+        assert node_2_name in self.db["schema"]["nodes"], f"Cannot create link, node name: {node_2_name} not in schema"
+        assert (node_1_name, link, node_2_name) in self.db["schema"]["links"], f"Cannot create link, link name: {link} not in schema"
+        node_1_ids, node_2_ids = self._pairwise(node_1_ids, node_2_ids)
+        self._check_ids(node_1_name, node_1_ids)
+        self._check_ids(node_2_name, node_2_ids)
+
+        added = self._add_edges(node_1_name, link, node_2_name, _group_pairs(node_1_ids, node_2_ids))
+        self._log("link_many", node_1_name, node_1_ids, link, node_2_name, node_2_ids)
+        return added
+
+
+    def unlink_many(self, node_1_name: str, node_1_ids: List[Id], link: str, node_2_name: str, node_2_ids: List[Id] | None = None) -> int:
+        # Pairwise unlink, see link_many(). Returns the number of links that were removed.
+        if self._transaction is not None:
+            node_1_ids, node_2_ids = self._pairwise(node_1_ids, node_2_ids)
+            self._transaction.append(("unlink_many", node_1_name, node_1_ids, link, node_2_name, node_2_ids))
+            return 0
+        assert node_1_name in self.db["schema"]["nodes"], f"Node name: {node_1_name} not in schema"
+        assert node_2_name in self.db["schema"]["nodes"], f"Node name: {node_2_name} not in schema"
+        assert (node_1_name, link, node_2_name) in self.db["schema"]["links"], f"Link: {link} not in schema between {node_1_name} and {node_2_name}"
+        node_1_ids, node_2_ids = self._pairwise(node_1_ids, node_2_ids)
+        self._check_ids(node_1_name, node_1_ids)
+        self._check_ids(node_2_name, node_2_ids)
+
+        removed = self._remove_edges(node_1_name, link, node_2_name, _group_pairs(node_1_ids, node_2_ids))
+        self._log("unlink_many", node_1_name, node_1_ids, link, node_2_name, node_2_ids)
+        return removed
+
+
+    def _pairwise(self, node_1_ids, node_2_ids) -> Tuple[List[Id], List[Id]]:
+        if node_2_ids is None:
+            pairs = list(node_1_ids)
+            node_1_ids = [pair[0] for pair in pairs]
+            node_2_ids = [pair[1] for pair in pairs]
+        node_1_ids, node_2_ids = list(self._as_ids(node_1_ids)), list(self._as_ids(node_2_ids))
+        assert len(node_1_ids) == len(node_2_ids), f"Cannot pair {len(node_1_ids)} ids with {len(node_2_ids)} ids"
+        return node_1_ids, node_2_ids
+
+
+    def _check_ids(self, node_name: str, ids: List[Id]):
+        # each distinct id is looked up once per batch instead of once per edge
+        store = self.db["nodes"][node_name]
+        missing = [node_id for node_id in set(ids) if node_id not in store]
+        assert not missing, f"ID: {missing[0]} not found in {node_name} nodes"
+
+
+    def _add_edges(self, node_1_name: str, link: str, node_2_name: str, edges: dict, changes: list | None = None) -> int:
+        # edges: node_1_id -> node_2_ids. Each dict level is resolved once per source id.
+        # The (node_1_id, node_2_ids) actually added are appended to `changes` when it is given.
+        if self._cow:
+            self._own_edges(node_1_name, link, node_2_name, edges)
+        forward = self.db["->"][link][node_1_name]
+        backward = self.db["<-"][link][node_2_name]
+        added = new_sources = new_targets_linked = 0
+        for node_1_id, node_2_ids in edges.items():
+            others = forward.get(node_1_id)
+            targets = None if others is None else others.get(node_2_name)
+            new_targets = set(node_2_ids) if targets is None else set(node_2_ids) - targets
+            if not new_targets:
+                continue  # leaves no empty containers behind
+            if others is None:
+                others = forward[node_1_id] = {}
+            if targets is None:
+                targets = others[node_2_name] = set()
+                new_sources += 1
+            targets |= new_targets
+            added += len(new_targets)
+            if changes is not None:
+                changes.append((node_1_id, new_targets))
+
+            for node_2_id in new_targets:
+                others = backward.get(node_2_id)
+                if others is None:
+                    others = backward[node_2_id] = {}
+                sources = others.get(node_1_name)
+                if sources is None:
+                    sources = others[node_1_name] = set()
+                    new_targets_linked += 1
+                sources.add(node_1_id)
+        self._links_changed(node_1_name, link, node_2_name, added, new_sources, new_targets_linked, edges, set().union(*edges.values()) if self._csr is not None else ())
+        return added
+
+
+    def _remove_edges(self, node_1_name: str, link: str, node_2_name: str, edges: dict, changes: list | None = None) -> int:
+        # edges: node_1_id -> node_2_ids. Containers left empty are removed.
+        # The (node_1_id, node_2_ids) actually removed are appended to `changes` when it is given.
+        if self._cow:
+            self._own_edges(node_1_name, link, node_2_name, edges)
+        forward = self.db["->"][link][node_1_name]
+        backward = self.db["<-"][link][node_2_name]
+        removed = unlinked_sources = unlinked_targets = 0
+        for node_1_id, node_2_ids in edges.items():
+            others = forward.get(node_1_id)
+            if others is None or node_2_name not in others:
+                continue  # no links from this id, so nothing to unlink
+            targets = others[node_2_name]
+            old_targets = targets.intersection(node_2_ids)
+            if not old_targets:
+                continue
+            targets -= old_targets
+            removed += len(old_targets)
+            if changes is not None:
+                changes.append((node_1_id, old_targets))
+            if not targets:
+                del others[node_2_name]
+                unlinked_sources += 1
+                if not others:
+                    del forward[node_1_id]
+
+            for node_2_id in old_targets:
+                others = backward[node_2_id]
+                others[node_1_name].discard(node_1_id)
+                if not others[node_1_name]:
+                    del others[node_1_name]
+                    unlinked_targets += 1
+                    if not others:
+                        del backward[node_2_id]
+        self._links_changed(node_1_name, link, node_2_name, -removed, -unlinked_sources, -unlinked_targets, edges, set().union(*edges.values()) if self._csr is not None else ())
+        return removed
+
+
+    @contextmanager
+    def transaction(self):
+        # Buffers create, delete, link, unlink, link_many and unlink_many until the block exits, then
+        # validates them together and applies them in one pass. Nothing is written if the block raises
+        # or if any operation is invalid. create() still returns its ids right away. Reads inside the
+        # block see the database as it was before the transaction.
+        assert hasattr(self, "db"), "Cannot start a transaction before a schema is migrated"
+        assert self._transaction is None, "Transactions cannot be nested"
+        with self.write_lock or nullcontext():
+            start_id = self.db["current_id"]
+            self._transaction = []
+            try:
+                yield self
+                operations = self._transaction
+            finally:
+                self._transaction = None
+                end_id, self.db["current_id"] = self.db["current_id"], start_id
+
+            self._commit(operations, end_id)
+            self._log("_commit", operations, end_id)
+
+
+    def _commit(self, operations: List[tuple], current_id: Id):
+        # also replays the single journal record a transaction is logged as
+        self._check_transaction(operations)
+        undo = []
+        try:
+            for step in self._plan(operations):
+                self._apply(step, undo)
+        except BaseException:
+            for reverse_step in reversed(undo):
+                reverse_step()
+            raise
+        self.db["current_id"] = current_id
+
+
+    def _check_transaction(self, operations: List[tuple]):
+        # Ids created earlier in the transaction count as existing, deleted ones as gone.
+        # Each node type and link is looked up in the schema once. Unique values freed by a delete can be
+        # taken by a later create.
+        created, deleted, checked = {}, {}, set()
+        unique, created_rows, claimed = self.db["schema"].get("unique", {}), {}, {}
+
+        def check_ids(node_name: str, ids: List[Id]):
+            store = self.db["nodes"][node_name]
+            new_ids, gone_ids = created.get(node_name, ()), deleted.get(node_name, ())
+            missing = [node_id for node_id in set(ids) if (node_id not in store and node_id not in new_ids) or node_id in gone_ids]
+            assert not missing, f"ID: {missing[0]} not found in {node_name} nodes"
+
+        for operation in operations:
+            kind, node_name = operation[0], operation[1]
+            if kind == "create":
+                self._check_rows(node_name, operation[3])
+                self._check_unique(node_name, operation[3], operation[2], claimed)
+                created.setdefault(node_name, set()).update(operation[2])
+                if node_name in unique:
+                    created_rows.setdefault(node_name, {}).update(zip(operation[2], operation[3]))
+            elif kind == "delete":
+                assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+                check_ids(node_name, operation[2])
+                deleted.setdefault(node_name, set()).update(operation[2])
+                for attr in unique.get(node_name, ()):
+                    taken = claimed.setdefault((node_name, attr), {})
+                    for node_id in operation[2]:
+                        row = created_rows[node_name][node_id] if node_id in created_rows.get(node_name, ()) else self.db["nodes"][node_name][node_id]
+                        taken[row[attr]] = None
+            else:
+                _, node_1_name, node_1_ids, link, node_2_name, node_2_ids = operation
+                if (node_1_name, link, node_2_name) not in checked:
+                    assert (node_1_name, link, node_2_name) in self.db["schema"]["links"], f"Link: {link} not in schema between {node_1_name} and {node_2_name}"
+                    checked.add((node_1_name, link, node_2_name))
+                check_ids(node_1_name, node_1_ids)
+                check_ids(node_2_name, node_2_ids)
+
+
+    def _plan(self, operations: List[tuple]) -> List[tuple]:
+        # Creates only add new ids, so they are applied first, one step per node type. Consecutive
+        # link (or unlink) operations on the same link are merged into one step. Everything else keeps its order.
+        creates, steps = {}, []
+        for operation in operations:
+            kind = operation[0]
+            if kind == "create":
+                _, node_name, ids, attributes = operation
+                if node_name not in creates:
+                    creates[node_name] = ("create", node_name, [], [])
+                creates[node_name][2].extend(ids)
+                creates[node_name][3].extend(attributes)
+                continue
+            if kind == "delete":
+                steps.append(operation)
+                continue
+
+            _, node_1_name, node_1_ids, link, node_2_name, node_2_ids = operation
+            kind = "link" if kind.startswith("link") else "unlink"
+            if not steps or steps[-1][:4] != (kind, node_1_name, link, node_2_name):
+                steps.append((kind, node_1_name, link, node_2_name, {}))
+            edges = steps[-1][4]
+            if operation[0] in ("link", "unlink"):
+                for node_1_id in node_1_ids:
+                    if node_1_id in edges:
+                        edges[node_1_id].update(node_2_ids)
+                    else:
+                        edges[node_1_id] = set(node_2_ids)
+            else:
+                for node_1_id, node_2_id in zip(node_1_ids, node_2_ids):
+                    if node_1_id in edges:
+                        edges[node_1_id].add(node_2_id)
+                    else:
+                        edges[node_1_id] = {node_2_id}
+        return list(creates.values()) + steps
+
+
+    def _apply(self, step: tuple, undo: list):
+        # applies one planned step and appends what reverses it to `undo`
+        kind = step[0]
+        if kind == "create":
+            _, node_name, ids, attributes = step
+            self._insert_rows(node_name, ids, attributes)
+            undo.append(partial(self._delete_rows, node_name, ids))
+        elif kind == "delete":
+            _, node_name, ids = step
+            ids = list(dict.fromkeys(ids))
+            store = self.db["nodes"][node_name]
+            rows = [dict(store[node_id]) for node_id in ids]
+            edges = self._node_edges(node_name, ids)
+            self._remove_node_links(node_name, ids)
+            self._delete_rows(node_name, ids)
+            for edge in edges:
+                undo.append(partial(self._add_edges, *edge))
+            undo.append(partial(self._restore_rows, node_name, ids, rows))
+        else:
+            _, node_1_name, link, node_2_name, edges = step
+            changes = []
+            if kind == "link":
+                self._add_edges(node_1_name, link, node_2_name, edges, changes)
+                undo.append(partial(self._remove_edges, node_1_name, link, node_2_name, dict(changes)))
+            else:
+                self._remove_edges(node_1_name, link, node_2_name, edges, changes)
+                undo.append(partial(self._add_edges, node_1_name, link, node_2_name, dict(changes)))
+
+
+    def _restore_rows(self, node_name: str, ids: List[Id], attributes: List[dict]):
+        # puts deleted rows back where they were: stores keep id order (see _ids_after), a plain insert appends
+        store = self.db["nodes"][node_name]
+        order = [int(node_id) for node_id in itertools.chain(itertools.islice(reversed(store.keys()), 1), ids)]
+        self._insert_rows(node_name, ids, attributes)
+        if order == sorted(order):
+            return
+        keys = store.rows if type(store) is _Records else store.slots if type(store) is _Columns else store
+        ordered = {node_id: keys[node_id] for node_id in sorted(keys, key=int)}
+        keys.clear()
+        keys.update(ordered)
+
+
+    def _node_edges(self, node_name: str, ids: List[Id]) -> List[tuple]:
+        # every link to or from the given ids, as (node_1_name, link, node_2_name, node_1_id -> node_2_ids)
+        edges = []
+        for direction, link, other_node_name in self._incident[node_name]:
+            adjacency = self.db[direction][link][node_name]
+            if direction == "->":
+                pairs = {node_id: set(adjacency[node_id][other_node_name]) for node_id in ids if other_node_name in adjacency.get(node_id, ())}
+                edges.append((node_name, link, other_node_name, pairs))
+            else:
+                pairs = {}
+                for node_id in ids:
+                    for other_id in adjacency.get(node_id, {}).get(other_node_name, ()):
+                        pairs.setdefault(other_id, set()).add(node_id)
+                edges.append((other_node_name, link, node_name, pairs))
+        return edges
+
+
+    def get(self, node_name: str, ids: List[Id] | None, attributes: List[str]) -> List[List[Any]]:
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        for attr in attributes:
+            if attr != "id":
+                assert attr in self.db["schema"]["nodes"][node_name], f"Attribute: {attr} not found in {node_name} nodes"
+        ids = self._as_ids(ids)
+
+        store = self.db["nodes"][node_name]
+        if type(store) is not dict:
+            if ids == None:
+                return [store.row(node_id, attributes) for node_id in store]
+            for node_id in ids:
+                assert node_id in store, f"ID: {node_id} not found in {node_name} nodes"
+            return [store.row(node_id, attributes) for node_id in ids]
+        
         if ids == None:
             result = []
             for node_id in self.db["nodes"][node_name]:
@@ -300,14 +1885,187 @@ class DB:
         return result
 
 
+    def find(self, node_name: str, where: dict) -> List[Id]:
+        # ids of the nodes matching every condition in where: {attr: value} for equality,
+        # {attr: slice(low, high)} for low <= value < high. Indexed attributes are looked up,
+        # the remaining conditions are checked on the candidates (or on every node if nothing is indexed).
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        for attr in where:
+            assert attr in self.db["schema"]["nodes"][node_name], f"Attribute: {attr} not found in {node_name} nodes"
+
+        indexes = self.db["indexes"].get(node_name, {})
+        matches = []
+        unindexed = {}
+        for attr, condition in where.items():
+            index = indexes.get(attr)
+            if index is None or (type(condition) is slice and type(index) is not _SortedIndex):
+                unindexed[attr] = condition
+            elif type(condition) is slice:
+                matches.append(index.range(condition.start, condition.stop))
+            else:
+                matches.append(index.equal(condition))
+
+        store = self.db["nodes"][node_name]
+        if matches:
+            matches.sort(key=len)
+            candidates = matches[0].intersection(*matches[1:])
+        else:
+            candidates = store
+
+        if not unindexed:
+            return list(candidates)
+
+        def matches_all(row: dict) -> bool:
+            for attr, condition in unindexed.items():
+                value = row[attr]
+                if type(condition) is slice:
+                    if (condition.start is not None and value < condition.start) or (condition.stop is not None and value >= condition.stop):
+                        return False
+                elif value != condition:
+                    return False
+            return True
+        return [node_id for node_id in candidates if matches_all(store[node_id])]
+
+
+    def get_iter(self, node_name: str, ids: List[Id] | None, attributes: List[str], batch_size: int | None = None, columns: bool = False, after: Id | None = None) -> Iterator[Any]:
+        # Lazy get(): yields one row at a time, or with batch_size lists of up to batch_size rows (one list per
+        # attribute with columns=True, like get_columns()). Only one batch is held in memory at a time.
+        # With ids None the whole node type is read in id order, which is creation order, starting after the
+        # id given in after (see page()). Writes between two batches are seen by the batches after them.
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        for attr in attributes:
+            if attr != "id":
+                assert attr in self.db["schema"]["nodes"][node_name], f"Attribute: {attr} not found in {node_name} nodes"
+        assert batch_size is None or batch_size > 0, f"Invalid batch size: {batch_size}"
+        assert batch_size is not None or not columns, "Column batches need a batch_size"
+        assert ids is None or after is None, "after only applies when reading a whole node type"
+        read = self.get_columns if columns else self.get
+
+        def batches():
+            if ids is not None:
+                remaining = iter(ids)
+                while chunk := list(itertools.islice(remaining, batch_size or 1000)):
+                    yield read(node_name, chunk, attributes)
+                return
+            last_id = after
+            while chunk := self._ids_after(node_name, last_id, batch_size or 1000):
+                last_id = chunk[-1]
+                yield read(node_name, chunk, attributes)
+
+        if batch_size is not None:
+            return batches()
+        return itertools.chain.from_iterable(batches())
+
+
+    def page(self, node_name: str, attributes: List[str], limit: int, token: str | None = None, columns: bool = False) -> Tuple[List[Any], str | None]:
+        # One page of up to limit rows of a node type in id order, and the token to pass to get the next
+        # page (None after the last one). Tokens stay valid across writes: the next page starts right after
+        # the last id of this one, even if that node was deleted since.
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        assert limit > 0, f"Invalid page size: {limit}"
+        assert token is None or (type(token) is str and token.isdigit()), f"Invalid page token: {token}"
+        ids = self._ids_after(node_name, None if token is None else int(token), limit)
+        batch = (self.get_columns if columns else self.get)(node_name, ids, attributes)
+        return batch, (str(ids[-1]) if len(ids) == limit else None)
+
+
+    def _ids_after(self, node_name: str, last_id: Id | None, count: int) -> List[Id]:
+        # Up to count ids of the node type that come after last_id in id order. Ids are handed out in increasing
+        # order and stores keep insertion order (a rolled back delete puts its rows back in place, see
+        # _restore_rows()), so that is the store's own order. The ids following last_id are probed directly,
+        # which is cheap when the node type holds most of them, with a scan of the store as the fallback once
+        # probing has cost as much as that scan would.
+        store = self.db["nodes"][node_name]
+        if last_id is None:
+            return list(itertools.islice(iter(store), count))
+        convert = int if type(self.db["current_id"]) is int else str
+        start, end = int(last_id) + 1, int(self.db["current_id"])
+        found = []
+        window = max(count * 4, 1024)
+        while start < end and start - int(last_id) <= len(store):
+            candidates = filter(store.__contains__, map(convert, range(start, min(end, start + window))))
+            found.extend(itertools.islice(candidates, count - len(found)))
+            if len(found) == count:
+                return found
+            start += window
+        if start >= end:
+            return found
+        last = int(found[-1]) if found else int(last_id)
+        return found + list(itertools.islice(itertools.dropwhile(lambda node_id: int(node_id) <= last, iter(store)), count - len(found)))
+
+
+    def get_columns(self, node_name: str, ids: List[Id] | None, attributes: List[str]) -> List[List[Any]]:
+        # same as get(), but returns one list per attribute instead of one list per node
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        for attr in attributes:
+            if attr != "id":
+                assert attr in self.db["schema"]["nodes"][node_name], f"Attribute: {attr} not found in {node_name} nodes"
+        ids = self._as_ids(ids)
+
+        store = self.db["nodes"][node_name]
+        if ids != None:
+            for node_id in ids:
+                assert node_id in store, f"ID: {node_id} not found in {node_name} nodes"
+
+        if type(store) is not dict:
+            return [list(store if ids == None else ids) if attr == "id" else store.column(attr, ids) for attr in attributes]
+
+        node_ids = list(store if ids == None else ids)
+        return [node_ids if attr == "id" else [store[node_id].get(attr, None) for node_id in node_ids] for attr in attributes]
+
+
+    def _convert_storage(self, storage: str):
+        # rebuild every node store in the requested storage mode
+        for node_name, attributes in self.db["schema"]["nodes"].items():
+            store = _new_node_store(storage, attributes)
+            for node_id, row in self.db["nodes"][node_name].items():
+                store[node_id] = row
+            self.db["nodes"][node_name] = store
+        self.db["storage"] = storage
+
+
     def traverse(self, source_node_name: str, source_ids: List[Id], direction: str, link_name: str, target_node_name: str) -> List[Id]:
         assert source_node_name in self.db["schema"]["nodes"], f"Source node name: {source_node_name} not in schema"
         assert target_node_name in self.db["schema"]["nodes"], f"Target node name: {target_node_name} not in schema"
         assert direction in ["->", "<-"], f"Invalid direction: {direction}. Must be '->' or '<-'."
+        source_ids = self._as_ids(source_ids)
         assert all(source_id in self.db["nodes"][source_node_name] for source_id in source_ids), f"Some source IDs not found in {source_node_name} nodes"
         assert (source_node_name, link_name, target_node_name) in self.db["schema"]["links"] or \
             (target_node_name, link_name, source_node_name) in self.db["schema"]["links"], f"Link: {link_name} not in schema between {source_node_name} and {target_node_name}"
 
+        if self._cache is not None:
+            key = ("traverse", source_node_name, tuple(source_ids), direction, link_name, target_node_name)
+            versions = (self._link_versions.get(link_name, 0),)
+            results = self._cache.get(key, versions)
+            if results is None:
+                results = tuple(self._traverse(source_node_name, source_ids, direction, link_name, target_node_name))
+                self._cache.put(key, versions, results)
+            return list(results)
+        return self._traverse(source_node_name, source_ids, direction, link_name, target_node_name)
+
+
+    def _traverse(self, source_node_name: str, source_ids: List[Id], direction: str, link_name: str, target_node_name: str) -> List[Id]:
+        if self._csr is not None:
+            rows, offsets, neighbors, stale = self._compiled(direction, link_name, source_node_name, target_node_name)
+            results = set()
+            if stale:
+                live = self._live_neighbors(direction, link_name, source_node_name, target_node_name)
+                for source_id in stale.intersection(source_ids):
+                    results.update(live(source_id))
+                source_ids = [source_id for source_id in source_ids if source_id not in stale]
+            # neighboring rows are merged so each run of rows is read as a single slice
+            found = sorted([row for row in map(rows.get, source_ids) if row is not None])
+            start = end = None
+            for row in found:
+                if row != end:
+                    if start is not None:
+                        results.update(neighbors[offsets[start]:offsets[end]])
+                    start = row
+                end = row + 1
+            if start is not None:
+                results.update(neighbors[offsets[start]:offsets[end]])
+            return list(results)
+
         results = set()
         for source_id in source_ids:
             try:
@@ -319,6 +2077,680 @@ class DB:
         return list(results)
 
 
+    def degree(self, source_node_name: str, source_ids: List[Id] | None, direction: str, link_name: str, target_node_name: str) -> List[int]:
+        # number of neighbors of each source id over the link, in the order of source_ids (None: every source node)
+        source_ids = self._hop_ids(source_node_name, source_ids, direction, link_name, target_node_name)
+        return list(map(self._degree(direction, link_name, source_node_name, target_node_name), source_ids))
+
+
+    def count_neighbors(self, source_node_name: str, source_ids: List[Id] | None, direction: str, link_name: str, target_node_name: str, distinct: bool = True) -> int:
+        # Number of different neighbors of the source ids over the link, or the number of links
+        # from them with distinct=False. Neither builds a result list per id.
+        if source_ids is None and distinct:
+            # every target reached from any source is a target with edges, the catalog counts those
+            triple, side = ((source_node_name, link_name, target_node_name), 2) if direction == "->" else ((target_node_name, link_name, source_node_name), 1)
+            self._hop_ids(source_node_name, [], direction, link_name, target_node_name)
+            return self._link_stats()[triple][side]
+        source_ids = self._hop_ids(source_node_name, source_ids, direction, link_name, target_node_name)
+        if not distinct:
+            return sum(map(self._degree(direction, link_name, source_node_name, target_node_name), source_ids))
+        neighbors = self._neighbors(direction, link_name, source_node_name, target_node_name)
+        reached = set()
+        for source_id in source_ids:
+            reached.update(neighbors(source_id))
+        return len(reached)
+
+
+    def count_by_neighbor(self, source_node_name: str, source_ids: List[Id] | None, direction: str, link_name: str, target_node_name: str) -> dict:
+        # neighbor id -> number of the source ids linked to it, e.g. tickets per showing:
+        # count_by_neighbor("Ticket", None, "->", "for", "Showing"). Neighbors without links are left out.
+        opposite_direction = "<-" if direction == "->" else "->"
+        if source_ids is None:
+            # counting every source is the degree of each neighbor in the other direction
+            self._hop_ids(source_node_name, [], direction, link_name, target_node_name)
+            if self._csr is not None:
+                rows, offsets, _, stale = self._compiled(opposite_direction, link_name, target_node_name, source_node_name)
+                counts = {node_id: offsets[row + 1] - offsets[row] for node_id, row in rows.items() if offsets[row + 1] > offsets[row] and node_id not in stale}
+                live = self._live_neighbors(opposite_direction, link_name, target_node_name, source_node_name)
+                for node_id in stale:
+                    if live(node_id):
+                        counts[node_id] = len(live(node_id))
+                return counts
+            return {node_id: len(others[source_node_name]) for node_id, others in self.db[opposite_direction][link_name][target_node_name].items() if source_node_name in others}
+        source_ids = self._hop_ids(source_node_name, source_ids, direction, link_name, target_node_name)
+        neighbors = self._neighbors(direction, link_name, source_node_name, target_node_name)
+        return dict(Counter(itertools.chain.from_iterable(map(neighbors, dict.fromkeys(source_ids)))))
+
+
+    def count_reachable(self, query: str, start_ids: List[Id] | None, end_ids: List[Id] | None = None) -> int:
+        # number of distinct ids at the end of a path, see path()
+        return sum(1 for _ in self.path(query, start_ids, end_ids=end_ids))
+
+
+    def bfs(self, node_name: str, ids: List[Id], direction: str = "->", links: List[str] | None = None, node_names: List[str] | None = None, max_hops: int | None = None) -> Iterator[Tuple[int, dict]]:
+        # Breadth first search from the given ids, one layer at a time: yields (hops, {node name: [ids]})
+        # starting with the ids themselves at 0 hops. Every id is reached once, at its smallest number of hops.
+        # direction is "->", "<-" or "both", links and node_names restrict the link names and node types followed.
+        edges = self._edge_steps(direction, links, node_names)
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        ids = self._as_ids(ids)
+        assert all(node_id in self.db["nodes"][node_name] for node_id in ids), f"Some IDs not found in {node_name} nodes"
+        seen = self._visited()
+        frontier = {node_name: []}
+        _mark_unseen(ids, seen, frontier[node_name])
+        hops = 0
+        while frontier:
+            yield hops, frontier
+            if hops == max_hops:
+                return
+            frontier = self._expand(frontier, edges, seen)
+            hops += 1
+
+
+    def k_hop(self, node_name: str, ids: List[Id], k: int, direction: str = "->", links: List[str] | None = None, node_names: List[str] | None = None) -> dict:
+        # node name -> ids reached in 1 to k hops from the given ids, which are not included themselves
+        assert k >= 0, f"Invalid number of hops: {k}"
+        reached = {}
+        for hops, layer in self.bfs(node_name, ids, direction, links, node_names, max_hops=k):
+            if hops:
+                for other_node_name, other_ids in layer.items():
+                    reached.setdefault(other_node_name, []).extend(other_ids)
+        return reached
+
+
+    def shortest_path(self, source_node_name: str, source_id: Id, target_node_name: str, target_id: Id, direction: str = "->", links: List[str] | None = None, node_names: List[str] | None = None) -> List[Tuple[str, Id]] | None:
+        # One unweighted shortest path as [(node name, id), ...] from source to target, None when there is none.
+        # Searches from both ends at once, always expanding the smaller frontier.
+        forward_edges = self._edge_steps(direction, links, node_names)
+        backward_edges = self._edge_steps({"->": "<-", "<-": "->"}.get(direction, direction), links, node_names)
+        source_id, target_id = self._as_ids([source_id, target_id])
+        assert source_id in self.db["nodes"].get(source_node_name, ()), f"Source ID: {source_id} not found in {source_node_name} nodes"
+        assert target_id in self.db["nodes"].get(target_node_name, ()), f"Target ID: {target_id} not found in {target_node_name} nodes"
+        # id -> (its node name, id it was reached from), from the source and from the target
+        forward_parents, backward_parents = {source_id: (source_node_name, None)}, {target_id: (target_node_name, None)}
+        forward, backward = {source_node_name: [source_id]}, {target_node_name: [target_id]}
+        meeting = source_id if source_id == target_id else None
+        while meeting is None and forward and backward:
+            if sum(map(len, forward.values())) <= sum(map(len, backward.values())):
+                forward, meeting = self._expand_parents(forward, forward_edges, forward_parents, backward_parents)
+            else:
+                backward, meeting = self._expand_parents(backward, backward_edges, backward_parents, forward_parents)
+        if meeting is None:
+            return None
+
+        path = []
+        node_id = meeting
+        while node_id is not None:
+            node_name, parent_id = forward_parents[node_id]
+            path.append((node_name, node_id))
+            node_id = parent_id
+        path.reverse()
+        node_id = backward_parents[meeting][1]
+        while node_id is not None:
+            node_name, parent_id = backward_parents[node_id]
+            path.append((node_name, node_id))
+            node_id = parent_id
+        return path
+
+
+    def connected_components(self, links: List[str] | None = None, node_names: List[str] | None = None) -> Iterator[dict]:
+        # Yields every connected component as {node name: [ids]}, following links in both directions.
+        # links and node_names restrict the link names and node types, ids without such links are components of their own.
+        edges = self._edge_steps("both", links, node_names)
+        seen = self._visited()
+        for node_name in (self.db["schema"]["nodes"] if node_names is None else node_names):
+            for node_id in self.db["nodes"][node_name]:
+                frontier = {node_name: []}
+                _mark_unseen((node_id,), seen, frontier[node_name])
+                if not frontier[node_name]:
+                    continue
+                component = {}
+                while frontier:
+                    for other_node_name, other_ids in frontier.items():
+                        component.setdefault(other_node_name, []).extend(other_ids)
+                    frontier = self._expand(frontier, edges, seen)
+                yield component
+
+
+    def _edge_steps(self, direction: str, links: List[str] | None, node_names: List[str] | None) -> dict:
+        # node name -> [(neighbor function, other node name)] for every link of the schema the filters allow
+        assert direction in ["->", "<-", "both"], f"Invalid direction: {direction}. Must be '->', '<-' or 'both'."
+        schema = self.db["schema"]
+        if links is not None:
+            assert all(any(link == triple[1] for triple in schema["links"]) for link in links), f"Some links not in schema: {links}"
+        if node_names is not None:
+            assert all(node_name in schema["nodes"] for node_name in node_names), f"Some node names not in schema: {node_names}"
+        edges = {}
+        for source, link, target in sorted(schema["links"]):
+            if (links is not None and link not in links) or (node_names is not None and (source not in node_names or target not in node_names)):
+                continue
+            if direction != "<-":
+                edges.setdefault(source, []).append((self._neighbors("->", link, source, target), target))
+            if direction != "->":
+                edges.setdefault(target, []).append((self._neighbors("<-", link, target, source), source))
+        return edges
+
+
+    def _visited(self):
+        # one byte per id for int ids, which are dense, a set otherwise. Ids are unique across node types.
+        current_id = self.db["current_id"]
+        return bytearray(current_id) if type(current_id) is int else set()
+
+
+    def _expand(self, frontier: dict, edges: dict, seen) -> dict:
+        # the next bfs layer: every id linked to the frontier that was not seen yet
+        next_frontier = {}
+        for node_name, ids in frontier.items():
+            for neighbors, other_node_name in edges.get(node_name, ()):
+                found = next_frontier.setdefault(other_node_name, [])
+                for node_id in ids:
+                    _mark_unseen(neighbors(node_id), seen, found)
+        return {node_name: ids for node_name, ids in next_frontier.items() if ids}
+
+
+    def _expand_parents(self, frontier: dict, edges: dict, parents: dict, other_parents: dict) -> Tuple[dict, Id | None]:
+        # one layer of a shortest_path() search, stops at the first id the search from the other end reached
+        next_frontier = {}
+        for node_name, ids in frontier.items():
+            for neighbors, other_node_name in edges.get(node_name, ()):
+                found = next_frontier.setdefault(other_node_name, [])
+                for node_id in ids:
+                    for other_id in neighbors(node_id):
+                        if other_id not in parents:
+                            parents[other_id] = (other_node_name, node_id)
+                            if other_id in other_parents:
+                                return next_frontier, other_id
+                            found.append(other_id)
+        return {node_name: ids for node_name, ids in next_frontier.items() if ids}, None
+
+
+    def _hop_ids(self, source_node_name: str, source_ids: List[Id] | None, direction: str, link_name: str, target_node_name: str) -> List[Id]:
+        # checks one hop and its source ids like traverse() does, None stands for every source node
+        assert source_node_name in self.db["schema"]["nodes"], f"Source node name: {source_node_name} not in schema"
+        assert target_node_name in self.db["schema"]["nodes"], f"Target node name: {target_node_name} not in schema"
+        assert direction in ["->", "<-"], f"Invalid direction: {direction}. Must be '->' or '<-'."
+        triple = (source_node_name, link_name, target_node_name) if direction == "->" else (target_node_name, link_name, source_node_name)
+        assert triple in self.db["schema"]["links"], f"Link: {link_name} not in schema between {triple[0]} and {triple[2]}"
+        store = self.db["nodes"][source_node_name]
+        if source_ids is None:
+            return list(store)
+        source_ids = self._as_ids(source_ids)
+        assert all(source_id in store for source_id in source_ids), f"Some source IDs not found in {source_node_name} nodes"
+        return source_ids
+
+
+    def _degree(self, direction: str, link: str, node_name: str, other_node_name: str):
+        # returns a function mapping one id to its number of neighbors over the given link
+        if self._csr is not None:
+            rows, offsets, _, stale = self._compiled(direction, link, node_name, other_node_name)
+            live = self._live_neighbors(direction, link, node_name, other_node_name)
+            def compiled_degree(node_id):
+                if node_id in stale:
+                    return len(live(node_id))
+                row = rows.get(node_id)
+                return 0 if row is None else offsets[row + 1] - offsets[row]
+            return compiled_degree
+
+        node_ids = self.db[direction][link][node_name]
+        empty = {}
+        return lambda node_id: len(node_ids.get(node_id, empty).get(other_node_name, ()))
+
+
+    def path(self, query: str, start_ids: List[Id] | None, pairs: bool = False, end_ids: List[Id] | None = None) -> Iterator[Any]:
+        # Multi-hop traverse, e.g. path("Person->has:Ticket->for:Showing->of:Movie", person_ids).
+        # Yields the distinct end ids, or (start_id, end_id) pairs when pairs=True. Results are streamed:
+        # every hop but the last is deduplicated as one set, the last hop is yielded as it is walked.
+        # end_ids keeps only the paths ending at those ids. The planner decides whether to walk from the
+        # start or to first walk back from the end, see explain().
+        start_node_name, hops = _parse_path(query)
+        steps = self._path_steps(start_node_name, hops)
+
+        start_ids = self._as_ids(start_ids)
+        if start_ids != None:
+            store = self.db["nodes"][start_node_name]
+            assert all(start_id in store for start_id in start_ids), f"Some start IDs not found in {start_node_name} nodes"
+        end_ids = self._as_ids(end_ids)
+
+        if self._cache is not None:
+            key = ("path", query, None if start_ids is None else tuple(start_ids), pairs, None if end_ids is None else tuple(end_ids))
+            versions = tuple(self._link_versions.get(link, 0) for _, link, _ in hops)
+            results = self._cache.get(key, versions)
+            if results is None:
+                results = tuple(self._path(steps, start_node_name, hops, start_ids, end_ids, pairs))
+                self._cache.put(key, versions, results)
+            return iter(results)
+        return self._path(steps, start_node_name, hops, start_ids, end_ids, pairs)
+
+
+    def _path(self, steps: list, start_node_name: str, hops: list, start_ids: List[Id] | None, end_ids: List[Id] | None, pairs: bool) -> Iterator[Any]:
+        start_ids, allowed = self._plan_start(start_node_name, hops, start_ids, end_ids)
+        if pairs:
+            return ((start_id, end_id) for start_id in start_ids for end_id in self._walk(steps, [start_id], allowed))
+        return self._walk(steps, start_ids, allowed)
+
+
+    def _plan_start(self, start_node_name: str, hops: list, start_ids: List[Id] | None, end_ids: List[Id] | None) -> Tuple[Any, list | None]:
+        # runs the first part of the chosen plan: the start ids to walk from, and the ids allowed at each layer
+        plan = self._plan_path(start_node_name, hops, start_ids, end_ids)
+        if plan["plan"] == "backward":
+            allowed = self._reachable_layers(start_node_name, hops, end_ids)
+            return (allowed[0] if start_ids is None else [start_id for start_id in start_ids if start_id in allowed[0]]), allowed
+        allowed = None if end_ids is None else [None] * len(hops) + [set(end_ids)]
+        return (list(self.db["nodes"][start_node_name]) if start_ids is None else start_ids), allowed
+
+
+    def _plan_path(self, start_node_name: str, hops: list, start_ids: List[Id] | None, end_ids: List[Id] | None) -> dict:
+        # Cost based choice between two plans, using stats():
+        #   forward:  walk from the start ids, keep the paths ending at end_ids
+        #   backward: walk back from end_ids to find the ids of every layer that lead to them, then walk
+        #             from the start ids through those only
+        # The cost of a walk is the number of neighbors it reads: rows * average degree, summed over the hops.
+        # Rows are estimated as distinct ids, at most the number of nodes of that type.
+        stats = self._link_stats()
+        node_names = [start_node_name] + [next_node_name for _, _, next_node_name in hops]
+        counts = [len(self.db["nodes"][node_name]) for node_name in node_names]
+        edges = []
+        for node_name, (direction, link, next_node_name) in zip(node_names, hops):
+            triple = (node_name, link, next_node_name) if direction == "->" else (next_node_name, link, node_name)
+            edges.append(stats[triple][0])
+
+        def walk(rows: float, layers: range, limits: List[float]) -> Tuple[List[float], float]:
+            estimated, cost = [rows], 0.0
+            for layer in layers:
+                current, following = (layer, layer + 1) if layers.step == 1 else (layer + 1, layer)
+                cost += rows * edges[layer] / max(counts[current], 1)
+                rows = min(rows * edges[layer] / max(counts[current], 1), counts[following], limits[following])
+                estimated.append(rows)
+            return estimated, cost
+
+        unlimited = [float("inf")] * len(counts)
+        first = counts[0] if start_ids is None else len(start_ids)
+        forward, forward_cost = walk(first, range(len(hops)), unlimited)
+        if end_ids is not None:
+            forward[-1] = min(forward[-1], len(end_ids))
+
+        last = counts[-1] if end_ids is None else len(end_ids)
+        reachable, backward_cost = walk(last, range(len(hops) - 1, -1, -1), unlimited)
+        reachable.reverse()
+        restricted, restricted_cost = walk(min(first, reachable[0]), range(len(hops)), reachable)
+        backward_cost += restricted_cost
+
+        plan = {"plan": "forward", "costs": {"forward": forward_cost, "backward": backward_cost}, "estimated": forward}
+        if backward_cost < forward_cost:
+            plan.update(plan="backward", estimated=restricted, reachable_estimated=reachable)
+        return plan
+
+
+    def _reachable_layers(self, start_node_name: str, hops: list, end_ids: List[Id] | None) -> List[Set[Id]]:
+        # layers[k]: the ids at position k of the path that lead to one of end_ids (any end id when None)
+        node_names = [start_node_name] + [next_node_name for _, _, next_node_name in hops]
+        frontier = set(self.db["nodes"][node_names[-1]] if end_ids is None else end_ids)
+        layers = [frontier]
+        for layer in range(len(hops) - 1, -1, -1):
+            direction, link, _ = hops[layer]
+            neighbors = self._neighbors("<-" if direction == "->" else "->", link, node_names[layer + 1], node_names[layer])
+            next_frontier = set()
+            for node_id in frontier:
+                next_frontier.update(neighbors(node_id))
+            frontier = next_frontier
+            layers.append(frontier)
+        layers.reverse()
+        return layers
+
+
+    def explain(self, query: str, start_ids: List[Id] | None, end_ids: List[Id] | None = None) -> dict:
+        # The plan path() picks for this query, with the estimated and actual number of distinct ids at every
+        # position of the path. Backward plans also show the ids found walking back from the end ids.
+        start_node_name, hops = _parse_path(query)
+        steps = self._path_steps(start_node_name, hops)
+        start_ids, end_ids = self._as_ids(start_ids), self._as_ids(end_ids)
+        plan = self._plan_path(start_node_name, hops, start_ids, end_ids)
+        frontier, allowed = self._plan_start(start_node_name, hops, start_ids, end_ids)
+
+        frontier = set(frontier)
+        actual = [len(frontier)]
+        for layer, neighbors in enumerate(steps, 1):
+            next_frontier = set()
+            for node_id in frontier:
+                next_frontier.update(neighbors(node_id))
+            if allowed is not None and allowed[layer] is not None:
+                next_frontier &= allowed[layer]
+            frontier = next_frontier
+            actual.append(len(frontier))
+
+        node_names = [start_node_name] + [next_node_name for _, _, next_node_name in hops]
+        plan["steps"] = [{"node": node_name, "estimated": estimated, "actual": rows} for node_name, estimated, rows in zip(node_names, plan.pop("estimated"), actual)]
+        if plan["plan"] == "backward":
+            for step, estimated, layer in zip(plan["steps"], plan.pop("reachable_estimated"), allowed):
+                step.update(reachable_estimated=estimated, reachable_actual=len(layer))
+        return plan
+
+
+    def memory_report(self) -> dict:
+        # Approximate bytes held by the id objects, every node type, every link in each direction and the
+        # indexes. Objects shared by several parts are counted once, in the first part listed here.
+        # Node types and links of a lazily loaded database that were not read yet are not counted.
+        seen = set()
+        stores = dict.items(self.db["nodes"])
+        report = {"ids": sum(_deep_size(node_id, seen) for _, store in stores for node_id in store.keys())}
+        report["nodes"] = {node_name: _deep_size(store, seen) for node_name, store in stores}
+        for direction in ["->", "<-"]:
+            report[direction] = {link: _deep_size(node_names, seen) for link, node_names in self.db[direction].items()}
+        report["indexes"] = {node_name: _deep_size(indexes, seen) for node_name, indexes in self.db["indexes"].items()}
+        if self._csr:
+            report["frozen"] = _deep_size(self._csr, seen)
+        report["total"] = sum(sum(part.values()) if type(part) is dict else part for part in report.values())
+        return report
+
+
+    def stats(self) -> dict:
+        # Catalog used by the path planner: node counts and, per (source, link, target), the number of edges and
+        # of source/target ids with at least one edge. Edge and id counts are kept up to date by every write
+        # once the catalog exists; max degrees and degree histograms (power of two buckets) are computed here.
+        result = {"nodes": {node_name: len(store) for node_name, store in self.db["nodes"].items()}, "links": {}}
+        for (source, link, target), (edges, sources, targets) in self._link_stats().items():
+            out_degrees = _degree_histogram(self.db["->"][link][source], target)
+            in_degrees = _degree_histogram(self.db["<-"][link][target], source)
+            result["links"][(source, link, target)] = {
+                "edges": edges,
+                "sources": sources,
+                "targets": targets,
+                "avg_out_degree": edges / sources if sources else 0.0,
+                "avg_in_degree": edges / targets if targets else 0.0,
+                "max_out_degree": max(out_degrees[1], default=0),
+                "max_in_degree": max(in_degrees[1], default=0),
+                "out_degree_histogram": out_degrees[0],
+                "in_degree_histogram": in_degrees[0],
+            }
+        return result
+
+
+    def _link_stats(self) -> dict:
+        # built from the adjacency the first time it is needed, then maintained by _links_changed()
+        if self._stats is None:
+            stats = {}
+            for (source, link, target) in self.db["schema"]["links"]:
+                degrees = [len(others[target]) for others in self.db["->"][link][source].values() if target in others]
+                targets = sum(1 for others in self.db["<-"][link][target].values() if source in others)
+                stats[(source, link, target)] = [sum(degrees), len(degrees), targets]
+            self._stats = stats
+        return self._stats
+
+
+    def _path_steps(self, start_node_name: str, hops: List[Tuple[str, str, str]]) -> list:
+        # validates the whole path against the schema once and returns one neighbor function per hop
+        assert start_node_name in self.db["schema"]["nodes"], f"Node name: {start_node_name} not in schema"
+        steps = []
+        node_name = start_node_name
+        for direction, link, next_node_name in hops:
+            assert next_node_name in self.db["schema"]["nodes"], f"Node name: {next_node_name} not in schema"
+            triple = (node_name, link, next_node_name) if direction == "->" else (next_node_name, link, node_name)
+            assert triple in self.db["schema"]["links"], f"Link: {link} not in schema between {triple[0]} and {triple[2]}"
+            steps.append(self._neighbors(direction, link, node_name, next_node_name))
+            node_name = next_node_name
+        return steps
+
+
+    def _neighbors(self, direction: str, link: str, node_name: str, other_node_name: str):
+        # returns a function mapping one id to its neighbors over the given link
+        if self._csr is not None:
+            rows, offsets, neighbors, stale = self._compiled(direction, link, node_name, other_node_name)
+            live = self._live_neighbors(direction, link, node_name, other_node_name)
+            def compiled_neighbors(node_id):
+                if node_id in stale:
+                    return live(node_id)
+                row = rows.get(node_id)
+                return () if row is None else neighbors[offsets[row]:offsets[row + 1]]
+            return compiled_neighbors
+        return self._live_neighbors(direction, link, node_name, other_node_name)
+
+
+    def _live_neighbors(self, direction: str, link: str, node_name: str, other_node_name: str):
+        node_ids = self.db[direction][link][node_name]
+        empty = {}
+        return lambda node_id: node_ids.get(node_id, empty).get(other_node_name, ())
+
+
+    def _walk(self, steps: list, frontier, allowed: list | None = None) -> Iterator[Id]:
+        # allowed: None, or per position of the path a set of the only ids the walk may reach there (or None)
+        for layer, neighbors in enumerate(steps[:-1], 1):
+            next_frontier = set()
+            for node_id in frontier:
+                next_frontier.update(neighbors(node_id))
+            if allowed is not None and allowed[layer] is not None:
+                next_frontier &= allowed[layer]
+            frontier = next_frontier
+
+        neighbors = steps[-1]
+        last = None if allowed is None else allowed[-1]
+        seen = set()
+        for node_id in frontier:
+            for end_id in neighbors(node_id):
+                if end_id not in seen and (last is None or end_id in last):
+                    seen.add(end_id)
+                    yield end_id
+
+
+    def enable_cache(self, max_entries: int | None = 10_000, max_bytes: int | None = None):
+        # LRU cache for traverse() and path(), bounded by number of entries and/or approximate bytes.
+        # Links keep a write counter, so a write only invalidates the cached results that read that link.
+        self._cache = _TraversalCache(max_entries, max_bytes)
+
+
+    def disable_cache(self):
+        self._cache = None
+
+
+    def cache_stats(self) -> dict:
+        assert self._cache is not None, "The traversal cache is not enabled"
+        return self._cache.stats()
+
+
+    def enable_metrics(self, slow_seconds: float | None = 0.1, slow_log_size: int = 100, ops: List[str] = METRIC_OPS):
+        # Counts calls, errors, items and latency of the given public methods, and logs the calls slower than
+        # slow_seconds with their arguments summarized. The methods are wrapped on this instance only, so
+        # disable_metrics() puts the plain methods back and costs nothing afterwards.
+        assert all(op in METRIC_OPS for op in ops), f"Invalid operations: {ops}. Must be some of {METRIC_OPS}"
+        self.disable_metrics()
+        self._metrics = _Metrics(slow_seconds, slow_log_size)
+        for op in ops:
+            setattr(self, op, self._metered(op, getattr(self, op)))
+
+
+    def disable_metrics(self):
+        if self._metrics is not None:
+            for op in METRIC_OPS:
+                self.__dict__.pop(op, None)
+            self._metrics = None
+
+
+    def metrics(self, reset: bool = False) -> dict:
+        # {"ops": {op: {"calls", "errors", "items", "seconds", "max_seconds", "histogram"}}, "slow": [...]}
+        # histogram maps the upper bound of each latency bucket in seconds to its number of calls
+        assert self._metrics is not None, "Metrics are not enabled"
+        snapshot = self._metrics.snapshot()
+        if reset:
+            self._metrics.reset()
+        return snapshot
+
+
+    def reset_metrics(self):
+        assert self._metrics is not None, "Metrics are not enabled"
+        self._metrics.reset()
+
+
+    def add_hook(self, pre=None, post=None):
+        # Tracing hooks around every metered call: pre(op, args, kwargs) runs first and its return value
+        # is handed to post(op, value, seconds, error) when the call is done, error is None on success.
+        assert self._metrics is not None, "Metrics are not enabled"
+        self._metrics.hooks.append((pre, post))
+
+
+    def _metered(self, op: str, method):
+        metrics = self._metrics
+        items = _METRIC_ITEMS.get(op)
+        code = method.__func__.__code__
+        names = code.co_varnames[1:code.co_argcount]
+        def metered(*args, **kwargs):
+            hooks = metrics.hooks
+            values = [pre(op, args, kwargs) if pre is not None else None for pre, _ in hooks] if hooks else ()
+            error = None
+            started = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+                return result
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                count = 0
+                if items is not None and error is None:
+                    try:
+                        count = items({**dict(zip(names, args)), **kwargs}, result)
+                    except Exception:
+                        pass  # e.g. ids passed as an iterator, which has no len(): metering must not fail the call
+                metrics.record(op, args, kwargs, seconds, count, error is not None)
+                for (_, post), value in zip(hooks, values):
+                    if post is not None:
+                        post(op, value, seconds, error)
+        return metered
+
+
+    def enable_snapshots(self):
+        # Snapshot mode: every write copies the parts of the database it touches before changing them and
+        # publishes a new version when it is done. Readers call snapshot() and never see a write in progress.
+        # Writes must come from one thread at a time, hold write_lock if several threads write.
+        assert hasattr(self, "db"), "Cannot enable snapshots before a schema is migrated"
+        if self._versions is None:
+            assert not self._cow, "Snapshots are read only"
+            self._versions = _Versions()
+            self.write_lock = threading.RLock()
+            self._cow = True
+            self._publish()
+
+
+    def disable_snapshots(self):
+        if self._versions is not None:
+            self._versions = None
+            self.write_lock = None
+            self._cow = False
+
+
+    def snapshot(self) -> "DB":
+        # the last published version, as a read-only DB. Taking one never waits for the writer.
+        assert self._versions is not None, "Snapshots are not enabled, see enable_snapshots()"
+        return self._versions.published
+
+
+    def _publish(self):
+        snapshot = DB(self.storage, self.ids)
+        snapshot.db = self.db
+        snapshot._incident = self._incident
+        snapshot._validators = self._validators
+        snapshot._cow = True  # any write goes through _own_root(), which refuses it
+        self._versions.owned = {}
+        self._versions.published = snapshot  # one reference assignment, readers get the old or the new version
+
+
+    def _own_root(self) -> dict:
+        assert self._versions is not None, "Snapshots are read only"
+        owned = self._versions.owned
+        if id(self.db) not in owned:
+            self.db = dict(self.db)
+            owned[id(self.db)] = self.db
+        return self.db
+
+
+    def _own(self, parent: dict, key: Any) -> Any:
+        # parent[key], copied first unless it was already copied since the last publish
+        value = parent[key]
+        owned = self._versions.owned
+        if id(value) not in owned:
+            value = parent[key] = value.copy()
+            owned[id(value)] = value
+        return value
+
+
+    def _own_store(self, node_name: str):
+        db = self._own_root()
+        self._own(self._own(db, "nodes"), node_name)
+        if node_name in db["indexes"]:
+            indexes = self._own(self._own(db, "indexes"), node_name)
+            for attr in list(indexes):
+                self._own(indexes, attr)
+
+
+    def _own_adjacency(self, direction: str, link: str, node_name: str, ids):
+        # copies the subtree of one side of a link, and the entries of the given ids in it
+        adjacency = self._own(self._own(self._own(self._own_root(), direction), link), node_name)
+        owned = self._versions.owned
+        for node_id in ids:
+            others = adjacency.get(node_id)
+            if others is not None and id(others) not in owned:
+                others = adjacency[node_id] = {other_node_name: set(other_ids) for other_node_name, other_ids in others.items()}
+                owned[id(others)] = others
+
+
+    def _own_edges(self, node_1_name: str, link: str, node_2_name: str, edges: dict):
+        self._own_adjacency("->", link, node_1_name, edges)
+        self._own_adjacency("<-", link, node_2_name, set().union(*edges.values()))
+
+
+    def _own_node_links(self, node_name: str, ids: List[Id]):
+        for direction, link, other_node_name in self._incident[node_name]:
+            adjacency = self.db[direction][link][node_name]
+            neighbor_ids = set()
+            for node_id in ids:
+                neighbor_ids.update(adjacency.get(node_id, {}).get(other_node_name, ()))
+            self._own_adjacency(direction, link, node_name, ids)
+            self._own_adjacency("<-" if direction == "->" else "->", link, other_node_name, neighbor_ids)
+
+
+    def freeze(self):
+        # compile every link triple, in both directions, into compressed sparse row arrays:
+        # a source id -> row map, offsets into the neighbor array, and the neighbor array itself.
+        # traverse() then reads slices of these arrays. Writes only mark the source ids they touch as stale,
+        # those are read from db[direction] until the triple is compiled again, see _compiled().
+        self._csr = {}
+        self._csr_stale = {}
+        for (source, link, target) in self.db["schema"]["links"]:
+            self._compiled("->", link, source, target)
+            self._compiled("<-", link, target, source)
+
+
+    def thaw(self):
+        self._csr = None
+        self._csr_stale = {}
+
+
+    def _compiled(self, direction: str, link: str, node_name: str, other_node_name: str) -> Tuple[Any, Any, Any, Set[Id]]:
+        # rows, offsets, neighbors and the stale ids, whose rows no longer match db[direction]. Once there are
+        # too many stale ids the triple is compiled again, so a few writes between reads cost no rebuild.
+        key = (direction, link, node_name, other_node_name)
+        stale = self._csr_stale.get(key, ())
+        if key not in self._csr or len(stale) > max(_CSR_STALE_LIMIT, len(self._csr[key][0]) // 8):
+            self._csr[key] = self._compile(direction, link, node_name, other_node_name)
+            self._csr_stale.pop(key, None)
+            stale = ()
+        return (*self._csr[key], stale)
+
+
+    def _compile(self, direction: str, link: str, node_name: str, other_node_name: str) -> Tuple[Any, Any, Any]:
+        node_ids = self.db[direction].get(link, {}).get(node_name, {})
+        rows = {}
+        offsets = array("q", [0])
+        neighbors = []
+        for node_id, others in node_ids.items():
+            if other_node_name in others:
+                rows[node_id] = len(rows)
+                neighbors.extend(others[other_node_name])
+                offsets.append(len(neighbors))
+        if type(self.db["current_id"]) is int:
+            neighbors = array("q", neighbors)
+        return rows, offsets, neighbors
+
+
     def save(self, folder_path: str, db_filename: str):
         with open(os.path.join(folder_path, db_filename), 'wb') as f:
             pickle.dump(self.db, f)
@@ -326,4 +2758,567 @@ class DB:
 
     def load(self, folder_path: str, db_filename: str):
         with open(os.path.join(folder_path, db_filename), 'rb') as f:
-            self.db = pickle.load(f)
\ No newline at end of file
+            self.db = pickle.load(f)
+
+        self._csr = None
+        self._csr_stale = {}
+        self._schema_changed()
+        self.db.setdefault("indexes", {})  # databases saved before indexes existed
+        if self.storage is not None and self.db.get("storage", "dict") != self.storage:
+            self._convert_storage(self.storage)
+        if self.ids is not None and type(self.db["current_id"]).__name__ != self.ids:
+            self._convert_ids(self.ids)
+
+        # replay the journal written since the last checkpoint, if there is one
+        journal_path = os.path.join(folder_path, db_filename + ".log")
+        if os.path.exists(journal_path):
+            journal, self._journal = self._journal, None
+            try:
+                for lsn, op, args in _read_journal(journal_path):
+                    if lsn > self.db.get("lsn", 0):
+                        # through the class, so enable_metrics() does not count replayed ops as calls
+                        if op == "create":
+                            # rows were accepted when they were written, maybe trusted=True or sampled
+                            DB.create(self, *args, trusted=True)
+                        else:
+                            getattr(DB, op)(self, *args)
+                        self.db["lsn"] = lsn
+            finally:
+                self._journal = journal
+        if self._versions is not None:
+            self._publish()
+
+
+    def import_nodes(self, node_name: str, path: str, key_map: KeyMap, key: str = "id", converters: dict | None = None, chunk_size: int = 10_000) -> int:
+        # Streams a .csv or .jsonl file of nodes into create(), chunk_size rows at a time. The key column holds
+        # the external key of each row, it is stored in key_map with the new id and dropped unless the schema
+        # has an attribute of that name. Text values of other schema types (all of them in a CSV file) are
+        # converted, so are ints of float attributes, any other type mismatch is refused. converters maps
+        # attribute names to functions overriding the conversion by type, which get every mismatching value.
+        # Returns the number of nodes created.
+        assert self._transaction is None, "Cannot import inside a transaction"
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        attributes = self.db["schema"]["nodes"][node_name]
+        custom = set(converters or {})
+        converters = {attr: (converters or {}).get(attr) or _TEXT_CONVERTERS.get(type_name) for attr, type_name in attributes.items()}
+        missing = [attr for attr, converter in converters.items() if converter is None]
+        assert not missing, f"No converter for attributes: {missing}, pass them in converters"
+
+        records = _read_records(path)
+        created = 0
+        while chunk := list(itertools.islice(records, chunk_size)):
+            fields = set(chunk[0])
+            assert key in fields, f"Key column: {key} not found in {path}"
+            unknown = fields - set(attributes) - {key}
+            assert not unknown, f"Columns not in the {node_name} schema: {sorted(unknown)}"
+            missing = set(attributes) - fields
+            assert not missing, f"Columns of the {node_name} schema not found in {path}: {sorted(missing)}"
+            assert all(set(record) == fields for record in chunk), f"Rows with different columns in {path}"
+            keys = [record[key] for record in chunk]
+
+            # convert and check one column at a time
+            columns = {}
+            for attr, type_name in attributes.items():
+                values = [record[attr] for record in chunk]
+                if any(type(value).__name__ != type_name for value in values):
+                    convert = converters[attr]
+                    if attr not in custom:
+                        convertible = (str, int) if type_name == "float" else (str,)
+                        refused = next((value for value in values if type(value).__name__ != type_name and type(value) not in convertible), None)
+                        assert refused is None, f"Cannot convert {node_name}.{attr} to {type_name}: {refused!r} is a {type(refused).__name__}"
+                    try:
+                        values = [value if type(value).__name__ == type_name else convert(value) for value in values]
+                    except (ValueError, TypeError, KeyError) as e:
+                        raise AssertionError(f"Cannot convert {node_name}.{attr} to {type_name}: {e}") from None
+                columns[attr] = values
+            rows = [dict(zip(columns, values)) for values in zip(*columns.values())] if columns else [{} for _ in chunk]
+
+            key_map.update(node_name, keys, self.create(node_name, rows))
+            created += len(rows)
+        return created
+
+
+    def import_links(self, path: str, node_1_name: str, link: str, node_2_name: str, key_map: KeyMap, node_1_key: str = "source", node_2_key: str = "target", chunk_size: int = 100_000) -> int:
+        # Streams a .csv or .jsonl file of (node_1 key, node_2 key) rows into link_many(), chunk_size rows at a
+        # time, translating the external keys with key_map. Returns the number of links that did not exist yet.
+        assert self._transaction is None, "Cannot import inside a transaction"
+        records = _read_records(path)
+        added = 0
+        while chunk := list(itertools.islice(records, chunk_size)):
+            assert node_1_key in chunk[0] and node_2_key in chunk[0], f"Key columns: {node_1_key}, {node_2_key} not found in {path}"
+            node_1_ids = self._as_ids(key_map.ids(node_1_name, [record[node_1_key] for record in chunk]))
+            node_2_ids = self._as_ids(key_map.ids(node_2_name, [record[node_2_key] for record in chunk]))
+            added += self.link_many(node_1_name, node_1_ids, link, node_2_name, node_2_ids)
+        return added
+
+
+    def export_nodes(self, node_name: str, path: str, attributes: List[str] | None = None, chunk_size: int = 10_000) -> int:
+        # Writes the id and the attributes (all by default) of every node to a .csv or .jsonl file, reading
+        # chunk_size nodes at a time. Returns the number of nodes written. import_nodes() reads it back.
+        assert node_name in self.db["schema"]["nodes"], f"Node name: {node_name} not in schema"
+        fields = ["id"] + list(self.db["schema"]["nodes"][node_name] if attributes is None else attributes)
+        ids = iter(self.db["nodes"][node_name].keys())
+
+        def rows():
+            while chunk := list(itertools.islice(ids, chunk_size)):
+                yield from self.get(node_name, chunk, fields)
+        return _write_records(path, fields, rows())
+
+
+    def export_links(self, path: str, node_1_name: str, link: str, node_2_name: str) -> int:
+        # Writes one (source, target) row per link of the triple to a .csv or .jsonl file, straight from the
+        # adjacency sets. Returns the number of links written. import_links() reads it back.
+        assert (node_1_name, link, node_2_name) in self.db["schema"]["links"], f"Link: {link} not in schema between {node_1_name} and {node_2_name}"
+        node_ids = self.db["->"][link][node_1_name]
+
+        def rows():
+            for node_id, others in node_ids.items():
+                for other_id in others.get(node_2_name, ()):
+                    yield node_id, other_id
+        return _write_records(path, ["source", "target"], rows())
+
+
+    def save_segments(self, folder_path: str, db_filename: str):
+        path = os.path.join(folder_path, db_filename)
+        with open(path + ".tmp", "wb") as f:
+            self._write_segments(f)
+        os.replace(path + ".tmp", path)
+
+
+    def _write_segments(self, f):
+        # Segmented file format, read lazily by load_segments(). One segment holds the schema and the
+        # rest of the metadata, then there is one segment per node type (plus one per numeric column
+        # in columnar storage), one per adjacency subtree
+        # db[direction][link][node_name], and the compiled CSR arrays of every link triple in both
+        # directions. Numeric columns and int id arrays are written raw so they can be mapped zero-copy.
+        # The segment table is written after the segments; the preamble points to it.
+        segments = {}  # key -> (offset, length, typecode or None for pickled segments)
+        f.write(_SEGMENT_PREAMBLE.pack(_SEGMENT_MAGIC, 0, 0))
+
+        def write(key: tuple, data: Any):
+            f.write(b"\x00" * (-f.tell() % 8))  # keep raw arrays 8 byte aligned
+            offset = f.tell()
+            if isinstance(data, (array, memoryview)):
+                f.write(data)
+                segments[key] = (offset, f.tell() - offset, data.typecode if type(data) is array else data.format)
+            else:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+                segments[key] = (offset, f.tell() - offset, None)
+
+        write(("meta",), {key: value for key, value in self.db.items() if key not in ("nodes", "->", "<-")})
+
+        for node_name, store in self.db["nodes"].items():
+            if type(store) is not _Columns:
+                write(("nodes", node_name), store)
+                continue
+            state = store.__getstate__()
+            for name, column in store.columns.items():
+                if type(column) is not list:
+                    write(("column", node_name, name), column)
+                    state["columns"][name] = None
+            write(("columnar", node_name), state)
+
+        for direction in ["->", "<-"]:
+            for link, node_names in self.db[direction].items():
+                for node_name, node_ids in node_names.items():
+                    write(("adjacency", direction, link, node_name), node_ids)
+
+        for (source, link, target) in self.db["schema"]["links"]:
+            for key in [("->", link, source, target), ("<-", link, target, source)]:
+                rows, offsets, neighbors = self._compile(*key)
+                write(("csr_rows", *key), rows)
+                write(("csr_offsets", *key), offsets)
+                write(("csr_neighbors", *key), neighbors)
+
+        table_offset = f.tell()
+        pickle.dump(segments, f, pickle.HIGHEST_PROTOCOL)
+        table_length = f.tell() - table_offset
+        end = f.tell()
+        f.seek(0)
+        f.write(_SEGMENT_PREAMBLE.pack(_SEGMENT_MAGIC, table_offset, table_length))
+        f.seek(end)
+
+
+    def load_segments(self, folder_path: str, db_filename: str):
+        # Reads only the preamble, the segment table and the metadata. Node types and adjacency are
+        # unpickled the first time they are used; numeric columns and CSR arrays stay memoryviews over
+        # the mapped file. The database comes back frozen (see freeze()) so traverse reads the mapped arrays.
+        with open(os.path.join(folder_path, db_filename), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._attach_segments(memoryview(mapped))
+        self._mapped = mapped
+
+
+    def _attach_segments(self, buffer: memoryview):
+        magic, table_offset, table_length = _SEGMENT_PREAMBLE.unpack_from(buffer, 0)
+        assert magic == _SEGMENT_MAGIC, "Not a pysgdb segment file"
+        segments = pickle.loads(buffer[table_offset:table_offset + table_length])
+
+        def segment(key: tuple) -> Any:
+            offset, length, typecode = segments[key]
+            if typecode is None:
+                return pickle.loads(buffer[offset:offset + length])
+            return buffer[offset:offset + length].cast(typecode)
+
+        def node_store(node_name: str) -> Any:
+            if ("nodes", node_name) in segments:
+                return segment(("nodes", node_name))
+            state = segment(("columnar", node_name))
+            for name, column in state["columns"].items():
+                if column is None:
+                    state["columns"][name] = segment(("column", node_name, name))
+            store = _Columns.__new__(_Columns)
+            store.__dict__.update(state)
+            return store
+
+        def compiled(key: tuple) -> Tuple[Any, Any, Any]:
+            return segment(("csr_rows", *key)), segment(("csr_offsets", *key)), segment(("csr_neighbors", *key))
+
+        self.db = segment(("meta",))
+        self.db["nodes"] = _LazyDict({node_name: partial(node_store, node_name) for node_name in self.db["schema"]["nodes"]})
+        self.db["->"] = {}
+        self.db["<-"] = {}
+        self._schema_changed()
+        for key in segments:
+            if key[0] == "adjacency":
+                _, direction, link, node_name = key
+                if link not in self.db[direction]:
+                    self.db[direction][link] = _LazyDict({})
+                self.db[direction][link].pending[node_name] = partial(segment, key)
+        self._csr = _LazyDict({key[1:]: partial(compiled, key[1:]) for key in segments if key[0] == "csr_rows"})
+        self._csr_stale = {}
+        if self._versions is not None:
+            self._publish()
+
+
+    def publish_shared(self, name: str) -> int:
+        # Writes the database in the segment format into a new shared memory block '<name>_<generation>',
+        # then points the control block '<name>' at it. Processes that called attach_shared(name) switch to
+        # it on their next refresh_shared(). The previous generation is kept for workers still switching,
+        # older ones are unlinked. Returns the new generation.
+        if self._shared is None or "blocks" not in self._shared:
+            assert self._shared is None, "Cannot publish from a database attached to shared memory"
+            try:
+                control = shared_memory.SharedMemory(name, create=True, size=_SHARED_CONTROL.size)
+                _SHARED_CONTROL.pack_into(control.buf, 0, 0)
+            except FileExistsError:
+                control = _open_shared_memory(name)  # left behind by an earlier writer, carry on from its generation
+            self._shared = {"name": name, "control": control, "blocks": {}}
+        assert self._shared["name"] == name, f"Already publishing as '{self._shared['name']}'"
+
+        buffer = io.BytesIO()
+        self._write_segments(buffer)
+        data = buffer.getbuffer()
+        control = self._shared["control"]
+        generation = _SHARED_CONTROL.unpack_from(control.buf, 0)[0] + 1
+        block = shared_memory.SharedMemory(f"{name}_{generation}", create=True, size=len(data))
+        block.buf[:len(data)] = data
+        del data
+
+        # one aligned 8 byte write, readers see the old generation or the new one
+        _SHARED_CONTROL.pack_into(control.buf, 0, generation)
+        blocks = self._shared["blocks"]
+        blocks[generation] = block
+        for old_generation in [old for old in blocks if old < generation - 1]:
+            blocks.pop(old_generation).unlink()
+        return generation
+
+
+    def attach_shared(self, name: str):
+        # Read replica of a database published with publish_shared(name) by another process. Node types and
+        # links are read from the shared block as with load_segments(), nothing is copied up front.
+        # The replica is frozen, writes to it stay local to this process.
+        assert self._shared is None, "Already attached to shared memory"
+        self._shared = {"name": name, "control": _open_shared_memory(name), "generation": None, "block": None, "retired": []}
+        assert self.refresh_shared(), f"Nothing published as '{name}' yet"
+
+
+    def refresh_shared(self) -> bool:
+        # switches to the newest published generation, if there is one. Returns whether it switched.
+        assert self._shared is not None and "generation" in self._shared, "Not attached to shared memory, see attach_shared()"
+        shared = self._shared
+        while True:
+            generation = _SHARED_CONTROL.unpack_from(shared["control"].buf, 0)[0]
+            if generation == 0 or generation == shared["generation"]:
+                return False
+            try:
+                block = _open_shared_memory(f"{shared['name']}_{generation}")
+                break
+            except FileNotFoundError:
+                continue  # unlinked by a newer publish while we were reading, read the control block again
+
+        self._attach_segments(block.buf)
+        if shared["block"] is not None:
+            shared["retired"].append(shared["block"])
+        shared["generation"], shared["block"] = generation, block
+        self._close_retired()
+        return True
+
+
+    def _close_retired(self):
+        # blocks of older generations can only be closed once nothing reads from them anymore
+        retired = []
+        for block in self._shared["retired"]:
+            try:
+                block.close()
+            except BufferError:
+                retired.append(block)
+        self._shared["retired"] = retired
+
+
+    def close_shared(self):
+        # the writer unlinks every block it published, a replica only detaches
+        if self._shared is None:
+            return
+        shared, self._shared = self._shared, None
+        if "blocks" in shared:
+            for block in shared["blocks"].values():
+                block.close()
+                block.unlink()
+            shared["control"].close()
+            shared["control"].unlink()
+        else:
+            self.db = None
+            self._csr = None
+            self._csr_stale = {}
+            for block in [shared["block"], *shared["retired"]]:
+                try:
+                    block.close()
+                except BufferError:
+                    pass  # still read by a snapshot or a result, freed with it
+            shared["control"].close()
+
+
+    def open_journal(self, folder_path: str, db_filename: str, sync_every: int | None = 1, sync_interval: float | None = None):
+        # From now on every create, delete, link, unlink and migrate is appended to '<db_filename>.log'.
+        # Records are flushed as they are written and fsynced every `sync_every` records and/or at most
+        # `sync_interval` seconds after they are written.
+        # The current database is checkpointed first, so load(folder_path, db_filename) recovers it.
+        assert hasattr(self, "db"), "Cannot open a journal before a schema is migrated"
+        assert self._journal is None, "A journal is already open"
+        self._journal = _Journal(os.path.join(folder_path, db_filename + ".log"), sync_every, sync_interval)
+        self._checkpoint_path = (folder_path, db_filename)
+        self.checkpoint()
+
+
+    def checkpoint(self):
+        # compacts the journal: writes the whole database to the snapshot file, then empties the log.
+        # Records are numbered, so a crash between the two steps only leaves records that load() skips.
+        assert self._journal is not None, "No journal is open"
+        self._journal.sync()
+        folder_path, db_filename = self._checkpoint_path
+        self.db["lsn"] = self.db.get("lsn", 0)
+        temp_filename = db_filename + ".tmp"
+        with open(os.path.join(folder_path, temp_filename), "wb") as f:
+            pickle.dump(self.db, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(os.path.join(folder_path, temp_filename), os.path.join(folder_path, db_filename))
+        self._journal.truncate()
+
+
+    def close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+    def _log(self, op: str, *args):
+        # called once at the end of every write
+        if self._journal is not None:
+            if self._cow:
+                self._own_root()
+            self.db["lsn"] = self.db.get("lsn", 0) + 1
+            self._journal.append((self.db["lsn"], op, args))
+        if self._versions is not None:
+            self._publish()
+
+
+# server mode: a DB served over a Unix socket or localhost TCP, see serve() and Client
+
+# DB methods a client may call
+SERVER_OPS = ("get", "get_columns", "find", "traverse", "path", "create", "delete", "link", "unlink", "link_many", "unlink_many")
+
+# frame header: payload length. Requests are (request_id, atomic, [(op, args)]),
+# responses are (request_id, [(ok, result or (error type, message))]), both pickled
+_FRAME = struct.Struct("<I")
+_MAX_FRAME = 1 << 30
+
+# the only classes a request may contain besides plain lists, tuples, dicts, sets, strings and numbers,
+# see the allow_classes parameter of serve() for attribute types of your own
+_FRAME_CLASSES = {("builtins", "slice"), ("builtins", "set"), ("builtins", "frozenset"), ("datetime", "datetime"), ("datetime", "date"), ("datetime", "time"), ("datetime", "timedelta"), ("datetime", "timezone")}
+
+
+class _FrameUnpickler(pickle.Unpickler):
+    # unpickling arbitrary classes would let any client run code in the server
+
+    def __init__(self, payload: bytes, classes: Set[Tuple[str, str]]):
+        super().__init__(io.BytesIO(payload))
+        self.classes = classes
+
+    def find_class(self, module: str, name: str):
+        # a real exception, not an assert: python -O must not turn the check off
+        if (module, name) not in self.classes:
+            raise pickle.UnpicklingError(f"Class not allowed in a pysgdb request: {module}.{name}")
+        return super().find_class(module, name)
+
+
+def _frame(message: tuple) -> bytes:
+    payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _FRAME.pack(len(payload)) + payload
+
+
+def _run_ops(db: "DB", atomic: bool, ops: List[tuple]) -> List[tuple]:
+    # one request: every op runs in order, an atomic request runs them in one transaction
+    def run(op: str, args: tuple) -> Any:
+        if op not in SERVER_OPS:
+            raise PermissionError(f"Operation not allowed: {op}")
+        result = getattr(db, op)(*args)
+        return list(result) if op == "path" else result
+
+    try:
+        if not atomic:
+            results = []
+            for op, args in ops:
+                try:
+                    results.append((True, run(op, args)))
+                except Exception as e:
+                    results.append((False, (type(e).__name__, str(e))))
+            return results
+        with db.transaction():
+            return [(True, run(op, args)) for op, args in ops]
+    except Exception as e:
+        return [(False, (type(e).__name__, str(e)))] * len(ops)
+
+
+async def _serve_connection(db: "DB", classes: Set[Tuple[str, str]], reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Requests are answered in the order they arrive, so a client can send many before reading any answer.
+    # Each request runs to the end before the next one starts, on any connection.
+    # A frame that is not a valid request closes the connection.
+    try:
+        while True:
+            length, = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+            if length > _MAX_FRAME:
+                break
+            try:
+                request_id, atomic, ops = _FrameUnpickler(await reader.readexactly(length), classes).load()
+            except (AssertionError, pickle.UnpicklingError, ValueError, TypeError, EOFError):
+                break
+            writer.write(_frame((request_id, _run_ops(db, atomic, ops))))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(db: "DB", path: str | None = None, host: str = "127.0.0.1", port: int = 0, allow_classes: List[Tuple[str, str]] = ()) -> asyncio.AbstractServer:
+    # Starts serving db on the Unix socket `path`, or on host:port when no path is given (port 0 picks a free port).
+    # allow_classes: (module, name) of attribute types clients may send besides builtins and datetime.
+    # Use `async with server: await server.serve_forever()`, or run_server() to block.
+    handler = partial(_serve_connection, db, _FRAME_CLASSES | set(allow_classes))
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path)
+    return await asyncio.start_server(handler, host, port)
+
+
+def run_server(db: "DB", path: str | None = None, host: str = "127.0.0.1", port: int = 0, allow_classes: List[Tuple[str, str]] = ()):
+    async def main():
+        async with await serve(db, path, host, port, allow_classes) as server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+class Client:
+    # Blocking client for serve(). Connections are pooled and can be used from many threads.
+    # Every op in SERVER_OPS is also a method: client.traverse("Person", ids, "->", "has", "Ticket").
+
+    def __init__(self, path: str | None = None, host: str = "127.0.0.1", port: int | None = None, pool_size: int = 8):
+        assert path is not None or port is not None, "Client needs a Unix socket path or a TCP port"
+        self.address = path if path is not None else (host, port)
+        self.pool = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.request_ids = itertools.count(1)
+
+    def __getattr__(self, op: str):
+        if op not in SERVER_OPS:
+            raise AttributeError(op)
+        return lambda *args: self.batch([(op, args)])[0]
+
+    def batch(self, ops: List[tuple], atomic: bool = False) -> List[Any]:
+        # Runs [(op, args), ...] in one round trip and returns their results. An atomic batch runs in one
+        # transaction on the server. The first error is raised once the whole batch has run.
+        return self.pipeline([ops], atomic)[0]
+
+    def pipeline(self, batches: List[List[tuple]], atomic: bool = False, window: int = 64) -> List[List[Any]]:
+        # Sends the batches on one connection without waiting for answers, keeping at most `window` of them
+        # in flight: a client that never reads would stall a server waiting to write its answers.
+        connection = self._acquire()
+        try:
+            request_ids, responses = [], []
+            for ops in batches:
+                if len(request_ids) - len(responses) >= window:
+                    responses.append(self._receive(connection))
+                request_ids.append(next(self.request_ids))
+                connection.sendall(_frame((request_ids[-1], atomic, [(op, tuple(args)) for op, args in ops])))
+            while len(responses) < len(request_ids):
+                responses.append(self._receive(connection))
+        except BaseException:
+            connection.close()  # answers may still be on the way, the connection cannot be reused
+            self.slots.release()
+            raise
+        self._release(connection)
+
+        results = []
+        for request_id, (response_id, answers) in zip(request_ids, responses):
+            assert response_id == request_id, "Answers arrived out of order"
+            for ok, value in answers:
+                if not ok:
+                    error_type, message = value
+                    error = getattr(builtins, error_type, None)
+                    raise (error if isinstance(error, type) and issubclass(error, Exception) else RuntimeError)(message)
+            results.append([value for _, value in answers])
+        return results
+
+    def _acquire(self) -> socket.socket:
+        self.slots.acquire()
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            if type(self.address) is str:
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            else:
+                connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection.connect(self.address)
+            return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _release(self, connection: socket.socket):
+        self.pool.put(connection)
+        self.slots.release()
+
+    @staticmethod
+    def _receive(connection: socket.socket) -> tuple:
+        def read(count: int) -> bytearray:
+            data = bytearray(count)
+            view = memoryview(data)
+            while view:
+                received = connection.recv_into(view)
+                if not received:
+                    raise ConnectionError("Server closed the connection")
+                view = view[received:]
+            return data
+        length, = _FRAME.unpack(read(_FRAME.size))
+        return pickle.loads(read(length))  # answers come from the server the client chose to trust
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                return
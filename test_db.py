@@ -1,7 +1,17 @@
 import unittest
+import re
+import random
+import tempfile
+from copy import deepcopy
 from datetime import datetime
-from pysgdb import DB, _unique_elements, _unique_tuples
+from decimal import Decimal
+from pysgdb import DB, Client, KeyMap, serve, _unique_elements, _unique_tuples, _parse_path
 import os
+import multiprocessing
+import asyncio
+import threading
+import subprocess
+import sys
 
 
 class TestDB(unittest.TestCase):
@@ -67,6 +77,43 @@ class TestDB(unittest.TestCase):
             self.db.create("Person", [])
 
 
+    def test_create_validates_every_row(self):
+        self.make_new_db()
+        good = [{"date": datetime(2000, 1, 1), "theater": f"Theater {i}"} for i in range(100)]
+        for bad_row, message in [
+            ({"date": datetime(2000, 1, 1), "theater": 5}, "theater of row 50"),
+            ({"date": "2000-01-01", "theater": "Theater 5"}, "date of row 50"),
+            ({"date": datetime(2000, 1, 1)}, "theater missing in row 50"),
+            ({"date": datetime(2000, 1, 1), "theater": "Theater 5", "seats": 100}, "row 50 of Showing has ['seats']"),
+            (["Theater 5"], "Row 50 of Showing is not a dict")
+        ]:
+            with self.assertRaisesRegex(AssertionError, re.escape(message)):
+                self.db.create("Showing", good[:50] + [bad_row] + good[50:])
+        self.assertEqual(len(self.db.db["nodes"]["Showing"]), 0)
+
+        # a sample checks rows spread over the batch, trusted rows are not checked at all
+        rows = good[:51] + [{"date": datetime(2000, 1, 1), "theater": 5}] + good[51:]
+        with self.assertRaisesRegex(AssertionError, "row 51"):
+            self.db.create("Showing", rows, sample=101)
+        with self.assertRaisesRegex(AssertionError, "row 51"):
+            self.db.create("Showing", rows, sample=30)  # every third row
+        self.assertEqual(len(self.db.create("Showing", rows, sample=10)), 101)
+        self.assertEqual(len(self.db.create("Showing", rows, trusted=True)), 101)
+        # but the node type and the batch itself still are, before any id is handed out
+        current_id = self.db.db["current_id"]
+        for node_name, batch in (("Concert", good[:1]), ("Showing", []), ("Showing", good[0])):
+            with self.assertRaises(AssertionError):
+                self.db.create(node_name, batch, trusted=True)
+        self.assertEqual(self.db.db["current_id"], current_id)
+
+        # type names outside the builtins are compared by name
+        self.db = DB()
+        self.db.migrate({"nodes": {"Price": {"amount": "Decimal"}}, "links": set()})
+        self.db.create("Price", [{"amount": Decimal("9.50")}, {"amount": Decimal("12")}])
+        with self.assertRaises(AssertionError):
+            self.db.create("Price", [{"amount": Decimal("9.50")}, {"amount": 12.0}])
+
+
     def test_delete(self):
         self.make_new_db()
         
@@ -98,6 +145,64 @@ class TestDB(unittest.TestCase):
             self.db.delete("InvalidNode", [person_id])
 
 
+    def test_delete_target_and_bulk(self):
+        self.make_new_db()
+        person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}, {"seat": "A3"}])
+        showing_id = self.db.create("Showing", [{"date": datetime(2023, 9, 24), "theater": "Palace"}])[0]
+        self.db.link("Person", person_ids, "has", "Ticket", ticket_ids)
+        self.db.link("Ticket", ticket_ids, "for", "Showing", [showing_id])
+
+        # Ticket is the target of 'has' and the source of 'for', both sides are cleaned up
+        self.db.delete("Ticket", ticket_ids[:2])
+        self.assertEqual(self.db.traverse("Person", [person_ids[0]], "->", "has", "Ticket"), [ticket_ids[2]])
+        self.assertEqual(self.db.traverse("Showing", [showing_id], "<-", "for", "Ticket"), [ticket_ids[2]])
+        self.assertNotIn(ticket_ids[0], self.db.db["<-"]["has"]["Ticket"])
+        self.assertNotIn(ticket_ids[0], self.db.db["->"]["for"]["Ticket"])
+
+        # empty containers are removed
+        self.db.delete("Ticket", [ticket_ids[2]])
+        self.assertEqual(self.db.db["->"]["has"]["Person"], {})
+        self.assertEqual(self.db.db["<-"]["for"]["Showing"], {})
+
+        # nothing is deleted when any id is wrong
+        with self.assertRaises(AssertionError):
+            self.db.delete("Person", [person_ids[0], "100"])
+        self.assertIn(person_ids[0], self.db.db["nodes"]["Person"])
+
+        # a node type that is only ever a link target can be migrated away once it is empty
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Showing": {"date": "datetime", "theater": "str"},
+                "Ticket": {"seat": "str"}
+            },
+            "links": {
+                ("Person", "has", "Ticket"),
+                ("Ticket", "for", "Showing")
+            }
+        })
+        self.assertNotIn("Movie", self.db.db["nodes"])
+        with self.assertRaises(AssertionError):
+            self.db.migrate({
+                "nodes": {"Person": {"name": "str"}, "Ticket": {"seat": "str"}},
+                "links": {("Person", "has", "Ticket"), ("Ticket", "for", "Showing")}
+            })
+
+
+    def test_delete_self_link(self):
+        self.db = DB()
+        self.db.migrate({"nodes": {"Person": {"name": "str"}}, "links": {("Person", "knows", "Person")}})
+        bob, alice, eve = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}, {"name": "Eve"}])
+        self.db.link("Person", [bob, alice], "knows", "Person", [bob, alice, eve])
+
+        self.db.delete("Person", [bob])
+        self.assertEqual(sorted(self.db.traverse("Person", [alice], "->", "knows", "Person")), sorted([alice, eve]))
+        self.assertEqual(self.db.traverse("Person", [eve], "<-", "knows", "Person"), [alice])
+        self.assertNotIn(bob, self.db.db["->"]["knows"]["Person"])
+        self.assertNotIn(bob, self.db.db["<-"]["knows"]["Person"])
+
+
     def test_link(self):
         self.make_new_db()
 
@@ -406,6 +511,1612 @@ class TestDB(unittest.TestCase):
 
         self.db.delete("Person", [person_id])
 
+    def test_link_many(self):
+        self.make_new_db()
+        person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}, {"seat": "A3"}])
+
+        # parallel id lists
+        added = self.db.link_many("Person", [person_ids[0], person_ids[0], person_ids[1]], "has", "Ticket", ticket_ids)
+        self.assertEqual(added, 3)
+        self.assertEqual(self.db.db["->"]["has"]["Person"][person_ids[0]]["Ticket"], set(ticket_ids[:2]))
+        self.assertEqual(self.db.db["<-"]["has"]["Ticket"][ticket_ids[2]]["Person"], {person_ids[1]})
+
+        # pairs, links that already exist are not counted
+        added = self.db.link_many("Person", [(person_ids[1], ticket_ids[2]), (person_ids[1], ticket_ids[0])], "has", "Ticket")
+        self.assertEqual(added, 1)
+        self.assertEqual(sorted(self.db.traverse("Ticket", [ticket_ids[0]], "<-", "has", "Person")), sorted(person_ids))
+
+        removed = self.db.unlink_many("Person", [(person_ids[0], ticket_ids[0]), (person_ids[1], ticket_ids[1])], "has", "Ticket")
+        self.assertEqual(removed, 1)
+        self.assertEqual(self.db.traverse("Ticket", [ticket_ids[0]], "<-", "has", "Person"), [person_ids[1]])
+
+        removed = self.db.unlink_many("Person", [person_ids[0], person_ids[1], person_ids[1]], "has", "Ticket", [ticket_ids[1], ticket_ids[0], ticket_ids[2]])
+        self.assertEqual(removed, 3)
+        self.assertEqual(self.db.db["->"]["has"]["Person"], {})
+        self.assertEqual(self.db.db["<-"]["has"]["Ticket"], {})
+
+        # nothing is linked when any id of the batch is wrong
+        with self.assertRaises(AssertionError):
+            self.db.link_many("Person", [person_ids[0], "10"], "has", "Ticket", [ticket_ids[0], ticket_ids[1]])
+        self.assertEqual(self.db.db["->"]["has"]["Person"], {})
+        with self.assertRaises(AssertionError):
+            self.db.link_many("Person", [(person_ids[0], person_ids[1])], "has", "Ticket")
+        with self.assertRaises(AssertionError):
+            self.db.link_many("Person", person_ids, "has", "Ticket", ticket_ids)
+        with self.assertRaises(AssertionError):
+            self.db.unlink_many("Person", [(person_ids[0], ticket_ids[0])], "for", "Ticket")
+
+
+    def test_transaction(self):
+        self.make_new_db()
+        bob = self.db.create("Person", [{"name": "Bob"}])[0]
+        with self.db.transaction():
+            ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}])
+            showing_id = self.db.create("Showing", [{"date": datetime(2000, 1, 1), "theater": "Theater 5"}])[0]
+            self.db.link("Person", [bob], "has", "Ticket", ticket_ids)
+            self.assertEqual(self.db.link_many("Ticket", [(ticket_id, showing_id) for ticket_id in ticket_ids], "for", "Showing"), 0)
+            self.db.unlink("Person", [bob], "has", "Ticket", ticket_ids[1:])
+            self.db.delete("Ticket", ticket_ids[1:])
+
+            # nothing is written before the block exits
+            self.assertEqual(self.db.get("Ticket", None, ["seat"]), [])
+
+        self.assertEqual(self.db.get("Ticket", None, ["id", "seat"]), [[ticket_ids[0], "A1"]])
+        self.assertEqual(self.db.traverse("Person", [bob], "->", "has", "Ticket"), ticket_ids[:1])
+        self.assertEqual(self.db.traverse("Showing", [showing_id], "<-", "for", "Ticket"), ticket_ids[:1])
+        self.assertEqual(self.db.db["current_id"], "4")
+
+
+    def test_transaction_rollback(self):
+        self.make_new_db()
+        bob = self.db.create("Person", [{"name": "Bob"}])[0]
+        ticket_id = self.db.create("Ticket", [{"seat": "A1"}])[0]
+        self.db.link("Person", [bob], "has", "Ticket", [ticket_id])
+        before = deepcopy(self.db.db)
+
+        # an exception inside the block
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.create("Person", [{"name": "Alice"}])
+                raise ValueError()
+        self.assertEqual(self.db.db, before)
+
+        # an invalid operation anywhere in the batch, including ids deleted earlier in it
+        for bad in [
+            lambda: self.db.link("Person", [bob], "has", "Ticket", ["10"]),
+            lambda: self.db.link("Person", [bob], "for", "Ticket", [ticket_id]),
+            lambda: self.db.create("Person", [{"name": 1}]),
+            lambda: (self.db.delete("Ticket", [ticket_id]), self.db.link("Person", [bob], "has", "Ticket", [ticket_id])),
+        ]:
+            with self.assertRaises(AssertionError):
+                with self.db.transaction():
+                    alice = self.db.create("Person", [{"name": "Alice"}])[0]
+                    self.db.link("Person", [alice], "has", "Ticket", [ticket_id])
+                    bad()
+            self.assertEqual(self.db.db, before)
+
+        # a failure while applying undoes what was applied so far
+        insert_rows = self.db._insert_rows
+        def failing_insert(node_name, ids, attributes):
+            if node_name == "Showing":
+                raise MemoryError()
+            insert_rows(node_name, ids, attributes)
+        self.db._insert_rows = failing_insert
+        with self.assertRaises(MemoryError):
+            with self.db.transaction():
+                self.db.unlink("Person", [bob], "has", "Ticket", [ticket_id])
+                self.db.delete("Person", [bob])
+                self.db.create("Ticket", [{"seat": "A2"}])
+                self.db.create("Showing", [{"date": datetime(2000, 1, 1), "theater": "Theater 5"}])
+        del self.db._insert_rows
+        self.assertEqual(self.db.db, before)
+
+        with self.db.transaction():
+            with self.assertRaises(AssertionError):
+                with self.db.transaction():
+                    pass
+
+
+    def test_get_iter(self):
+        self.make_new_db()
+        ticket_ids = []
+        for i in range(20):
+            ticket_ids += self.db.create("Ticket", [{"seat": f"A{i}-{j}"} for j in range(5)])
+            self.db.create("Person", [{"name": "Bob"}] * 30)  # ids of other node types in between
+        self.db.delete("Ticket", ticket_ids[3:40])
+
+        everything = self.db.get("Ticket", None, ["id", "seat"])
+        self.assertEqual(list(self.db.get_iter("Ticket", None, ["id", "seat"])), everything)
+        batches = list(self.db.get_iter("Ticket", None, ["id", "seat"], batch_size=7))
+        self.assertEqual([len(batch) for batch in batches], [7] * 9)
+        self.assertEqual([row for batch in batches for row in batch], everything)
+        columns = list(self.db.get_iter("Ticket", None, ["seat"], batch_size=50, columns=True))
+        self.assertEqual([seat for batch in columns for seat in batch[0]], [seat for _, seat in everything])
+        self.assertEqual(list(self.db.get_iter("Ticket", ticket_ids[40:43], ["seat"])), [["A8-0"], ["A8-1"], ["A8-2"]])
+        self.assertEqual(list(self.db.get_iter("Ticket", None, ["id"], after=ticket_ids[97])), [[ticket_ids[98]], [ticket_ids[99]]])
+        with self.assertRaises(AssertionError):
+            self.db.get_iter("Ticket", None, ["price"])
+
+
+    def test_page(self):
+        self.make_new_db()
+        ticket_ids = []
+        for i in range(10):
+            ticket_ids += self.db.create("Ticket", [{"seat": f"A{i}-{j}"} for j in range(5)])
+            self.db.create("Person", [{"name": "Bob"}] * 3000)  # sparse Ticket ids, pages fall back to a scan
+
+        page, token = self.db.page("Ticket", ["seat"], 20)
+        self.assertEqual(page, [[f"A{i // 5}-{i % 5}"] for i in range(20)])
+        self.assertEqual(token, ticket_ids[19])
+
+        # writes between pages: a deleted last id still works as a token, new nodes come last
+        self.db.delete("Ticket", ticket_ids[19:25])
+        new_ids = self.db.create("Ticket", [{"seat": "B0"}])
+        pages = []
+        while token is not None:
+            page, token = self.db.page("Ticket", ["id"], 20, token)
+            pages.append(page)
+        self.assertEqual([node_id for page in pages for node_id, in page], ticket_ids[25:] + new_ids)
+        self.assertEqual(self.db.page("Ticket", ["id", "seat"], 2, columns=True), ([ticket_ids[:2], ["A0-0", "A0-1"]], ticket_ids[1]))
+        with self.assertRaises(AssertionError):
+            self.db.page("Ticket", ["id"], 20, "not a token")
+
+
+    def test_pages_after_rollback(self):
+        for storage in ("dict", "columnar", "record"):
+            self.db = DB(storage=storage)
+            self.db.migrate({"nodes": {"Ticket": {"seat": "str"}}, "links": {("Ticket", "next", "Ticket")}})
+            ticket_ids = self.db.create("Ticket", [{"seat": f"A{i}"} for i in range(10)])
+
+            # a rolled back delete puts the rows back in id order
+            def failing_add_edges(*args, **kwargs):
+                raise MemoryError()
+            self.db._add_edges = failing_add_edges
+            with self.assertRaises(MemoryError):
+                with self.db.transaction():
+                    self.db.delete("Ticket", [ticket_ids[5], ticket_ids[0]])
+                    self.db.link("Ticket", [ticket_ids[1]], "next", "Ticket", [ticket_ids[2]])
+            del self.db._add_edges
+            self.assertEqual(len(self.db.db["nodes"]["Ticket"]), 10)
+            self.assertEqual([node_id for node_id, in self.db.get_iter("Ticket", None, ["id"])], ticket_ids)
+            self.assertEqual(self.db.page("Ticket", ["id"], 3), ([[node_id] for node_id in ticket_ids[:3]], ticket_ids[2]))
+            self.assertEqual([node_id for batch in self.db.get_iter("Ticket", None, ["id"], batch_size=3, after=ticket_ids[2]) for node_id, in batch], ticket_ids[3:])
+
+
+    def test_metrics(self):
+        self.make_new_db()
+        self.db.enable_metrics(slow_seconds=0.0, slow_log_size=3)
+        calls = []
+        self.db.add_hook(lambda op, args, kwargs: op, lambda op, value, seconds, error: calls.append((op, value, type(error))))
+        person_ids = self.db.create("Person", [{"name": "A"}, {"name": "B"}])
+        ticket_ids = self.db.create(node_name="Ticket", attributes=[{"seat": f"A{i}"} for i in range(5)])
+        self.db.link("Person", person_ids, "has", "Ticket", ticket_ids)
+        self.assertEqual(len(self.db.traverse("Person", person_ids, "->", "has", "Ticket")), 5)
+        with self.assertRaises(AssertionError):
+            self.db.delete("Person", ["nope"])
+
+        metrics = self.db.metrics()
+        self.assertEqual({op: (counters["calls"], counters["errors"], counters["items"]) for op, counters in metrics["ops"].items()},
+                         {"create": (2, 0, 7), "link": (1, 0, 10), "traverse": (1, 0, 5), "delete": (1, 1, 0)})
+        self.assertEqual(sum(metrics["ops"]["create"]["histogram"].values()), 2)
+        self.assertEqual([entry["op"] for entry in metrics["slow"]], ["link", "traverse", "delete"])
+        self.assertEqual(metrics["slow"][0]["args"], ["'Person'", repr(person_ids), "'has'", "'Ticket'", "<list of 5>"])
+        self.assertEqual(calls[0], ("create", "create", type(None)))
+        self.assertEqual(calls[-1], ("delete", "delete", AssertionError))
+
+        self.assertEqual(self.db.metrics(reset=True)["ops"]["create"]["calls"], 2)
+        self.assertEqual(self.db.metrics(), {"ops": {}, "slow": []})
+
+        # metering never changes what a call does, even when it cannot count the items
+        self.db.delete("Ticket", iter(ticket_ids[:1]))
+        self.assertEqual(len(self.db.db["nodes"]["Ticket"]), 4)
+        self.assertEqual(self.db.metrics()["ops"]["delete"]["items"], 0)
+        self.db.disable_metrics()
+        self.assertNotIn("create", vars(self.db))
+        self.db.create("Person", [{"name": "C"}])
+        with self.assertRaises(AssertionError):
+            self.db.metrics()
+
+
+    def test_snapshots(self):
+        self.make_new_db()
+        bob = self.db.create("Person", [{"name": "Bob"}])[0]
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}])
+        self.db.link("Person", [bob], "has", "Ticket", ticket_ids[:1])
+        self.db.enable_snapshots()
+
+        # every write publishes a new version, versions taken before it do not change
+        versions = [(self.db.snapshot(), deepcopy(self.db.db))]
+        writes = [
+            lambda: self.db.create("Person", [{"name": "Alice"}]),
+            lambda: self.db.link("Person", [bob], "has", "Ticket", ticket_ids[1:]),
+            lambda: self.db.unlink("Person", [bob], "has", "Ticket", ticket_ids[:1]),
+            lambda: self.db.delete("Ticket", ticket_ids[1:]),
+            lambda: self.db.migrate({**self.db.db["schema"], "indexes": {"Person": {"name": "hash"}}}),
+            lambda: self.db.delete("Person", [bob]),
+        ]
+        for write in writes:
+            write()
+            self.assertIsNot(self.db.snapshot(), versions[-1][0])
+            versions.append((self.db.snapshot(), deepcopy(self.db.db)))
+        with self.db.transaction():
+            carol = self.db.create("Person", [{"name": "Carol"}])[0]
+            self.db.link("Person", [carol], "has", "Ticket", ticket_ids[:1])
+        versions.append((self.db.snapshot(), deepcopy(self.db.db)))
+
+        for snapshot, state in versions:
+            self.assertEqual(snapshot.db, state)
+        first, last = versions[0][0], versions[-1][0]
+        self.assertEqual(first.get("Person", None, ["name"]), [["Bob"]])
+        self.assertEqual(first.traverse("Person", [bob], "->", "has", "Ticket"), ticket_ids[:1])
+        self.assertEqual(last.get("Person", None, ["name"]), [["Alice"], ["Carol"]])
+        self.assertEqual(last.find("Person", {"name": "Carol"}), [carol])
+        self.assertEqual(last.traverse("Ticket", ticket_ids[:1], "<-", "has", "Person"), [carol])
+
+        # snapshots are read only
+        with self.assertRaises(AssertionError):
+            first.create("Person", [{"name": "Dave"}])
+        with self.assertRaises(AssertionError):
+            first.link("Person", [bob], "has", "Ticket", ticket_ids[1:])
+        with self.assertRaises(AssertionError):
+            first.delete("Person", [bob])
+        with self.assertRaises(AssertionError):
+            first.enable_snapshots()
+        self.assertEqual(first.db, versions[0][1])
+
+
+    def test_cache(self):
+        self.make_new_db()
+        person_id = self.db.create("Person", [{"name": "Bob"}])[0]
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}])
+        showing_id = self.db.create("Showing", [{"date": datetime(2000, 1, 1), "theater": "Theater 5"}])[0]
+        self.db.link("Person", [person_id], "has", "Ticket", ticket_ids[:1])
+        self.db.link("Ticket", ticket_ids, "for", "Showing", [showing_id])
+        self.db.enable_cache(max_entries=2)
+
+        for _ in range(3):
+            self.assertEqual(self.db.traverse("Person", [person_id], "->", "has", "Ticket"), ticket_ids[:1])
+            self.assertEqual(sorted(self.db.traverse("Showing", [showing_id], "<-", "for", "Ticket")), ticket_ids)
+        self.assertEqual(self.db.cache_stats()["hits"], 4)
+        self.assertEqual(self.db.cache_stats()["misses"], 2)
+
+        # a write to 'has' invalidates the 'has' result only
+        self.db.link("Person", [person_id], "has", "Ticket", ticket_ids[1:])
+        self.assertEqual(sorted(self.db.traverse("Person", [person_id], "->", "has", "Ticket")), ticket_ids)
+        self.assertEqual(sorted(self.db.traverse("Showing", [showing_id], "<-", "for", "Ticket")), ticket_ids)
+        self.assertEqual(self.db.cache_stats()["misses"], 3)
+        self.assertEqual(self.db.cache_stats()["hits"], 5)
+
+        # so do deletes of linked nodes
+        self.db.delete("Ticket", ticket_ids[1:])
+        self.assertEqual(self.db.traverse("Showing", [showing_id], "<-", "for", "Ticket"), ticket_ids[:1])
+
+        # path results are cached with the versions of every link they read
+        query = "Person->has:Ticket->for:Showing"
+        self.assertEqual(list(self.db.path(query, [person_id])), [showing_id])
+        self.assertEqual(list(self.db.path(query, [person_id])), [showing_id])
+        self.db.unlink("Ticket", ticket_ids[:1], "for", "Showing", [showing_id])
+        self.assertEqual(list(self.db.path(query, [person_id])), [])
+
+        # least recently used entries are evicted
+        self.assertEqual(self.db.cache_stats()["entries"], 2)
+        self.assertGreater(self.db.cache_stats()["evictions"], 0)
+
+        # returned lists are copies
+        self.db.traverse("Person", [person_id], "->", "has", "Ticket").append("x")
+        self.assertEqual(self.db.traverse("Person", [person_id], "->", "has", "Ticket"), ticket_ids[:1])
+
+
+    def test_freeze(self):
+        self.make_new_db()
+        person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}, {"seat": "A3"}])
+        self.db.link("Person", [person_ids[0]], "has", "Ticket", ticket_ids[:2])
+        self.db.link("Person", [person_ids[1]], "has", "Ticket", ticket_ids[1:])
+
+        self.db.freeze()
+        self.assertEqual(sorted(self.db.traverse("Person", person_ids, "->", "has", "Ticket")), sorted(ticket_ids))
+        self.assertEqual(sorted(self.db.traverse("Ticket", [ticket_ids[1]], "<-", "has", "Person")), sorted(person_ids))
+        self.assertEqual(self.db.traverse("Ticket", ticket_ids, "->", "for", "Showing"), [])
+
+        # writes keep the compiled triple, the ids they touch are read from the dictionaries
+        compiled = self.db._csr[("->", "has", "Person", "Ticket")]
+        self.db.unlink("Person", [person_ids[1]], "has", "Ticket", [ticket_ids[1]])
+        self.assertEqual(self.db.traverse("Ticket", [ticket_ids[1]], "<-", "has", "Person"), [person_ids[0]])
+        self.assertEqual(self.db.degree("Person", person_ids, "->", "has", "Ticket"), [2, 1])
+        self.assertEqual(self.db.count_by_neighbor("Person", None, "->", "has", "Ticket"), {ticket_ids[0]: 1, ticket_ids[1]: 1, ticket_ids[2]: 1})
+        self.assertIs(self.db._csr[("->", "has", "Person", "Ticket")], compiled)
+
+        self.db.delete("Person", [person_ids[0]])
+        self.assertEqual(self.db.traverse("Ticket", ticket_ids, "<-", "has", "Person"), [person_ids[1]])
+        self.assertEqual(sorted(self.db.path("Ticket<-has:Person->has:Ticket", ticket_ids)), [ticket_ids[2]])
+
+        # many changed ids compile the triple again
+        more_ids = self.db.create("Ticket", [{"seat": f"B{i}"} for i in range(2000)])
+        self.db.link("Person", [person_ids[1]], "has", "Ticket", more_ids)
+        self.assertEqual(len(self.db.traverse("Ticket", more_ids, "<-", "has", "Person")), 1)
+        self.assertEqual(self.db._csr_stale.get(("<-", "has", "Ticket", "Person")), None)
+        self.assertEqual(len(self.db.traverse("Person", person_ids[1:], "->", "has", "Ticket")), 2001)
+
+        self.db.thaw()
+        self.assertEqual(self.db.traverse("Ticket", ticket_ids, "<-", "has", "Person"), [person_ids[1]])
+
+
+    def test_path(self):
+        self.make_new_db()
+        bob, alice = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        ticket_1, ticket_2, ticket_3 = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}, {"seat": "A3"}])
+        showing_1, showing_2 = self.db.create("Showing", [
+            {"date": datetime(2000, 1, 1), "theater": "Theater 5"},
+            {"date": datetime(2010, 1, 1), "theater": "Theater 2"}
+        ])
+        movie_id = self.db.create("Movie", [{"title": "The Movie"}])[0]
+        self.db.link("Person", [bob], "has", "Ticket", [ticket_1, ticket_2])
+        self.db.link("Person", [alice], "has", "Ticket", [ticket_3])
+        self.db.link("Ticket", [ticket_1, ticket_2], "for", "Showing", [showing_1])
+        self.db.link("Ticket", [ticket_3], "for", "Showing", [showing_2])
+        self.db.link("Showing", [showing_1, showing_2], "of", "Movie", [movie_id])
+
+        query = "Person->has:Ticket->for:Showing->of:Movie"
+        self.assertEqual(list(self.db.path(query, [bob, alice])), [movie_id])
+        self.assertEqual(sorted(self.db.path(query, None, pairs=True)), [(bob, movie_id), (alice, movie_id)])
+        self.assertEqual(sorted(self.db.path("Movie<-of:Showing<-for:Ticket<-has:Person", [movie_id])), sorted([bob, alice]))
+        self.assertEqual(sorted(self.db.path("Showing<-for:Ticket", [showing_1])), sorted([ticket_1, ticket_2]))
+
+        self.db.freeze()
+        self.assertEqual(sorted(self.db.path("Ticket->for:Showing<-for:Ticket", [ticket_1], pairs=True)), [(ticket_1, ticket_1), (ticket_1, ticket_2)])
+
+        # the whole path is validated before anything is read
+        with self.assertRaises(AssertionError):
+            self.db.path("Person->has:Ticket->of:Movie", [bob])
+        with self.assertRaises(AssertionError):
+            self.db.path("Ticket<-for:Showing", [ticket_1])
+        with self.assertRaises(AssertionError):
+            self.db.path(query, ["100"])
+
+
+    def test_parse_path(self):
+        self.assertEqual(_parse_path("Person->has:Ticket"), ("Person", [("->", "has", "Ticket")]))
+        self.assertEqual(_parse_path("Ticket<-has:Person->has:Ticket"), ("Ticket", [("<-", "has", "Person"), ("->", "has", "Ticket")]))
+        with self.assertRaises(AssertionError):
+            _parse_path("Person")
+        with self.assertRaises(AssertionError):
+            _parse_path("Person->has")
+        with self.assertRaises(AssertionError):
+            _parse_path("Person=>has:Ticket")
+
+
+class TestIndexes(unittest.TestCase):
+
+    def make_new_db(self, storage=None):
+        self.schema = {
+            "nodes": {
+                "Person": {"name": "str"},
+                "Showing": {"date": "datetime", "theater": "str"}
+            },
+            "links": set(),
+            "indexes": {
+                "Showing": {"date": "sorted", "theater": "hash"}
+            }
+        }
+        self.db = DB(storage=storage)
+        self.db.migrate(self.schema)
+        self.showing_ids = self.db.create("Showing", [
+            {"date": datetime(2000, 1, 1), "theater": "Theater 5"},
+            {"date": datetime(2005, 1, 1), "theater": "Theater 2"},
+            {"date": datetime(2010, 1, 1), "theater": "Theater 5"},
+            {"date": datetime(2010, 1, 1), "theater": "Theater 2"}
+        ])
+
+
+    def test_find(self):
+        for storage in ("dict", "columnar", "record"):
+            self.make_new_db(storage)
+            s1, s2, s3, s4 = self.showing_ids
+
+            self.assertEqual(sorted(self.db.find("Showing", {"theater": "Theater 5"})), [s1, s3])
+            self.assertEqual(sorted(self.db.find("Showing", {"date": datetime(2010, 1, 1)})), [s3, s4])
+            self.assertEqual(sorted(self.db.find("Showing", {"date": slice(datetime(2001, 1, 1), datetime(2010, 1, 1))})), [s2])
+            self.assertEqual(sorted(self.db.find("Showing", {"date": slice(datetime(2001, 1, 1), None)})), [s2, s3, s4])
+            self.assertEqual(self.db.find("Showing", {"date": slice(None, datetime(2010, 1, 1)), "theater": "Theater 2"}), [s2])
+            self.assertEqual(self.db.find("Showing", {"theater": "Theater 9"}), [])
+
+            # unindexed attributes are scanned
+            person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+            self.assertEqual(self.db.find("Person", {"name": "Alice"}), [person_ids[1]])
+
+            with self.assertRaises(AssertionError):
+                self.db.find("Showing", {"seat": "A1"})
+
+
+    def test_indexes_follow_create_and_delete(self):
+        self.make_new_db()
+        s1, s2, s3, s4 = self.showing_ids
+        self.db.delete("Showing", [s3])
+        self.assertEqual(self.db.find("Showing", {"theater": "Theater 5"}), [s1])
+        self.assertEqual(self.db.find("Showing", {"date": datetime(2010, 1, 1)}), [s4])
+
+        s5 = self.db.create("Showing", [{"date": datetime(2003, 1, 1), "theater": "Theater 5"}])[0]
+        self.assertEqual(sorted(self.db.find("Showing", {"date": slice(datetime(2001, 1, 1), datetime(2006, 1, 1))})), sorted([s2, s5]))
+        self.assertEqual(self.db.db["indexes"]["Showing"]["date"].values, sorted(self.db.db["indexes"]["Showing"]["date"].values))
+
+        # a large delete rebuilds the sorted index in one pass
+        more_ids = self.db.create("Showing", [{"date": datetime(2000 + i % 20, 1, 1), "theater": "Theater 1"} for i in range(100)])
+        self.db.delete("Showing", more_ids[:90])
+        self.assertEqual(sorted(self.db.find("Showing", {"date": slice(datetime(2010, 1, 1), None)})), sorted([s4, *more_ids[90:]]))
+        self.assertEqual(sorted(self.db.find("Showing", {"theater": "Theater 1"})), sorted(more_ids[90:]))
+        index = self.db.db["indexes"]["Showing"]["date"]
+        self.assertEqual(index.values, sorted(index.values))
+        self.assertEqual(len(index.ids), 14)
+
+
+    def test_migrate_indexes(self):
+        self.make_new_db()
+        self.schema["indexes"] = {"Showing": {"theater": "sorted"}, "Person": {"name": "hash"}}
+        self.db.migrate(self.schema)
+        self.assertNotIn("date", self.db.db["indexes"]["Showing"])
+        self.assertEqual(self.db.db["indexes"]["Showing"]["theater"].kind, "sorted")
+        self.assertEqual(sorted(self.db.find("Showing", {"theater": slice("Theater 3", None)})), [self.showing_ids[0], self.showing_ids[2]])
+        self.assertIn("name", self.db.db["indexes"]["Person"])
+
+        self.schema["indexes"] = {}
+        self.db.migrate(self.schema)
+        self.assertEqual(self.db.db["indexes"], {})
+
+        with self.assertRaises(AssertionError):
+            self.db.migrate({**self.schema, "indexes": {"Showing": {"seat": "hash"}}})
+        with self.assertRaises(AssertionError):
+            self.db.migrate({**self.schema, "indexes": {"Showing": {"date": "btree"}}})
+
+
+class TestUnique(unittest.TestCase):
+
+    def make_new_db(self, storage=None):
+        self.schema = {
+            "nodes": {
+                "Person": {"email": "str", "name": "str", "age": "int"},
+                "Ticket": {"seat": "str"}
+            },
+            "links": {("Person", "has", "Ticket")},
+            "unique": {"Person": ["email"]}
+        }
+        self.db = DB(storage=storage)
+        self.db.migrate(self.schema)
+        self.person_ids = self.db.create("Person", [
+            {"email": "bob@example.com", "name": "Bob", "age": 30},
+            {"email": "alice@example.com", "name": "Alice", "age": 25}
+        ])
+
+
+    def test_unique_keys(self):
+        self.make_new_db()
+        bob, alice = self.person_ids
+        self.assertEqual(self.db.db["indexes"]["Person"]["email"].kind, "hash")
+
+        with self.assertRaises(AssertionError):
+            self.db.create("Person", [{"email": "bob@example.com", "name": "Bobby", "age": 31}])
+        with self.assertRaises(AssertionError):
+            self.db.create("Person", [{"email": "eve@example.com", "name": "Eve", "age": 20}, {"email": "eve@example.com", "name": "Eve", "age": 20}], trusted=True)
+        self.assertEqual(len(self.db.db["nodes"]["Person"]), 2)
+
+        # a deleted node frees its key
+        self.db.delete("Person", [bob])
+        new_bob = self.db.create("Person", [{"email": "bob@example.com", "name": "Bob", "age": 30}])[0]
+        self.assertEqual(self.db.find("Person", {"email": "bob@example.com"}), [new_bob])
+
+        # inside a transaction a key can move from a deleted node to a new one, but not be used twice
+        with self.db.transaction():
+            self.db.delete("Person", [alice])
+            self.db.create("Person", [{"email": "alice@example.com", "name": "Alice", "age": 26}])
+        self.assertEqual(len(self.db.find("Person", {"email": "alice@example.com"})), 1)
+        before = deepcopy(self.db.db)
+        with self.assertRaises(AssertionError):
+            with self.db.transaction():
+                self.db.create("Person", [{"email": "carol@example.com", "name": "Carol", "age": 40}])
+                self.db.create("Person", [{"email": "carol@example.com", "name": "Carol", "age": 41}])
+        self.assertEqual(self.db.db, before)
+
+
+    def test_upsert(self):
+        for storage in ("dict", "columnar", "record"):
+            self.make_new_db(storage)
+            bob, alice = self.person_ids
+            ids = self.db.upsert("Person", [
+                {"email": "alice@example.com", "age": 26},
+                {"email": "carol@example.com", "name": "Carol", "age": 40},
+                {"email": "bob@example.com", "name": "Bob", "age": 30},
+                {"email": "carol@example.com", "age": 41}
+            ], key="email")
+            carol = ids[1]
+            self.assertEqual(ids, [alice, carol, bob, carol])
+            self.assertNotIn(carol, self.person_ids)
+            self.assertEqual(self.db.get("Person", [alice, carol], ["email", "name", "age"]), [
+                ["alice@example.com", "Alice", 26],
+                ["carol@example.com", "Carol", 41]
+            ])
+            self.assertEqual(self.db.find("Person", {"email": "carol@example.com"}), [carol])
+
+            # nothing new: the same ids and no write at all
+            lsn = self.db.db.get("lsn")
+            self.assertEqual(self.db.upsert("Person", [{"email": "bob@example.com", "name": "Bob"}], key="email"), [bob])
+            self.assertEqual(self.db.db.get("lsn"), lsn)
+
+            # every row is checked before anything changes
+            before = deepcopy(self.db.db)
+            with self.assertRaises(AssertionError):
+                self.db.upsert("Person", [{"email": "dave@example.com", "name": "Dave", "age": 50}, {"email": "bob@example.com", "age": "old"}], key="email")
+            with self.assertRaises(AssertionError):
+                self.db.upsert("Person", [{"email": "erin@example.com", "name": "Erin"}], key="email")
+            with self.assertRaises(AssertionError):
+                self.db.upsert("Person", [{"name": "Bob"}], key="name")
+            self.assertEqual(self.db.db, before)
+
+
+    def test_upsert_keeps_other_unique_keys(self):
+        self.make_new_db()
+        bob, alice = self.person_ids
+        self.schema["unique"] = {"Person": ["email", "name"]}
+        self.db.migrate(self.schema)
+        with self.assertRaises(AssertionError):
+            self.db.upsert("Person", [{"email": "bob@example.com", "name": "Alice"}], key="email")
+        # names can be swapped in one batch
+        self.db.upsert("Person", [{"email": "bob@example.com", "name": "Alice"}, {"email": "alice@example.com", "name": "Bob"}], key="email")
+        self.assertEqual(self.db.find("Person", {"name": "Alice"}), [bob])
+        self.assertEqual(self.db.find("Person", {"name": "Bob"}), [alice])
+
+
+    def test_migrate_unique(self):
+        self.make_new_db()
+        with self.assertRaises(AssertionError):
+            self.db.migrate({**self.schema, "unique": {"Person": ["phone"]}})
+        self.db.create("Person", [{"email": "bobby@example.com", "name": "Bob", "age": 30}])
+        with self.assertRaises(AssertionError):
+            self.db.migrate({**self.schema, "unique": {"Person": ["email", "name"]}})
+        self.assertEqual(self.db.db["schema"]["unique"], {"Person": ["email"]})
+
+        # an explicit index is kept for a unique attribute, the implicit one goes with the declaration
+        self.db.migrate({**self.schema, "indexes": {"Person": {"email": "sorted"}}})
+        self.assertEqual(self.db.db["indexes"]["Person"]["email"].kind, "sorted")
+        with self.assertRaises(AssertionError):
+            self.db.create("Person", [{"email": "bob@example.com", "name": "Bob", "age": 30}])
+        self.db.migrate({**self.schema, "unique": {}})
+        self.assertEqual(self.db.db["indexes"], {})
+        self.db.create("Person", [{"email": "bob@example.com", "name": "Bob", "age": 30}])
+
+
+    def test_snapshots(self):
+        self.make_new_db()
+        self.db.enable_snapshots()
+        snapshot = self.db.snapshot()
+        before = deepcopy(snapshot.db)
+        self.db.upsert("Person", [{"email": "bob@example.com", "age": 31}, {"email": "carol@example.com", "name": "Carol", "age": 40}], key="email")
+        self.assertEqual(snapshot.db, before)
+        self.assertEqual(self.db.snapshot().get("Person", [self.person_ids[0]], ["age"]), [[31]])
+
+
+class TestPlanner(unittest.TestCase):
+
+    def make_new_db(self):
+        # a few Showings, each with many Tickets, each Ticket held by one Person
+        rng = random.Random(7)
+        self.db = DB()
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Ticket": {"seat": "str"},
+                "Showing": {"theater": "str"}
+            },
+            "links": {
+                ("Person", "has", "Ticket"),
+                ("Ticket", "for", "Showing")
+            }
+        })
+        self.person_ids = self.db.create("Person", [{"name": f"Person {i}"} for i in range(300)])
+        self.ticket_ids = self.db.create("Ticket", [{"seat": f"A{i}"} for i in range(1000)])
+        self.showing_ids = self.db.create("Showing", [{"theater": f"Theater {i}"} for i in range(5)])
+        self.db.link_many("Person", [rng.choice(self.person_ids) for _ in self.ticket_ids], "has", "Ticket", self.ticket_ids)
+        self.db.link_many("Ticket", self.ticket_ids, "for", "Showing", [rng.choice(self.showing_ids) for _ in self.ticket_ids])
+
+
+    def expected(self, start_ids, end_ids):
+        tickets = {ticket_id for person_id in start_ids for ticket_id in self.db.traverse("Person", [person_id], "->", "has", "Ticket")}
+        return set(self.db.traverse("Ticket", list(tickets), "->", "for", "Showing")) & set(end_ids)
+
+
+    def test_stats(self):
+        self.make_new_db()
+        stats = self.db.stats()
+        self.assertEqual(stats["nodes"], {"Person": 300, "Ticket": 1000, "Showing": 5})
+        has = stats["links"][("Person", "has", "Ticket")]
+        self.assertEqual((has["edges"], has["targets"], has["max_in_degree"], has["in_degree_histogram"]), (1000, 1000, 1, {1: 1000}))
+        self.assertEqual(sum(has["out_degree_histogram"].values()), has["sources"])
+        self.assertEqual(has["avg_out_degree"], 1000 / has["sources"])
+
+        # writes keep the catalog up to date, it matches one built from scratch
+        rng = random.Random(3)
+        for _ in range(50):
+            person_id, ticket_id = rng.choice(self.person_ids), rng.choice(self.ticket_ids)
+            rng.choice([self.db.link, self.db.unlink])("Person", [person_id], "has", "Ticket", [ticket_id])
+        self.db.delete("Showing", self.showing_ids[:1])
+        self.db.delete("Person", self.person_ids[:10])
+        with self.db.transaction():
+            self.db.link("Person", self.person_ids[10:20], "has", "Ticket", self.ticket_ids[:5])
+            self.db.delete("Ticket", self.ticket_ids[3:7])
+        maintained = self.db._link_stats()
+        self.db._stats = None
+        self.assertEqual(self.db._link_stats(), maintained)
+
+
+    def test_plans(self):
+        self.make_new_db()
+        query = "Person->has:Ticket->for:Showing"
+
+        # the persons holding tickets for one showing: cheaper from the showing
+        plan = self.db.explain(query, None, self.showing_ids[:1])
+        self.assertEqual(plan["plan"], "backward")
+        self.assertLess(plan["costs"]["backward"], plan["costs"]["forward"])
+        self.assertEqual([step["node"] for step in plan["steps"]], ["Person", "Ticket", "Showing"])
+        self.assertEqual(plan["steps"][-1]["actual"], 1)
+        self.assertEqual(plan["steps"][0]["reachable_actual"], len(set(self.db.path("Showing<-for:Ticket<-has:Person", self.showing_ids[:1]))))
+
+        # the showings of one person: cheaper from the person
+        plan = self.db.explain(query, self.person_ids[:1])
+        self.assertEqual(plan["plan"], "forward")
+        self.assertEqual(plan["steps"][1]["actual"], len(self.db.traverse("Person", self.person_ids[:1], "->", "has", "Ticket")))
+
+        # both plans give the same answers
+        for start_ids, end_ids in [(None, self.showing_ids[:1]), (self.person_ids[:1], None), (self.person_ids[:100], self.showing_ids[:2]), (None, None)]:
+            expected = self.expected(self.person_ids if start_ids is None else start_ids, self.showing_ids if end_ids is None else end_ids)
+            self.assertEqual(set(self.db.path(query, start_ids, end_ids=end_ids)), expected)
+            pairs = set(self.db.path(query, start_ids, pairs=True, end_ids=end_ids))
+            self.assertEqual({end_id for _, end_id in pairs}, expected)
+            for start_id, end_id in list(pairs)[:20]:
+                self.assertIn(end_id, self.expected([start_id], [end_id]))
+
+
+    def test_counts(self):
+        self.make_new_db()
+        some_ids = self.person_ids[:40] + self.person_ids[:5]
+        for frozen in (False, True):
+            if frozen:
+                self.db.freeze()
+            self.assertEqual(self.db.degree("Person", some_ids, "->", "has", "Ticket"), [len(self.db.traverse("Person", [person_id], "->", "has", "Ticket")) for person_id in some_ids])
+            self.assertEqual(sum(self.db.degree("Showing", None, "<-", "for", "Ticket")), 1000)
+            tickets = self.db.traverse("Person", some_ids, "->", "has", "Ticket")
+            self.assertEqual(self.db.count_neighbors("Person", some_ids, "->", "has", "Ticket"), len(tickets))
+            self.assertEqual(self.db.count_neighbors("Person", some_ids, "->", "has", "Ticket", distinct=False), len(tickets) + sum(self.db.degree("Person", some_ids[:5], "->", "has", "Ticket")))
+            self.assertEqual(self.db.count_neighbors("Ticket", None, "->", "for", "Showing"), len(self.db.traverse("Ticket", self.ticket_ids, "->", "for", "Showing")))
+            self.assertEqual(self.db.count_neighbors("Ticket", None, "<-", "has", "Person"), len(self.db.traverse("Ticket", self.ticket_ids, "<-", "has", "Person")))
+
+            per_showing = {showing_id: len(self.db.traverse("Showing", [showing_id], "<-", "for", "Ticket")) for showing_id in self.showing_ids}
+            self.assertEqual(self.db.count_by_neighbor("Ticket", None, "->", "for", "Showing"), {showing_id: count for showing_id, count in per_showing.items() if count})
+            counts = self.db.count_by_neighbor("Ticket", tickets + tickets[:3], "->", "for", "Showing")
+            self.assertEqual(sum(counts.values()), len(tickets))
+            self.assertEqual(counts, {showing_id: len(set(tickets) & set(self.db.traverse("Showing", [showing_id], "<-", "for", "Ticket"))) for showing_id in counts})
+            self.assertEqual(self.db.count_reachable("Person->has:Ticket->for:Showing", some_ids), len(self.expected(some_ids, self.showing_ids)))
+
+        with self.assertRaises(AssertionError):
+            self.db.degree("Person", some_ids, "<-", "has", "Ticket")
+        with self.assertRaises(AssertionError):
+            self.db.count_by_neighbor("Person", ["nope"], "->", "has", "Ticket")
+
+
+class TestAlgorithms(unittest.TestCase):
+
+    def make_new_db(self, ids):
+        # Persons who know each other, in a few separate groups, and hold Tickets for Showings
+        rng = random.Random(11)
+        self.db = DB(ids=ids)
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Ticket": {"seat": "str"},
+                "Showing": {"theater": "str"}
+            },
+            "links": {
+                ("Person", "knows", "Person"),
+                ("Person", "has", "Ticket"),
+                ("Ticket", "for", "Showing")
+            }
+        })
+        self.person_ids = self.db.create("Person", [{"name": f"Person {i}"} for i in range(200)])
+        self.ticket_ids = self.db.create("Ticket", [{"seat": f"A{i}"} for i in range(100)])
+        self.showing_ids = self.db.create("Showing", [{"theater": f"Theater {i}"} for i in range(3)])
+        for group in range(4):
+            members = self.person_ids[group * 50:(group + 1) * 50 - 5]
+            self.db.link_many("Person", [rng.choice(members) for _ in range(80)], "knows", "Person", [rng.choice(members) for _ in range(80)])
+        self.db.link_many("Person", [rng.choice(self.person_ids[:50]) for _ in self.ticket_ids], "has", "Ticket", self.ticket_ids)
+        self.db.link_many("Ticket", self.ticket_ids, "for", "Showing", [rng.choice(self.showing_ids) for _ in self.ticket_ids])
+
+
+    def distances(self, node_id, direction, links):
+        # plain bfs over Persons with traverse, {id: hops}
+        distances = {node_id: 0}
+        frontier = [node_id]
+        while frontier:
+            next_frontier = []
+            for person_id in frontier:
+                for other_direction in (["->", "<-"] if direction == "both" else [direction]):
+                    for other_id in self.db.traverse("Person", [person_id], other_direction, "knows", "Person"):
+                        if other_id not in distances:
+                            distances[other_id] = distances[person_id] + 1
+                            next_frontier.append(other_id)
+            frontier = next_frontier
+        return distances
+
+
+    def test_bfs(self):
+        for ids, frozen in (("str", False), ("int", False), ("int", True)):
+            self.make_new_db(ids)
+            if frozen:
+                self.db.freeze()
+            for person_id in self.person_ids[:60:7]:
+                for direction in ("->", "<-", "both"):
+                    distances = self.distances(person_id, direction, ["knows"])
+                    layers = list(self.db.bfs("Person", [person_id], direction, links=["knows"]))
+                    self.assertEqual({node_id: hops for hops, layer in layers for node_id in layer["Person"]}, distances)
+                    self.assertEqual(sum(len(layer["Person"]) for _, layer in layers), len(distances))
+                    reached = self.db.k_hop("Person", [person_id], 2, direction, links=["knows"])
+                    self.assertEqual(set(reached.get("Person", [])), {node_id for node_id, hops in distances.items() if 0 < hops <= 2})
+
+            # following every link reaches tickets and showings, node_names keeps the walk to Persons and Tickets
+            reached = self.db.k_hop("Person", self.person_ids[:50], 3)
+            self.assertEqual(set(reached["Showing"]), set(self.db.traverse("Ticket", self.ticket_ids, "->", "for", "Showing")))
+            reached = self.db.k_hop("Person", self.person_ids[:50], 3, node_names=["Person", "Ticket"])
+            self.assertNotIn("Showing", reached)
+            self.assertEqual(set(reached["Ticket"]), set(self.ticket_ids))
+            self.assertEqual(list(self.db.bfs("Person", [self.person_ids[0]], max_hops=0)), [(0, {"Person": [self.person_ids[0]]})])
+
+
+    def test_shortest_path(self):
+        for ids in ("str", "int"):
+            self.make_new_db(ids)
+            for person_id in self.person_ids[:50:5]:
+                for direction in ("->", "<-", "both"):
+                    distances = self.distances(person_id, direction, ["knows"])
+                    for other_id in self.person_ids[:60]:
+                        path = self.db.shortest_path("Person", person_id, "Person", other_id, direction, links=["knows"])
+                        if other_id not in distances:
+                            self.assertIsNone(path)
+                            continue
+                        self.assertEqual(len(path) - 1, distances[other_id])
+                        self.assertEqual((path[0], path[-1]), (("Person", person_id), ("Person", other_id)))
+                        for (_, node_id), (_, next_id) in zip(path, path[1:]):
+                            neighbors = set()
+                            for other_direction in (["->", "<-"] if direction == "both" else [direction]):
+                                neighbors.update(self.db.traverse("Person", [node_id], other_direction, "knows", "Person"))
+                            self.assertIn(next_id, neighbors)
+
+            showing_id = self.db.traverse("Ticket", [self.ticket_ids[0]], "->", "for", "Showing")[0]
+            path = self.db.shortest_path("Showing", showing_id, "Person", self.person_ids[0], "<-")
+            self.assertEqual([node_name for node_name, _ in path][:3], ["Showing", "Ticket", "Person"])
+            with self.assertRaises(AssertionError):
+                self.db.shortest_path("Person", self.person_ids[0], "Person", self.person_ids[1], links=["nope"])
+
+
+    def test_connected_components(self):
+        for ids in ("str", "int"):
+            self.make_new_db(ids)
+            components = list(self.db.connected_components(links=["knows"], node_names=["Person"]))
+            self.assertEqual(sorted(node_id for component in components for node_id in component["Person"]), sorted(self.person_ids))
+            for component in components:
+                person_ids = component["Person"]
+                self.assertEqual(set(person_ids), set(self.distances(person_ids[0], "both", ["knows"])))
+            # the Persons who know nobody are components of their own, among them the 5 left out of each group
+            linked = set(self.db.traverse("Person", self.person_ids, "->", "knows", "Person")) | set(self.db.traverse("Person", self.person_ids, "<-", "knows", "Person"))
+            self.assertEqual({component["Person"][0] for component in components if len(component["Person"]) == 1}, set(self.person_ids) - linked)
+            self.assertGreaterEqual(len(set(self.person_ids) - linked), 20)
+            everything = list(self.db.connected_components())
+            self.assertEqual(sum(sum(map(len, component.values())) for component in everything), 303)
+
+
+class TestAttributeMigrations(unittest.TestCase):
+
+    def make_new_db(self, storage):
+        self.schema = {
+            "nodes": {
+                "Person": {"name": "str"},
+                "Ticket": {"seat": "str", "price": "float", "row": "str"}
+            },
+            "links": {
+                ("Person", "has", "Ticket")
+            },
+            "indexes": {
+                "Ticket": {"seat": "hash", "row": "sorted"}
+            }
+        }
+        self.db = DB(storage=storage)
+        self.db.migrate(self.schema)
+        self.person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        self.ticket_ids = self.db.create("Ticket", [{"seat": f"A{i}", "price": 9.5 + i, "row": str(i % 3)} for i in range(10)])
+        self.db.link("Person", self.person_ids[:1], "has", "Ticket", self.ticket_ids[:4])
+
+
+    def test_migrations(self):
+        for storage in ("dict", "columnar", "record"):
+            self.make_new_db(storage)
+            schema = deepcopy(self.schema)
+            # add vip, drop price, rename seat to code, retype row to int
+            schema["nodes"]["Ticket"] = {"code": "str", "row": "int", "vip": "bool"}
+            schema["indexes"] = {"Ticket": {"code": "hash", "row": "sorted"}}
+            calls = []
+            self.db.migrate(schema, defaults={"Ticket": {"vip": False}}, renames={"Ticket": {"seat": "code"}}, converters={"Ticket": {"row": int}},
+                            chunk_size=4, progress=lambda *args: calls.append(args))
+            self.assertEqual(calls, [("Ticket", 4, 10), ("Ticket", 8, 10), ("Ticket", 10, 10)])
+            self.assertEqual(self.db.db["schema"]["nodes"]["Ticket"], {"code": "str", "row": "int", "vip": "bool"})
+            self.assertEqual(self.db.get("Ticket", self.ticket_ids[:2], ["id", "code", "row", "vip"]), [[self.ticket_ids[0], "A0", 0, False], [self.ticket_ids[1], "A1", 1, False]])
+            self.assertEqual(set(self.db.find("Ticket", {"row": 2})), {self.ticket_ids[2], self.ticket_ids[5], self.ticket_ids[8]})
+            self.assertEqual(self.db.find("Ticket", {"code": "A3"}), [self.ticket_ids[3]])
+            self.assertEqual(set(self.db.db["indexes"]["Ticket"]), {"code", "row"})
+            self.assertEqual(sorted(self.db.traverse("Person", self.person_ids[:1], "->", "has", "Ticket")), sorted(self.ticket_ids[:4]))
+            with self.assertRaises(AssertionError):
+                self.db.create("Ticket", [{"seat": "B1", "price": 1.0, "row": "1"}])
+            self.db.create("Ticket", [{"code": "B1", "row": 1, "vip": True}])
+
+
+    def test_failed_migrations_change_nothing(self):
+        self.make_new_db("dict")
+        before = self.db.get("Ticket", None, ["id", "seat", "price", "row"])
+        schema = deepcopy(self.schema)
+        schema["nodes"]["Ticket"]["vip"] = "bool"
+        with self.assertRaisesRegex(AssertionError, "without a default"):
+            self.db.migrate(schema)
+        with self.assertRaisesRegex(AssertionError, "must be a bool"):
+            self.db.migrate(schema, defaults={"Ticket": {"vip": 0}})
+
+        schema = deepcopy(self.schema)
+        schema["nodes"]["Ticket"]["row"] = "int"
+        with self.assertRaisesRegex(AssertionError, "without a converter"):
+            self.db.migrate(schema)
+        # the converter fails on the last chunk: nothing was swapped in
+        schema["nodes"]["Person"] = {"name": "str", "age": "int"}
+        with self.assertRaisesRegex(AssertionError, "Type mismatch"):
+            self.db.migrate(schema, defaults={"Person": {"age": 0}}, converters={"Ticket": {"row": lambda row: int(row) if row != "0" else None}}, chunk_size=3)
+        self.assertEqual(self.db.db["schema"], self.schema)
+        self.assertEqual(self.db.get("Ticket", None, ["id", "seat", "price", "row"]), before)
+        self.assertEqual(self.db.get("Person", None, ["name"]), [["Bob"], ["Alice"]])
+
+        with self.assertRaises(AssertionError):
+            self.db.migrate(self.schema, renames={"Ticket": {"gate": "seat"}})
+
+
+    def test_snapshots(self):
+        self.make_new_db("dict")
+        self.db.enable_snapshots()
+        snapshot = self.db.snapshot()
+        schema = deepcopy(self.schema)
+        schema["nodes"]["Ticket"]["vip"] = "bool"
+        schema["nodes"]["Movie"] = {"title": "str"}
+        schema["links"].add(("Ticket", "for", "Movie"))
+        self.db.migrate(schema, defaults={"Ticket": {"vip": True}})
+
+        # the snapshot keeps the old schema and rows, the node stores and link sets that did not change are shared
+        self.assertEqual(snapshot.db["schema"], self.schema)
+        self.assertEqual(snapshot.get("Ticket", self.ticket_ids[:1], ["seat", "price", "row"]), [["A0", 9.5, "0"]])
+        self.assertNotIn("Movie", snapshot.db["nodes"])
+        self.assertEqual(self.db.snapshot().get("Ticket", self.ticket_ids[:1], ["seat", "vip"]), [["A0", True]])
+        self.assertIs(self.db.db["nodes"]["Person"], snapshot.db["nodes"]["Person"])
+        self.assertIs(self.db.db["->"]["has"]["Person"], snapshot.db["->"]["has"]["Person"])
+
+
+class TestJournal(unittest.TestCase):
+
+    def make_new_db(self):
+        self.folder = tempfile.mkdtemp()
+        self.schema = {
+            "nodes": {
+                "Person": {"name": "str"},
+                "Ticket": {"seat": "str"}
+            },
+            "links": {
+                ("Person", "has", "Ticket")
+            }
+        }
+        self.db = DB()
+        self.db.migrate(self.schema)
+        self.db.open_journal(self.folder, "db", sync_every=2)
+
+
+    def tearDown(self):
+        if hasattr(self, "folder"):
+            self.db.close_journal()
+            for filename in os.listdir(self.folder):
+                os.remove(os.path.join(self.folder, filename))
+            os.rmdir(self.folder)
+
+
+    def recover(self) -> DB:
+        # what a new process sees after a crash: the checkpoint plus the journal
+        recovered = DB()
+        recovered.load(self.folder, "db")
+        return recovered
+
+
+    def test_replay(self):
+        self.make_new_db()
+        person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}])
+        self.db.link("Person", person_ids, "has", "Ticket", ticket_ids)
+        self.db.unlink("Person", [person_ids[1]], "has", "Ticket", [ticket_ids[0]])
+        self.db.delete("Ticket", [ticket_ids[1]])
+        self.schema["nodes"]["Movie"] = {"title": "str"}
+        self.db.migrate(self.schema)
+        self.db._journal.sync()
+
+        self.assertEqual(self.recover().db, self.db.db)
+
+
+    def test_replay_trusted_create(self):
+        self.make_new_db()
+        self.schema["nodes"]["Ticket"]["price"] = "float"
+        self.db.migrate(self.schema)
+        self.db.create("Ticket", [{"seat": "A1", "price": 3}], trusted=True)
+        self.db._journal.sync()
+        self.assertEqual(self.recover().db, self.db.db)
+
+        # replayed ops are not counted as calls
+        recovered = DB()
+        recovered.enable_metrics()
+        recovered.load(self.folder, "db")
+        self.assertEqual(set(recovered.metrics()["ops"]), {"load"})
+
+
+    def test_sync_interval(self):
+        self.make_new_db()
+        self.db.close_journal()
+        self.db.open_journal(self.folder, "db", sync_every=None, sync_interval=0.05)
+        self.db.create("Person", [{"name": "Bob"}])
+        # flushed right away, synced by the timer although no other write follows
+        self.assertEqual(len(self.recover().db["nodes"]["Person"]), 1)
+        self.assertEqual(self.db._journal.unsynced, 1)
+        for _ in range(100):
+            if self.db._journal.unsynced == 0:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(self.db._journal.unsynced, 0)
+
+
+    def test_replay_upsert(self):
+        self.make_new_db()
+        self.schema["unique"] = {"Ticket": ["seat"]}
+        self.db.migrate(self.schema)
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}])
+        self.assertEqual(self.db.upsert("Ticket", [{"seat": "A1"}, {"seat": "A2"}], key="seat")[0], ticket_ids[0])
+        self.db._journal.sync()
+
+        recovered = self.recover()
+        self.assertEqual(recovered.db, self.db.db)
+        with self.assertRaises(AssertionError):
+            recovered.create("Ticket", [{"seat": "A2"}])
+
+
+    def test_replay_attribute_migration(self):
+        self.make_new_db()
+        self.db.create("Ticket", [{"seat": "12"}, {"seat": "7"}])
+        schema = deepcopy(self.schema)
+        schema["nodes"]["Ticket"] = {"number": "int", "price": "float"}
+        self.db.migrate(schema, defaults={"Ticket": {"price": 9.5}}, renames={"Ticket": {"seat": "number"}}, converters={"Ticket": {"number": int}})
+        self.assertEqual(self.recover().get("Ticket", None, ["number", "price"]), [[12, 9.5], [7, 9.5]])
+        with self.assertRaises(AssertionError):
+            self.db.migrate(self.schema, renames={"Ticket": {"number": "seat"}}, converters={"Ticket": {"seat": lambda number: str(number)}})
+
+
+    def test_replay_transaction(self):
+        self.make_new_db()
+        with self.db.transaction():
+            person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+            ticket_ids = self.db.create("Ticket", [{"seat": "A1"}])
+            self.db.link("Person", person_ids, "has", "Ticket", ticket_ids)
+            self.db.delete("Person", person_ids[1:])
+        self.db.create("Ticket", [{"seat": "A2"}])
+        self.db._journal.sync()
+
+        self.assertEqual(self.db.db["lsn"], 2)
+        self.assertEqual(self.recover().db, self.db.db)
+
+
+    def test_checkpoint(self):
+        self.make_new_db()
+        self.db.create("Person", [{"name": "Bob"}])
+        self.db.checkpoint()
+        self.assertEqual(os.path.getsize(os.path.join(self.folder, "db.log")), 0)
+
+        self.db.create("Person", [{"name": "Alice"}])
+        self.db._journal.sync()
+        recovered = self.recover()
+        self.assertEqual(recovered.get("Person", None, ["name"]), [["Bob"], ["Alice"]])
+        self.assertEqual(recovered.db, self.db.db)
+
+
+    def test_torn_record(self):
+        self.make_new_db()
+        self.db.create("Person", [{"name": "Bob"}])
+        self.db.create("Person", [{"name": "Alice"}])
+        self.db.close_journal()
+
+        # a crash while writing the last record leaves half of it behind
+        journal_path = os.path.join(self.folder, "db.log")
+        with open(journal_path, "rb") as f:
+            journal = f.read()
+        with open(journal_path, "wb") as f:
+            f.write(journal[:-3])
+
+        recovered = self.recover()
+        self.assertEqual(recovered.get("Person", None, ["name"]), [["Bob"]])
+
+        # reopening the journal checkpoints the recovered state, the torn record is gone
+        recovered.open_journal(self.folder, "db")
+        recovered.create("Person", [{"name": "Eve"}])
+        self.db = recovered
+        self.assertEqual(self.recover().get("Person", None, ["name"]), [["Bob"], ["Eve"]])
+
+
+class TestSegments(unittest.TestCase):
+
+    def make_new_db(self, storage):
+        self.db = DB(storage=storage, ids="int")
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Ticket": {"seat": "str", "price": "float"},
+                "Movie": {"title": "str"}
+            },
+            "links": {
+                ("Person", "has", "Ticket")
+            }
+        })
+        self.person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        self.ticket_ids = self.db.create("Ticket", [{"seat": "A1", "price": 9.5}, {"seat": "A2", "price": 12.0}])
+        self.db.link("Person", self.person_ids, "has", "Ticket", self.ticket_ids[:1])
+        self.db.link("Person", self.person_ids[1:], "has", "Ticket", self.ticket_ids[1:])
+
+
+    def test_lazy_load(self):
+        for storage in ("dict", "columnar", "record"):
+            self.make_new_db(storage)
+            with tempfile.TemporaryDirectory() as folder:
+                self.db.save_segments(folder, "db")
+                loaded = DB()
+                loaded.load_segments(folder, "db")
+
+                # nothing but the metadata is read until a node type or link is used
+                self.assertEqual(set(loaded.db["nodes"].pending), {"Person", "Ticket", "Movie"})
+                self.assertEqual(loaded.db["schema"], self.db.db["schema"])
+
+                self.assertEqual(loaded.get("Ticket", None, ["id", "seat", "price"]), self.db.get("Ticket", None, ["id", "seat", "price"]))
+                self.assertEqual(set(loaded.db["nodes"].pending), {"Person", "Movie"})
+
+                # traverse reads the mapped CSR arrays
+                self.assertEqual(sorted(loaded.traverse("Ticket", self.ticket_ids, "<-", "has", "Person")), self.person_ids)
+                rows, offsets, neighbors = loaded._csr[("<-", "has", "Ticket", "Person")]
+                self.assertEqual(type(neighbors), memoryview)
+                self.assertIn("Ticket", loaded.db["<-"]["has"].pending)
+                if storage == "columnar":
+                    self.assertEqual(type(loaded.db["nodes"]["Ticket"].columns["price"]), memoryview)
+
+                self.assertEqual(loaded.db, self.db.db)
+
+                # writes copy what they touch out of the mapped file
+                loaded.unlink("Person", self.person_ids[:1], "has", "Ticket", self.ticket_ids[:1])
+                new_ticket = loaded.create("Ticket", [{"seat": "A3", "price": 7.0}])[0]
+                loaded.link("Person", self.person_ids[:1], "has", "Ticket", [new_ticket])
+                self.assertEqual(loaded.traverse("Person", self.person_ids[:1], "->", "has", "Ticket"), [new_ticket])
+                self.assertEqual(loaded.get("Ticket", [new_ticket], ["price"]), [[7.0]])
+
+                # and a lazily loaded database can be saved again in either format
+                loaded.save(folder, "db.pickle")
+                reloaded = DB()
+                reloaded.load(folder, "db.pickle")
+                self.assertEqual(reloaded.db, loaded.db)
+
+
+    def test_concurrent_readers(self):
+        self.make_new_db("columnar")
+        with tempfile.TemporaryDirectory() as folder:
+            self.db.save_segments(folder, "db")
+            loaded = DB()
+            loaded.load_segments(folder, "db")
+            loaded.enable_snapshots()
+            snapshot = loaded.snapshot()
+            # slow loaders, so every reader asks while the first one is still loading
+            pending = snapshot.db["nodes"].pending
+            for node_name, load in list(pending.items()):
+                pending[node_name] = lambda load=load: (threading.Event().wait(0.05), load())[1]
+
+            errors = []
+            def read():
+                try:
+                    self.assertEqual(len(snapshot.get("Ticket", None, ["id"])), 2)
+                except Exception as error:
+                    errors.append(error)
+            readers = [threading.Thread(target=read) for _ in range(8)]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            self.assertEqual(errors, [])
+
+
+    def test_shared_memory(self):
+        for storage in ("dict", "columnar", "record"):
+            self.make_new_db(storage)
+            name = f"pysgdb_test_{os.getpid()}"
+            try:
+                self.assertEqual(self.db.publish_shared(name), 1)
+                replica = DB()
+                replica.attach_shared(name)
+                self.assertEqual(replica.get("Ticket", None, ["id", "seat", "price"]), self.db.get("Ticket", None, ["id", "seat", "price"]))
+                self.assertEqual(replica.db, self.db.db)
+                self.assertFalse(replica.refresh_shared())
+
+                # replicas keep reading their generation until they refresh
+                new_ticket = self.db.create("Ticket", [{"seat": "A3", "price": 7.0}])[0]
+                self.db.link("Person", self.person_ids[:1], "has", "Ticket", [new_ticket])
+                self.assertEqual(self.db.publish_shared(name), 2)
+                self.assertEqual(replica.traverse("Person", self.person_ids[:1], "->", "has", "Ticket"), self.ticket_ids[:1])
+                self.assertTrue(replica.refresh_shared())
+                self.assertEqual(sorted(replica.traverse("Person", self.person_ids[:1], "->", "has", "Ticket")), [self.ticket_ids[0], new_ticket])
+
+                # other processes attach without copying the database through a pipe
+                with multiprocessing.get_context("spawn").Pool(1) as pool:
+                    self.assertEqual(pool.apply(_read_replica, (name, self.ticket_ids)), replica.traverse("Ticket", self.ticket_ids, "<-", "has", "Person"))
+                replica.close_shared()
+            finally:
+                self.db.close_shared()
+            if os.path.isdir("/dev/shm"):
+                self.assertFalse([filename for filename in os.listdir("/dev/shm") if filename.startswith(name)])
+
+
+def _read_replica(name, ticket_ids):
+    replica = DB()
+    replica.attach_shared(name)
+    return replica.traverse("Ticket", ticket_ids, "<-", "has", "Person")
+
+
+class TestServer(unittest.TestCase):
+
+    def start_server(self, unix: bool = True):
+        self.db = DB()
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Showing": {"date": "datetime", "theater": "str"},
+                "Ticket": {"seat": "str"}
+            },
+            "links": {
+                ("Person", "has", "Ticket"),
+                ("Ticket", "for", "Showing")
+            },
+            "indexes": {"Showing": {"date": "sorted"}}
+        })
+        self.folder = tempfile.mkdtemp()
+        path = os.path.join(self.folder, "db.sock") if unix else None
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(serve(self.db, path=path))
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        if unix:
+            self.client = Client(path=path, pool_size=4)
+        else:
+            self.client = Client(port=self.server.sockets[0].getsockname()[1], pool_size=4)
+
+
+    def tearDown(self):
+        async def shutdown():
+            # closed client connections end their handlers, wait for them before the loop goes away
+            self.server.close()
+            await self.server.wait_closed()
+            await asyncio.gather(*[task for task in asyncio.all_tasks() if task is not asyncio.current_task()])
+
+        self.client.close()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        for filename in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, filename))
+        os.rmdir(self.folder)
+
+
+    def test_ops(self):
+        for unix in (True, False):
+            if unix is False:
+                self.tearDown()
+            self.start_server(unix)
+            person_id = self.client.create("Person", [{"name": "Bob"}])[0]
+            showing_id = self.client.create("Showing", [{"date": datetime(2000, 1, 1), "theater": "Theater 5"}])[0]
+
+            # many ops, one round trip
+            ticket_ids, _, _ = self.client.batch([
+                ("create", ("Ticket", [{"seat": "A1"}, {"seat": "A2"}])),
+                ("link", ("Person", [person_id], "has", "Ticket", ["2"])),
+                ("link_many", ("Ticket", [("2", showing_id), ("3", showing_id)], "for", "Showing")),
+            ])
+            self.assertEqual(ticket_ids, ["2", "3"])
+            self.assertEqual(self.client.get("Showing", None, ["id", "date"]), [[showing_id, datetime(2000, 1, 1)]])
+            self.assertEqual(self.client.find("Showing", {"date": slice(datetime(2000, 1, 1), None)}), [showing_id])
+            self.assertEqual(self.client.path("Person->has:Ticket->for:Showing", [person_id]), [showing_id])
+            self.assertEqual(sorted(self.client.traverse("Showing", [showing_id], "<-", "for", "Ticket")), ticket_ids)
+
+            # pipelined requests are answered in order
+            answers = self.client.pipeline([[("traverse", ("Ticket", [ticket_id], "->", "for", "Showing"))] for ticket_id in ticket_ids * 50])
+            self.assertEqual(answers, [[[showing_id]]] * 100)
+            self.assertEqual(self.db.get("Person", None, ["name"]), [["Bob"]])
+
+
+    def test_errors(self):
+        self.start_server()
+        person_id = self.client.create("Person", [{"name": "Bob"}])[0]
+
+        # ops after a failed one still run, unless the batch is atomic
+        with self.assertRaises(AssertionError):
+            self.client.batch([("link", ("Person", [person_id], "has", "Ticket", ["10"])), ("create", ("Ticket", [{"seat": "A1"}]))])
+        self.assertEqual(self.db.get("Ticket", None, ["seat"]), [["A1"]])
+        with self.assertRaises(AssertionError):
+            self.client.batch([("create", ("Ticket", [{"seat": "A2"}])), ("link", ("Person", [person_id], "has", "Ticket", ["10"]))], atomic=True)
+        self.assertEqual(self.db.get("Ticket", None, ["seat"]), [["A1"]])
+
+        # only the listed ops can be called, and requests cannot carry arbitrary classes
+        with self.assertRaises(PermissionError):
+            self.client.batch([("save", ("/tmp", "db"))])
+        with self.assertRaises(AttributeError):
+            self.client.save
+        with self.assertRaises(ConnectionError):
+            self.client.create("Person", [{"name": Client}])
+
+        # the pool survives a broken connection, and serves several threads
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.client.get("Person", [person_id], ["name"]))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[["Bob"]]] * 8)
+
+
+class TestRequestChecks(unittest.TestCase):
+
+    def test_checks_survive_optimize(self):
+        # python -O strips asserts, the allow-lists of requests must still hold
+        script = "\n".join([
+            "import os, pickle",
+            "from pysgdb import DB, _FrameUnpickler, _run_ops",
+            "class Payload:",
+            "    def __reduce__(self):",
+            "        return (os.getpid, ())",
+            "try:",
+            "    _FrameUnpickler(pickle.dumps(Payload()), set()).load()",
+            "    print('loaded')",
+            "except pickle.UnpicklingError:",
+            "    print('refused')",
+            "db = DB()",
+            "db.migrate({'nodes': {}, 'links': set()})",
+            "print(_run_ops(db, False, [('save', ('/nonexistent', 'db'))])[0][1][0])",
+        ])
+        output = subprocess.run([sys.executable, "-O", "-c", script], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        self.assertEqual(output.split(), ["refused", "PermissionError"])
+
+
+class TestColumnarStorage(unittest.TestCase):
+
+    def make_new_db(self):
+        self.db = DB(storage="columnar")
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Showing": {"date": "datetime", "theater": "str"},
+                "Seat": {"row": "int", "price": "float", "vip": "bool"}
+            },
+            "links": {
+                ("Person", "booked", "Seat"),
+                ("Seat", "for", "Showing")
+            }
+        })
+
+
+    def test_create_and_get(self):
+        self.make_new_db()
+        seat_ids = self.db.create("Seat", [
+            {"row": 1, "price": 9.5, "vip": False},
+            {"row": 2, "price": 12.0, "vip": True}
+        ])
+        self.assertEqual(self.db.get("Seat", seat_ids, ["row", "price", "vip"]), [[1, 9.5, False], [2, 12.0, True]])
+        self.assertEqual(self.db.get("Seat", None, ["id", "vip"]), [[seat_ids[0], False], [seat_ids[1], True]])
+        self.assertEqual(self.db.get_columns("Seat", None, ["id", "row", "vip"]), [seat_ids, [1, 2], [False, True]])
+        self.assertEqual(self.db.get_columns("Seat", [seat_ids[1]], ["price"]), [[12.0]])
+
+        with self.assertRaises(AssertionError):
+            self.db.get("Seat", ["100"], ["row"])
+
+
+    def test_ints_outside_int64(self):
+        self.make_new_db()
+        seat_ids = self.db.create("Seat", [{"row": 2, "price": 9.5, "vip": False}, {"row": 2**64, "price": 9.5, "vip": True}])
+        seat_ids += self.db.create("Seat", [{"row": 9, "price": 1.0, "vip": False}])
+        self.assertEqual(self.db.get("Seat", seat_ids, ["row", "price", "vip"]), [[2, 9.5, False], [2**64, 9.5, True], [9, 1.0, False]])
+        store = self.db.db["nodes"]["Seat"]
+        self.assertEqual({len(column) for column in store.columns.values()}, {store.size})
+
+        # a refused batch writes nothing and hands out no ids
+        before = deepcopy(self.db.db)
+        with self.assertRaises(TypeError):
+            self.db.create("Seat", [{"row": 3, "price": 1.0, "vip": False}, {"row": 4, "price": "free", "vip": False}], trusted=True)
+        self.assertEqual(self.db.db, before)
+
+        # also when the rows go to freed slots
+        self.db.delete("Seat", seat_ids[:2])
+        free, columns = list(store.free), {name: list(column) for name, column in store.columns.items()}
+        with self.assertRaises(TypeError):
+            self.db.create("Seat", [{"row": 5, "price": "free", "vip": False}], trusted=True)
+        self.assertEqual((store.free, {name: list(column) for name, column in store.columns.items()}), (free, columns))
+        with self.assertRaises(TypeError):
+            self.db.create("Seat", [{"row": 5, "price": 1.0, "vip": False}, {"row": 6, "price": "free", "vip": False}], trusted=True)
+        self.assertEqual(sorted(store.free), sorted(free))
+        self.assertEqual(store.size, len(columns["row"]))
+        self.assertEqual(dict(store.items()), {seat_ids[2]: {"row": 9, "price": 1.0, "vip": False}})
+
+
+    def test_delete_reuses_slots(self):
+        self.make_new_db()
+        person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}, {"name": "Eve"}])
+        seat_id = self.db.create("Seat", [{"row": 1, "price": 9.5, "vip": False}])[0]
+        self.db.link("Person", [person_ids[1]], "booked", "Seat", [seat_id])
+
+        self.db.delete("Person", [person_ids[1]])
+        store = self.db.db["nodes"]["Person"]
+        self.assertEqual(store.free, [1])
+        self.assertNotIn(person_ids[1], store)
+        self.assertEqual(self.db.traverse("Seat", [seat_id], "<-", "booked", "Person"), [])
+
+        # the freed slot is taken by the next node, the other rows stay where they are
+        new_id = self.db.create("Person", [{"name": "Mallory"}])[0]
+        self.assertEqual(store.slots, {person_ids[0]: 0, person_ids[2]: 2, new_id: 1})
+        self.assertEqual(self.db.get("Person", None, ["name"]), [["Bob"], ["Eve"], ["Mallory"]])
+
+
+    def test_save_and_load_converts_storage(self):
+        self.make_new_db()
+        self.db.create("Person", [{"name": "Bob"}])
+        self.db.create("Showing", [{"date": datetime(2000, 1, 1), "theater": "Theater 5"}])
+
+        folder = "."
+        db_filename = "test_columnar_save_and_load_db"
+        self.db.save(folder, db_filename)
+        before = self.db.get("Showing", None, ["id", "date", "theater"])
+
+        self.db = DB()
+        self.db.load(folder, db_filename)
+        self.assertEqual(self.db.get("Showing", None, ["id", "date", "theater"]), before)
+
+        # loading into a DB asking for another storage mode converts the node stores
+        self.db = DB(storage="dict")
+        self.db.load(folder, db_filename)
+        os.remove(os.path.join(folder, db_filename))
+        self.assertEqual(type(self.db.db["nodes"]["Showing"]), dict)
+        self.assertEqual(self.db.get("Showing", None, ["id", "date", "theater"]), before)
+
+
+class TestRecordStorage(unittest.TestCase):
+
+    def make_new_db(self, storage="record"):
+        self.db = DB(storage=storage)
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Seat": {"row": "int", "price": "float", "vip": "bool", "section": "str"}
+            },
+            "links": {
+                ("Person", "booked", "Seat")
+            }
+        })
+        self.person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        self.seat_ids = self.db.create("Seat", [{"section": f"S{i % 3}", "vip": i == 0, "price": 9.5 + i, "row": i} for i in range(100)])
+        self.db.link("Person", self.person_ids[:1], "booked", "Seat", self.seat_ids[:10])
+
+
+    def test_create_and_get(self):
+        self.make_new_db()
+        store = self.db.db["nodes"]["Seat"]
+        self.assertEqual(store.rows[self.seat_ids[0]], (0, 9.5, True, "S0"))
+        self.assertEqual(store[self.seat_ids[1]], {"row": 1, "price": 10.5, "vip": False, "section": "S1"})
+        self.assertEqual(self.db.get("Seat", self.seat_ids[:2], ["id", "section", "row"]), [[self.seat_ids[0], "S0", 0], [self.seat_ids[1], "S1", 1]])
+        self.assertEqual(self.db.get_columns("Seat", None, ["price"]), [[9.5 + i for i in range(100)]])
+        self.assertEqual(self.db.find("Seat", {"section": "S2", "row": slice(0, 10)}), self.seat_ids[2:10:3])
+
+        self.db.delete("Seat", self.seat_ids[:5])
+        self.assertEqual(len(store), 95)
+        self.assertEqual(sorted(self.db.traverse("Person", self.person_ids[:1], "->", "booked", "Seat")), sorted(self.seat_ids[5:10]))
+        with self.assertRaises(AssertionError):
+            self.db.get("Seat", self.seat_ids[:1], ["row"])
+
+
+    def test_save_and_load_converts_storage(self):
+        self.make_new_db()
+        before = self.db.get("Seat", None, ["id", "row", "price", "vip", "section"])
+        with tempfile.TemporaryDirectory() as folder:
+            self.db.save(folder, "db")
+            for storage, store_type in (("record", type(self.db.db["nodes"]["Seat"])), ("dict", dict)):
+                loaded = DB(storage=storage)
+                loaded.load(folder, "db")
+                self.assertEqual(type(loaded.db["nodes"]["Seat"]), store_type)
+                self.assertEqual(loaded.get("Seat", None, ["id", "row", "price", "vip", "section"]), before)
+
+
+    def test_memory_report(self):
+        reports = {}
+        for storage in ("dict", "columnar", "record"):
+            self.make_new_db(storage)
+            report = self.db.memory_report()
+            self.assertEqual(set(report["nodes"]), {"Person", "Seat"})
+            self.assertEqual(set(report["->"]), {"booked"})
+            self.assertEqual(report["total"], report["ids"] + sum(report["nodes"].values()) + sum(report["->"].values()) + sum(report["<-"].values()))
+            reports[storage] = report
+
+        # the same ids and links, the node stores differ
+        self.assertEqual(reports["dict"]["ids"], reports["record"]["ids"])
+        self.assertEqual(reports["dict"]["->"], reports["record"]["->"])
+        self.assertLess(reports["record"]["nodes"]["Seat"], reports["dict"]["nodes"]["Seat"] * 0.6)
+        self.db.freeze()
+        self.assertGreater(self.db.memory_report()["frozen"], 0)
+
+
+class TestImport(unittest.TestCase):
+
+    def make_new_db(self, ids=None):
+        self.db = DB(ids=ids)
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Showing": {"date": "datetime", "theater": "str"},
+                "Seat": {"row": "int", "price": "float", "vip": "bool"}
+            },
+            "links": {
+                ("Person", "booked", "Seat"),
+                ("Seat", "for", "Showing")
+            }
+        })
+
+
+    def write(self, filename: str, text: str) -> str:
+        path = os.path.join(self.folder, filename)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+
+    def test_import(self):
+        with tempfile.TemporaryDirectory() as self.folder:
+            persons = self.write("persons.csv", "key,name\n" + "".join(f"p{i},Person {i}\n" for i in range(25)))
+            seats = self.write("seats.jsonl", "".join(f'{{"id": {i}, "row": {i // 10}, "price": "{9.5 + i}", "vip": {str(i < 3).lower()}}}\n' for i in range(30)))
+            showings = self.write("showings.csv", "id,date,theater\n1,2000-01-01 20:00:00,Theater 5\n2,2000-01-02T20:00:00,Theater 2\n")
+            booked = self.write("booked.csv", "source,target\n" + "".join(f"p{i},{i}\n" for i in range(25)))
+            seat_for = self.write("for.jsonl", "".join(f'{{"seat": {i}, "showing": "{1 + i % 2}"}}\n' for i in range(30)))
+
+            for ids, spill in (("str", False), ("int", True)):
+                self.make_new_db(ids)
+                key_map = KeyMap(os.path.join(self.folder, "keys") if spill else None)
+                self.assertEqual(self.db.import_nodes("Person", persons, key_map, key="key", chunk_size=10), 25)
+                self.assertEqual(self.db.import_nodes("Seat", seats, key_map, chunk_size=7), 30)
+                self.assertEqual(self.db.import_nodes("Showing", showings, key_map), 2)
+                self.assertEqual(self.db.import_links(booked, "Person", "booked", "Seat", key_map, chunk_size=10), 25)
+                self.assertEqual(self.db.import_links(seat_for, "Seat", "for", "Showing", key_map, node_1_key="seat", node_2_key="showing"), 30)
+                self.assertEqual(len(key_map), 57)
+
+                person_id = self.db._as_ids(key_map.ids("Person", ["p3"]))[0]
+                self.assertEqual(self.db.get("Person", [person_id], ["name"]), [["Person 3"]])
+                seat_ids = self.db.traverse("Person", [person_id], "->", "booked", "Seat")
+                self.assertEqual(self.db.get("Seat", seat_ids, ["row", "price", "vip"]), [[0, 12.5, False]])
+                showing_id = self.db.traverse("Seat", seat_ids, "->", "for", "Showing")[0]
+                self.assertEqual(self.db.get("Showing", [showing_id], ["date", "theater"]), [[datetime(2000, 1, 2, 20), "Theater 2"]])
+                self.assertEqual(self.db.find("Seat", {"vip": True}), self.db._as_ids(key_map.ids("Seat", [0, 1, 2])))
+
+                # errors are raised before anything of the failing chunk is written
+                bad_seats = self.write("bad.csv", "id,row,price,vip\n100,1,9.5,True\n101,one,9.5,False\n")
+                with self.assertRaises(AssertionError):
+                    self.db.import_nodes("Seat", bad_seats, key_map)
+                self.assertEqual(len(self.db.db["nodes"]["Seat"]), 30)
+                # JSON values of the wrong type are refused, not coerced
+                for bad_seat in ['{"id": 100, "row": true, "price": 9.5, "vip": true}', '{"id": 100, "row": 3.9, "price": 9.5, "vip": true}',
+                                 '{"id": 100, "row": 1, "price": null, "vip": true}', '{"id": 100, "row": 1, "price": 9.5, "vip": ["a"]}']:
+                    with self.assertRaises(AssertionError):
+                        self.db.import_nodes("Seat", self.write("bad.jsonl", bad_seat + "\n"), key_map)
+                self.assertEqual(len(self.db.db["nodes"]["Seat"]), 30)
+                self.assertEqual(self.db.import_nodes("Seat", self.write("seat.jsonl", '{"id": 100, "row": 1, "price": 9, "vip": true}\n'), key_map), 1)
+                self.assertEqual(self.db.get("Seat", self.db._as_ids(key_map.ids("Seat", [100])), ["price"]), [[9.0]])
+                with self.assertRaises(AssertionError):
+                    self.db.import_links(self.write("bad.jsonl", '{"source": "p1", "target": 999}\n'), "Person", "booked", "Seat", key_map)
+                with self.assertRaises(AssertionError):
+                    self.db.import_nodes("Person", self.write("persons.txt", ""), key_map)
+                key_map.close()
+
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as self.folder:
+            for extension in (".csv", ".jsonl"):
+                self.make_new_db("int")
+                person_ids = self.db.create("Person", [{"name": f"Person {i}"} for i in range(20)])
+                seat_ids = self.db.create("Seat", [{"row": i, "price": 9.5, "vip": i % 2 == 0} for i in range(30)])
+                showing_ids = self.db.create("Showing", [{"date": datetime(2000, 1, 1, 20), "theater": "Theater 5"}])
+                self.db.link_many("Person", person_ids, "booked", "Seat", seat_ids[:20])
+                self.db.link_many("Seat", seat_ids, "for", "Showing", showing_ids * 30)
+
+                files = {node_name: os.path.join(self.folder, node_name + extension) for node_name in ["Person", "Seat", "Showing", "booked", "for"]}
+                self.assertEqual(self.db.export_nodes("Person", files["Person"], chunk_size=7), 20)
+                self.assertEqual(self.db.export_nodes("Seat", files["Seat"]), 30)
+                self.assertEqual(self.db.export_nodes("Showing", files["Showing"]), 1)
+                self.assertEqual(self.db.export_links(files["booked"], "Person", "booked", "Seat"), 20)
+                self.assertEqual(self.db.export_links(files["for"], "Seat", "for", "Showing"), 30)
+
+                # importing the export rebuilds the same graph under new ids
+                copy = DB()
+                copy.migrate(self.db.db["schema"])
+                key_map = KeyMap()
+                for node_name in ["Person", "Seat", "Showing"]:
+                    copy.import_nodes(node_name, files[node_name], key_map)
+                copy.import_links(files["booked"], "Person", "booked", "Seat", key_map)
+                copy.import_links(files["for"], "Seat", "for", "Showing", key_map)
+                for node_name, attributes in self.db.db["schema"]["nodes"].items():
+                    self.assertEqual(copy.get(node_name, key_map.ids(node_name, self.db.db["nodes"][node_name]), list(attributes)), self.db.get(node_name, None, list(attributes)))
+                copied_ids = key_map.ids("Person", person_ids)
+                self.assertEqual(sorted(key_map.ids("Seat", self.db.traverse("Person", person_ids, "->", "booked", "Seat"))), sorted(copy.traverse("Person", copied_ids, "->", "booked", "Seat")))
+
+
+class TestIntIds(unittest.TestCase):
+
+    def make_new_db(self, ids="int"):
+        self.db = DB(ids=ids)
+        self.db.migrate({
+            "nodes": {
+                "Person": {"name": "str"},
+                "Ticket": {"seat": "str"}
+            },
+            "links": {
+                ("Person", "has", "Ticket")
+            }
+        })
+
+
+    def test_int_ids(self):
+        self.make_new_db()
+        person_ids = self.db.create("Person", [{"name": "Bob"}, {"name": "Alice"}])
+        ticket_ids = self.db.create("Ticket", [{"seat": "A1"}, {"seat": "A2"}, {"seat": "A3"}])
+        self.assertEqual(person_ids, [0, 1])
+        self.assertEqual(ticket_ids, [2, 3, 4])
+        self.assertEqual(self.db.db["current_id"], 5)
+
+        self.db.link("Person", [0], "has", "Ticket", [2, 3])
+        self.assertEqual(self.db.db["->"]["has"]["Person"][0]["Ticket"], {2, 3})
+        self.assertEqual(sorted(self.db.traverse("Person", [0], "->", "has", "Ticket")), [2, 3])
+
+        # string ids are translated
+        self.assertEqual(self.db.traverse("Ticket", ["2"], "<-", "has", "Person"), [0])
+        self.assertEqual(self.db.get("Person", ["1"], ["id", "name"]), [[1, "Alice"]])
+        with self.assertRaises(AssertionError):
+            self.db.get("Person", ["10"], ["name"])
+        with self.assertRaises(AssertionError):
+            self.db.get("Person", ["abc"], ["name"])
+
+
+    def test_load_string_id_database(self):
+        self.make_new_db(ids=None)
+        person_id = self.db.create("Person", [{"name": "Bob"}])[0]
+        ticket_id = self.db.create("Ticket", [{"seat": "A1"}])[0]
+        self.db.link("Person", [person_id], "has", "Ticket", [ticket_id])
+
+        folder = "."
+        db_filename = "test_load_string_id_database"
+        self.db.save(folder, db_filename)
+
+        self.db = DB(ids="int")
+        self.db.load(folder, db_filename)
+        os.remove(os.path.join(folder, db_filename))
+
+        self.assertEqual(self.db.get("Person", None, ["id", "name"]), [[0, "Bob"]])
+        self.assertEqual(self.db.traverse("Person", [person_id], "->", "has", "Ticket"), [1])
+        self.assertEqual(self.db.db["<-"]["has"]["Ticket"][1]["Person"], {0})
+        self.assertEqual(self.db.create("Person", [{"name": "Alice"}]), [2])
+
 
 class TestUniqueElements(unittest.TestCase):
 